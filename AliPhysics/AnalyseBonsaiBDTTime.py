@@ -1,61 +1,125 @@
 #!/usr/bin/python3
 
 '''
-Script for plotting results of BDT application benchmark 
+Script for plotting results of BDT application benchmark
 '''
 
 import sys
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
+sys.path.append('..')
+from pyutils.InferenceBenchmark import LoadReport, replayHistEdges
+from pyutils.BenchmarkStore import LoadStore, ListRuns
+
+parser = argparse.ArgumentParser(description='Arguments to pass')
+parser.add_argument('--store', default='outputs/timetests/store',
+                    help='directory of the benchmark store')
+parser.add_argument('--run', default=None,
+                    help='identifier of the run to be plotted (the last one if not set)')
+parser.add_argument('--report', default=None,
+                    help='report file of TestBonsaiBDT.py to be plotted instead of a run of the store')
+parser.add_argument('--threads', type=int, default=1,
+                    help='number of threads of the results to be plotted')
+args = parser.parse_args()
 
-xgbVer = '1.3.3'
-batchSizes = [100, 1000, 10000]
-featuresForTrain = ['fd0MinDau', 'fDecayLength', 'fImpParProd', 'fCosP']
 colors = ['forestgreen', 'lightseagreen', 'teal', 'steelblue', 'navy']
 
-dfBatchSizes, figTime, timeVsBatchSize = {}, {}, {}
-for iDf, batchSize in enumerate(batchSizes):
-    dfBatchSizes[batchSize] = pd.read_parquet(f'outputs/timetests/timeBench_XGBoost_v{xgbVer}_batchSize{batchSize}'
-                                              f'_features_{"-".join(featuresForTrain)}.parquet.gzip')
-
-    nBins, clfNames = [], []
-    for name in dfBatchSizes[batchSize].columns:
-        if 'BBDT' in name:
-            clfNames.append(name)
-            nBins.append(float(name.strip('BBDT')))
-        if name != 'n_estimators':
-            if name not in timeVsBatchSize:
-                timeVsBatchSize[name] = []
-            timeVsBatchSize[name].append(dfBatchSizes[batchSize].query('n_estimators == 1500')[name].to_numpy()[0])
-
-    figTime[batchSize] = plt.figure(figsize=(15, 8))
+if args.report is not None:
+    dfBench = LoadReport(args.report)
+else:
+    dfStore = LoadStore(args.store)
+    if dfStore.empty:
+        print(f'\033[91mERROR: no runs in {args.store}\033[0m')
+        sys.exit(1)
+    runId = args.run if args.run is not None else ListRuns(dfStore)['run_id'].iloc[-1]
+    dfBench = dfStore.query('run_id == @runId')
+    print(f'\033[32mPlotting run {runId}\033[0m')
+dfBench = dfBench.query(f'n_threads == {args.threads}')
+# event-by-event (replay) results are plotted separately from the batch ones
+if 'mode' in dfBench.columns:
+    dfReplay = dfBench.query('mode == "replay"')
+    dfBench = dfBench.query('mode != "replay"')
+else:
+    dfReplay = dfBench.iloc[:0]
+batchSizes = sorted(dfBench['batch_size'].unique())
+clfNames = [name for name in dfBench['backend'].unique() if 'BBDT' in name]
+nBins = [float(name.strip('BBDT')) for name in clfNames]
+labels = {'XGBoost': 'xgboost', 'Treelite': 'treelite', 'ONNX': 'onnxruntime', 'Hummingbird': 'hummingbird',
+          'NumPy': 'numpy'}
+labels.update({name: f'BBDT nbins = {nBin}' for name, nBin in zip(clfNames, nBins)})
+colorsBackend = {'XGBoost': 'darkred', 'Treelite': 'chocolate', 'ONNX': 'darkorchid',
+                 'Hummingbird': 'goldenrod', 'NumPy': 'slategray'}
+colorsBackend.update({name: colors[iBin % len(colors)] for iBin, name in enumerate(clfNames)})
+
+
+def PlotTime(dfBackend, varX, name):
+    '''
+    Helper method to plot the median time per candidate with the interquartile range as band
+    '''
+    dfBackend = dfBackend.sort_values(varX)
+    time = dfBackend['time_per_cand'].to_numpy()
+    timeQ25 = dfBackend['q25_ns'].to_numpy() * 1.e-9 / dfBackend['batch_size'].to_numpy()
+    timeQ75 = dfBackend['q75_ns'].to_numpy() * 1.e-9 / dfBackend['batch_size'].to_numpy()
+    plt.plot(dfBackend[varX].to_numpy(), time, label=labels.get(name, name), color=colorsBackend.get(name))
+    plt.fill_between(dfBackend[varX].to_numpy(), timeQ25, timeQ75, alpha=0.3, color=colorsBackend.get(name))
+
+
+for batchSize in batchSizes:
+    dfBatchSize = dfBench.query(f'batch_size == {batchSize}')
+    figTime = plt.figure(figsize=(15, 8))
     plt.grid(True)
-    plt.plot(dfBatchSizes[batchSize]['n_estimators'].to_numpy(), dfBatchSizes[batchSize]['XGBoost'].to_numpy(),
-             label='xgboost', color='darkred')
-    plt.plot(dfBatchSizes[batchSize]['n_estimators'].to_numpy(), dfBatchSizes[batchSize]['Treelite'].to_numpy(),
-             label='treelite', color='chocolate')
-    for iBin, (nBin, name) in enumerate(zip(nBins, clfNames)):
-        plt.plot(dfBatchSizes[batchSize]['n_estimators'].to_numpy(), dfBatchSizes[batchSize][name].to_numpy(),
-                 label=f'BBDT nbins = {nBin}', color=colors[iBin])
+    for name, dfBackend in dfBatchSize.groupby('backend'):
+        PlotTime(dfBackend, 'n_estimators', name)
     plt.yscale('log')
     plt.legend(loc='best')
-    plt.ylabel('time / candidate', size=15)
+    plt.ylabel('time / candidate (s)', size=15)
     plt.xlabel('n_estimators', size=15)
-    figTime[batchSize].savefig(f'plots/Time_benchmark_batchSize{batchSize}.pdf')
+    figTime.savefig(f'plots/Time_benchmark_batchSize{batchSize}.pdf')
     plt.close('all')
 
+# time vs batch size for the largest model
+dfMaxEstim = dfBench.query(f'n_estimators == {dfBench["n_estimators"].max()}')
 figTimeVsBatchSize = plt.figure(figsize=(15, 8))
 plt.grid(True)
-plt.plot(batchSizes, timeVsBatchSize['XGBoost'], label='xgboost', color='darkred')
-plt.plot(batchSizes, timeVsBatchSize['Treelite'], label='treelite', color='chocolate')
-for iBin, (nBin, name) in enumerate(zip(nBins, clfNames)):
-    plt.plot(batchSizes, timeVsBatchSize[name], label=f'BBDT nbins = {nBin}', color=colors[iBin])
+for name, dfBackend in dfMaxEstim.groupby('backend'):
+    PlotTime(dfBackend, 'batch_size', name)
 plt.yscale('log')
 plt.xscale('log')
 plt.legend(loc='best')
-plt.ylabel('time / candidate', size=15)
+plt.ylabel('time / candidate (s)', size=15)
 plt.xlabel('batch size', size=15)
 figTimeVsBatchSize.savefig(f'plots/Time_benchmark_vs_batchSize.pdf')
 plt.close('all')
 
+# per-call latency of the event-by-event scoring: percentiles vs n_estimators and distributions
+if not dfReplay.empty:
+    figLatency, axesLatency = plt.subplots(1, 3, figsize=(21, 7), sharey=True)
+    for axis, quantile in zip(axesLatency, ['median', 'p95', 'p99']):
+        for name, dfBackend in dfReplay.groupby('backend'):
+            dfBackend = dfBackend.sort_values('n_estimators')
+            axis.plot(dfBackend['n_estimators'].to_numpy(), dfBackend[f'{quantile}_ns'].to_numpy() * 1.e-3,
+                      label=labels.get(name, name), color=colorsBackend.get(name))
+        axis.set_yscale('log')
+        axis.grid(True)
+        axis.set_title(f'{quantile} latency per event', size=15)
+        axis.set_xlabel('n_estimators', size=15)
+    axesLatency[0].set_ylabel('latency per call (us)', size=15)
+    axesLatency[0].legend(loc='best')
+    figLatency.savefig('plots/Latency_replay_vs_n_estimators.pdf')
+
+    dfReplayMaxEstim = dfReplay.query(f'n_estimators == {dfReplay["n_estimators"].max()}')
+    figLatencyDistr = plt.figure(figsize=(15, 8))
+    for name, dfBackend in dfReplayMaxEstim.groupby('backend'):
+        plt.stairs(dfBackend['hist_counts'].iloc[0], replayHistEdges * 1.e-3,
+                   label=f'{labels.get(name, name)}, {dfBackend["cycles_per_cand"].iloc[0]:.0f} cycles / cand',
+                   color=colorsBackend.get(name))
+    plt.xscale('log')
+    plt.yscale('log')
+    plt.legend(loc='best')
+    plt.ylabel('calls', size=15)
+    plt.xlabel('latency per call (us)', size=15)
+    figLatencyDistr.savefig('plots/Latency_replay_distribution.pdf')
+    plt.close('all')
+
 plt.show()
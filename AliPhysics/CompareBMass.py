@@ -1,62 +1,105 @@
-import uproot
-from ROOT import TH1F, TH2F, TCanvas, kRainBow
-from StyleFormatter import SetGlobalStyle, SetObjectStyle
-
-SetGlobalStyle(padbottommargin=0.14, padleftmargin=0.15, palette=kRainBow, titleoffsety=1.5)
-
-tree = uproot.open('AnalysisResults_0000.root:PWGHF_D2H_CharmTrigger_GenPurpose/fRecoTree')
-dfBplus = tree.arrays(filter_name=['Beauty3Prong/Beauty3Prong.fInvMassBplustoD0pi',
-                                   'Beauty3Prong/Beauty3Prong.fInvMassNoPropBplustoD0pi',
-                                   'Beauty3Prong/Beauty3Prong.fDecayLength'], library='pd')
-dfBzero = tree.arrays(filter_name=['Beauty4Prong/Beauty4Prong.fInvMassB0toDminuspi',
-                                   'Beauty4Prong/Beauty4Prong.fInvMassNoPropB0toDminuspi',
-                                   'Beauty4Prong/Beauty4Prong.fDecayLength'], library='pd')
-
-dfBplus['delta'] = dfBplus['Beauty3Prong.fInvMassNoPropBplustoD0pi'] - dfBplus['Beauty3Prong.fInvMassBplustoD0pi']
-dfBzero['delta'] = dfBzero['Beauty4Prong.fInvMassNoPropB0toDminuspi'] - dfBzero['Beauty4Prong.fInvMassB0toDminuspi']
-
-hDeltaMassBplus = TH1F('hDeltaMassBplus', ';#it{M}(#bar{D}^{0}#pi^{+}, no vtx)-#it{M}(#bar{D}^{0}#pi^{+}, vtx) (MeV/#it{c}^{2});entries',1000, -1., 1.)
-SetObjectStyle(hDeltaMassBplus, fillstyle=0, markersize=0.5)
-hDeltaMassBplusVsDecL = TH2F('hDeltaMassBplusVsDecL',
-                             ';decay length (cm);#it{M}(#bar{D}^{0}#pi^{+}, no vtx)-#it{M}(#bar{D}^{0}#pi^{+}, vtx) (MeV/#it{c}^{2});',
-                             100, 0., 1., 1000, -1., 1.)
-
-hDeltaMassBzero = TH1F('hDeltaMassBzero', ';#it{M}(D^{-}#pi^{+}, no vtx)-#it{M}(D^{-}#pi^{+}, vtx) (MeV/#it{c}^{2});entries',1000, -1., 1.)
-SetObjectStyle(hDeltaMassBzero, fillstyle=0, markersize=0.5)
-hDeltaMassBzeroVsDecL = TH2F('hDeltaMassBzeroVsDecL',
-                             ';decay length (cm);#it{M}(D^{-}#pi^{+}, no vtx)-#it{M}(D^{-}#pi^{+}, vtx) (MeV/#it{c}^{2});',
-                             100, 0., 1., 1000, -1., 1.)
-
-for delta, decL in zip(dfBplus['delta'].to_numpy(), dfBplus['Beauty3Prong.fDecayLength'].to_numpy()):
-    hDeltaMassBplus.Fill(delta*1000)
-    hDeltaMassBplusVsDecL.Fill(decL, delta*1000)
-
-for delta, decL, mass in zip(dfBzero['delta'].to_numpy(), dfBzero['Beauty4Prong.fDecayLength'].to_numpy(),
-                             dfBzero['Beauty4Prong.fInvMassB0toDminuspi'].to_numpy()):
-    if mass > 1000 or mass < 1:
-        continue
-    hDeltaMassBzero.Fill(delta*1000)
-    hDeltaMassBzeroVsDecL.Fill(decL, delta*1000)
-
-cDeltaMassBplus = TCanvas('cDeltaMassBplus', '', 1000, 500)
-cDeltaMassBplus.Divide(2, 1)
-cDeltaMassBplus.cd(1).SetLogy()
-hDeltaMassBplus.Draw('e')
-cDeltaMassBplus.cd(2).SetLogz()
-hDeltaMassBplusVsDecL.Draw('colz')
-cDeltaMassBplus.Modified()
-cDeltaMassBplus.Update()
-
-cDeltaMassBzero = TCanvas('cDeltaMassBzero', '', 1000, 500)
-cDeltaMassBzero.Divide(2, 1)
-cDeltaMassBzero.cd(1).SetLogy()
-hDeltaMassBzero.Draw('e')
-cDeltaMassBzero.cd(2).SetLogz()
-hDeltaMassBzeroVsDecL.Draw('colz')
-cDeltaMassBzero.Modified()
-cDeltaMassBzero.Update()
-
-cDeltaMassBplus.SaveAs('Bplus_mass_w_wo_vtx_propagation.pdf')
-cDeltaMassBzero.SaveAs('Bzero_mass_w_wo_vtx_propagation.pdf')
-
-input()
\ No newline at end of file
+'''
+Script for the comparison of the B-meson invariant masses with and without the propagation to the vertex
+run: python CompareBMass.py AnalysisResults_0000.root [AnalysisResults_0001.root ...] [--jobs 4] [--stepsize "100 MB"]
+the input files are read in chunks and in parallel, the histograms are filled in bulk from numpy arrays
+and converted to ROOT only for drawing and saving
+'''
+
+import sys
+import argparse
+from functools import partial
+from ROOT import TCanvas, kRainBow  # pylint: disable=import-error,no-name-in-module
+sys.path.append('..')
+from pyutils.StyleFormatter import SetGlobalStyle, SetObjectStyle
+from pyutils.HistUtils import BinnedHist, IterateTreeChunks, FillHistsFromFiles
+
+treeName = 'PWGHF_D2H_CharmTrigger_GenPurpose/fRecoTree'
+branchesBplus = ['Beauty3Prong/Beauty3Prong.fInvMassBplustoD0pi',
+                 'Beauty3Prong/Beauty3Prong.fInvMassNoPropBplustoD0pi',
+                 'Beauty3Prong/Beauty3Prong.fDecayLength']
+branchesBzero = ['Beauty4Prong/Beauty4Prong.fInvMassB0toDminuspi',
+                 'Beauty4Prong/Beauty4Prong.fInvMassNoPropB0toDminuspi',
+                 'Beauty4Prong/Beauty4Prong.fDecayLength']
+
+
+def FillDeltaMass(fileName, hists, stepSize='100 MB'):
+    '''
+    Method to fill the histograms of the mass difference with the candidates of one file
+
+    Arguments
+    ----------
+    - name of the input file
+    - dictionary with the histograms to be filled
+    - size of the chunks read at once
+    '''
+    for dfBplus in IterateTreeChunks(fileName, treeName, branchesBplus, stepSize, library='pd'):
+        delta = (dfBplus['Beauty3Prong.fInvMassNoPropBplustoD0pi'].to_numpy()
+                 - dfBplus['Beauty3Prong.fInvMassBplustoD0pi'].to_numpy()) * 1000
+        hists['hDeltaMassBplus'].Fill(delta)
+        hists['hDeltaMassBplusVsDecL'].Fill(dfBplus['Beauty3Prong.fDecayLength'].to_numpy(), delta)
+
+    for dfBzero in IterateTreeChunks(fileName, treeName, branchesBzero, stepSize, library='pd'):
+        mass = dfBzero['Beauty4Prong.fInvMassB0toDminuspi'].to_numpy()
+        isGoodMass = (mass <= 1000) & (mass >= 1)
+        delta = (dfBzero['Beauty4Prong.fInvMassNoPropB0toDminuspi'].to_numpy()[isGoodMass]
+                 - mass[isGoodMass]) * 1000
+        hists['hDeltaMassBzero'].Fill(delta)
+        hists['hDeltaMassBzeroVsDecL'].Fill(dfBzero['Beauty4Prong.fDecayLength'].to_numpy()[isGoodMass], delta)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Arguments to pass')
+    parser.add_argument('inputFiles', metavar='text', nargs='*', default=['AnalysisResults_0000.root'],
+                        help='input AnalysisResults files')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='maximum number of files processed in parallel')
+    parser.add_argument('--stepsize', default='100 MB',
+                        help='size of the chunks read at once (number of entries or size)')
+    args = parser.parse_args()
+
+    SetGlobalStyle(padbottommargin=0.14, padleftmargin=0.15, palette=kRainBow, titleoffsety=1.5)
+
+    histsDeltaMass = {
+        'hDeltaMassBplus': BinnedHist('hDeltaMassBplus', ';#it{M}(#bar{D}^{0}#pi^{+}, no vtx)-#it{M}(#bar{D}^{0}#pi^{+}, vtx) (MeV/#it{c}^{2});entries',
+                                      [(1000, -1., 1.)]),
+        'hDeltaMassBplusVsDecL': BinnedHist('hDeltaMassBplusVsDecL',
+                                            ';decay length (cm);#it{M}(#bar{D}^{0}#pi^{+}, no vtx)-#it{M}(#bar{D}^{0}#pi^{+}, vtx) (MeV/#it{c}^{2});',
+                                            [(100, 0., 1.), (1000, -1., 1.)]),
+        'hDeltaMassBzero': BinnedHist('hDeltaMassBzero', ';#it{M}(D^{-}#pi^{+}, no vtx)-#it{M}(D^{-}#pi^{+}, vtx) (MeV/#it{c}^{2});entries',
+                                      [(1000, -1., 1.)]),
+        'hDeltaMassBzeroVsDecL': BinnedHist('hDeltaMassBzeroVsDecL',
+                                            ';decay length (cm);#it{M}(D^{-}#pi^{+}, no vtx)-#it{M}(D^{-}#pi^{+}, vtx) (MeV/#it{c}^{2});',
+                                            [(100, 0., 1.), (1000, -1., 1.)])}
+    histsDeltaMass = FillHistsFromFiles(args.inputFiles, partial(FillDeltaMass, stepSize=args.stepsize),
+                                        histsDeltaMass, args.jobs)
+
+    # conversion to ROOT only at the end, for styling and drawing
+    hDeltaMassBplus = histsDeltaMass['hDeltaMassBplus'].ToROOT('TH1F')
+    SetObjectStyle(hDeltaMassBplus, fillstyle=0, markersize=0.5)
+    hDeltaMassBplusVsDecL = histsDeltaMass['hDeltaMassBplusVsDecL'].ToROOT('TH2F')
+    hDeltaMassBzero = histsDeltaMass['hDeltaMassBzero'].ToROOT('TH1F')
+    SetObjectStyle(hDeltaMassBzero, fillstyle=0, markersize=0.5)
+    hDeltaMassBzeroVsDecL = histsDeltaMass['hDeltaMassBzeroVsDecL'].ToROOT('TH2F')
+
+    cDeltaMassBplus = TCanvas('cDeltaMassBplus', '', 1000, 500)
+    cDeltaMassBplus.Divide(2, 1)
+    cDeltaMassBplus.cd(1).SetLogy()
+    hDeltaMassBplus.Draw('e')
+    cDeltaMassBplus.cd(2).SetLogz()
+    hDeltaMassBplusVsDecL.Draw('colz')
+    cDeltaMassBplus.Modified()
+    cDeltaMassBplus.Update()
+
+    cDeltaMassBzero = TCanvas('cDeltaMassBzero', '', 1000, 500)
+    cDeltaMassBzero.Divide(2, 1)
+    cDeltaMassBzero.cd(1).SetLogy()
+    hDeltaMassBzero.Draw('e')
+    cDeltaMassBzero.cd(2).SetLogz()
+    hDeltaMassBzeroVsDecL.Draw('colz')
+    cDeltaMassBzero.Modified()
+    cDeltaMassBzero.Update()
+
+    cDeltaMassBplus.SaveAs('Bplus_mass_w_wo_vtx_propagation.pdf')
+    cDeltaMassBzero.SaveAs('Bzero_mass_w_wo_vtx_propagation.pdf')
+
+    input()
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+'''
+Script for the comparison of the runs of the BDT application benchmark saved in the benchmark store
+run: python CompareBenchmarkRuns.py [--store outputs/timetests/store] [--list]
+                                    [--base runId] [--new runId] [--alpha 0.01] [--minchange 0.05]
+by default the last run is compared with the previous one, the script exits with code 1 if
+significant regressions are found
+'''
+
+import sys
+import argparse
+sys.path.append('..')
+from pyutils.BenchmarkStore import LoadStore, ListRuns, CompareRuns
+
+parser = argparse.ArgumentParser(description='Arguments to pass')
+parser.add_argument('--store', default='outputs/timetests/store',
+                    help='directory of the benchmark store')
+parser.add_argument('--list', action='store_true', default=False,
+                    help='list the runs in the store')
+parser.add_argument('--base', default=None,
+                    help='identifier of the reference run (the second to last if not set)')
+parser.add_argument('--new', default=None,
+                    help='identifier of the new run (the last if not set)')
+parser.add_argument('--alpha', type=float, default=0.01,
+                    help='significance level of the Mann-Whitney U test')
+parser.add_argument('--minchange', type=float, default=0.05,
+                    help='minimum relative change of the median time to be flagged')
+args = parser.parse_args()
+
+dfStore = LoadStore(args.store)
+if dfStore.empty:
+    print(f'\033[91mERROR: no runs in {args.store}\033[0m')
+    sys.exit(1)
+dfRuns = ListRuns(dfStore)
+if args.list:
+    print(dfRuns.to_string(index=False))
+    sys.exit(0)
+
+if len(dfRuns) < 2 and (args.base is None or args.new is None):
+    print('\033[91mERROR: at least two runs are needed for the comparison\033[0m')
+    sys.exit(1)
+baseRun = args.base if args.base is not None else dfRuns['run_id'].iloc[-2]
+newRun = args.new if args.new is not None else dfRuns['run_id'].iloc[-1]
+for runId in (baseRun, newRun):
+    if runId not in dfRuns['run_id'].to_numpy():
+        print(f'\033[91mERROR: run {runId} not in {args.store}\033[0m')
+        sys.exit(1)
+
+# differences in the tags of the two runs (library versions, commit, config, host)
+dfTags = dfRuns.set_index('run_id').loc[[baseRun, newRun]].T
+dfTags.columns = ['base', 'new']
+dfTags = dfTags.fillna('-').astype(str)
+dfTags = dfTags[(dfTags['base'] != dfTags['new']) & (dfTags.index != 'timestamp')]
+if not dfTags.empty:
+    print(dfTags.to_string())
+
+dfComp = CompareRuns(dfStore, baseRun, newRun, alpha=args.alpha, minRelChange=args.minchange)
+print(dfComp.to_string(index=False))
+nRegressions = (dfComp['status'] == 'regression').sum()
+nImprovements = (dfComp['status'] == 'improvement').sum()
+if nRegressions > 0:
+    print(f'\033[91mERROR: {nRegressions} significant regressions ({nImprovements} improvements)\033[0m')
+    sys.exit(1)
+print(f'\033[32mNo significant regressions ({nImprovements} improvements)\033[0m')
@@ -1,11 +1,12 @@
 import sys
 import os
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import uproot
 import pandas as pd
 import yaml
 sys.path.append('..')
-from pyutils.DfUtils import FilterBitDf
+from pyutils.DfUtils import GetBitMasks, WriteDfChunkToParquet, CloseParquetWriters
 
 parser = argparse.ArgumentParser(description='Arguments')
 parser.add_argument('configFileName', metavar='text', default='config_skim_tree.yml')
@@ -25,162 +26,169 @@ massNames = {'Dzero': ['fInvMassD0', 'fInvMassD0bar'],
              'Lb': ['fInvMassLbtoLcpluspi']}
 fidAccBit = {'Dzero': 22, 'Dplus': 23, 'Ds': 25, 'Lc': 26,
              'Bplus': 27, 'Bzero': 28, 'Bs': 29, 'Lb': 30}
+branchGroups = {'Charm2Prong': ['Dzero'], 'Charm3Prong': ['Dplus', 'Ds', 'Lc'],
+                'Beauty3Prong': ['Bplus'], 'Beauty4Prong': ['Bzero', 'Bs', 'Lb']}
+# bits of fCandType
+candTypeBits = {'bkg': 1, 'prompt': 2, 'FD': 3}
+
+
+def GetSpeciesTable():
+    '''
+    Helper method to build the table of species from the selection bits, decays,
+    mass names and fiducial-acceptance bits
+
+    Returns
+    ----------
+    - dictionary {species: {group, outputs, decays}}, with outputs the output file
+      name (without extension) of each candidate class and decays a list of
+      (selection bits, decay, mass name, file suffix)
+    '''
+    speciesTable = {}
+    for branchGroup, speciesInGroup in branchGroups.items():
+        for species in speciesInGroup:
+            outName = 'D0' if species == 'Dzero' else species
+            if branchGroup.startswith('Charm'):
+                outputs = {'bkg': f'Reco_bkg_{outName}', 'prompt': f'Reco_prompt_{outName}',
+                           'FD': f'Reco_FD_{outName}'}
+            else:
+                outputs = {'bkg': f'Reco_bkg_{outName}', 'prompt': f'Reco_{outName}'}
+            speciesDecays = []
+            for iDec, (recoSelBit, decay, massName) in enumerate(zip(recoSelBits[species], decays[species],
+                                                                     massNames[species])):
+                # one file per decay for the species with more than one decay
+                suffix = f'_{iDec}' if len(decays[species]) > 1 else ''
+                speciesDecays.append(((recoSelBit, fidAccBit[species]), decay, massName, suffix))
+            speciesTable[species] = {'group': branchGroup, 'outputs': outputs, 'decays': speciesDecays}
+    return speciesTable
+
+
+def GetVarsToSave(species, colNames, massNamesGroup):
+    '''
+    Helper method to get the columns to be saved for a species
+
+    Arguments
+    ----------
+    - species name
+    - list of column names of the branch group
+    - list of the invariant-mass columns of the branch group
+
+    Returns
+    ----------
+    - list of columns, the invariant mass of the decay is always saved as fInvMass
+    '''
+    varsCfg = cfg['channels'][species]['vars']
+    if varsCfg is None or len(varsCfg) == 0:
+        varsToSave = [var for var in colNames if var not in ['fDecay', 'fSelBit', 'fCandType'] + massNamesGroup]
+    else:
+        varsToSave = list(varsCfg)
+        if 'fInvMass' in varsToSave:
+            varsToSave.remove('fInvMass')
+        else:
+            print(f'WARNING: invariant mass not included in variables to save for {species}, adding it')
+    varsToSave.append('fInvMass')
+    return varsToSave
+
+
+def GetRecoChunks(branchGroup):
+    '''
+    Helper method to iterate over the reco tree in chunks, reading only the branches of a candidate group
+
+    Arguments
+    ----------
+    - name of the candidate branch (Charm2Prong, Charm3Prong, Beauty3Prong, Beauty4Prong)
+
+    Returns
+    ----------
+    - list of column names
+    - generator of pandas dataframes with the column names without the branch prefix
+    '''
+    branches = [var for var in treeReco.keys() if var.startswith(f'{branchGroup}/')
+                or var in ['Ntracklets', 'zVtxReco']]
+    colNames = {var: var.replace(f'{branchGroup}/{branchGroup}.', '') for var in branches}
+    chunks = (df.rename(columns=colNames)
+              for df in treeReco.iterate(filter_name=branches, library='pd', step_size=stepSize))
+    return list(colNames.values()), chunks
+
+
+def WriteSpeciesChunk(dfChunk, species, classMasks, selMasks, decay, varsToSave):
+    '''
+    Method to select the candidates of a species in a chunk and append them to the outputs
+
+    Arguments
+    ----------
+    - pandas dataframe with a chunk of the branch group
+    - species name
+    - dictionary {candidate class: boolean mask} of the chunk
+    - dictionary {selection bits: boolean mask} of the chunk
+    - numpy array of decays of the chunk
+    - list of columns to be saved
+    '''
+    speciesInfo = speciesTable[species]
+    varsToRead = varsToSave[:-1]
+    for selBits, decayCode, massName, suffix in speciesInfo['decays']:
+        isSelected = selMasks[selBits]
+        isDecay = decay == decayCode
+        for candClass, outName in speciesInfo['outputs'].items():
+            mask = classMasks[candClass] & isSelected
+            if candClass != 'bkg':
+                mask &= isDecay
+            # the selected rows are materialised only once, with the requested columns
+            dfSel = dfChunk.loc[mask, varsToRead].assign(fInvMass=dfChunk.loc[mask, massName])
+            WriteDfChunkToParquet(dfSel, os.path.join(outDir, f'{outName}.parquet{suffix}.gzip'), writers)
+
+
+def ProcessBranchGroup(branchGroup, speciesExecutor):
+    '''
+    Method to read a branch group once and fill the outputs of all its enabled species
+
+    Arguments
+    ----------
+    - name of the candidate branch
+    - thread pool in which the species are processed
+    '''
+    speciesToProcess = [species for species in branchGroups[branchGroup] if cfg['channels'][species]['enable']]
+    colNames, chunks = GetRecoChunks(branchGroup)
+    massNamesGroup = [massName for species in branchGroups[branchGroup] for massName in massNames[species]]
+    varsToSave = {species: GetVarsToSave(species, colNames, massNamesGroup) for species in speciesToProcess}
+    selBitsList = list(dict.fromkeys(selBits for species in speciesToProcess
+                                     for selBits, _, _, _ in speciesTable[species]['decays']))
+    for dfChunk in chunks:
+        # one pass over the bit columns for all the species and decays
+        classMasks = dict(zip(candTypeBits, GetBitMasks(dfChunk['fCandType'],
+                                                        [([bit], 'or') for bit in candTypeBits.values()])))
+        selMasks = dict(zip(selBitsList, GetBitMasks(dfChunk['fSelBit'],
+                                                     [(selBits, 'and') for selBits in selBitsList])))
+        decay = dfChunk['fDecay'].to_numpy()
+        futures = [speciesExecutor.submit(WriteSpeciesChunk, dfChunk, species, classMasks, selMasks,
+                                          decay, varsToSave[species]) for species in speciesToProcess]
+        for future in futures:
+            future.result()
+
 
 with open(args.configFileName, 'r') as ymlConfigFile:
     cfg = yaml.load(ymlConfigFile, yaml.FullLoader)
 
 # reco candidates
 treeReco = uproot.open(f'{cfg["infile"]["name"]}:{cfg["infile"]["dir"]}/fRecoTree')
+# the tree is read in chunks (number of entries or size, e.g. '100 MB') to keep the memory usage flat
+stepSize = cfg['infile'].get('stepsize', '100 MB')
+nThreads = cfg.get('nthreads', 4)
+outDir = cfg['outfiles']['dir']
+speciesTable = GetSpeciesTable()
+writers = {}
 
-if cfg['channels']['Dzero']['enable']:
-    vars = [var for var in treeReco.keys() if ('Charm2Prong' in var) or var in ['Ntracklets', 'zVtxReco']]
-    dfRecoDzero = treeReco.arrays(filter_name=vars, library='pd')
-    for iVar, var in enumerate(vars):
-        vars[iVar] = var.replace('Charm2Prong/Charm2Prong.', '')
-    if 'Charm2Prong' in vars:
-        vars.remove('Charm2Prong')
-    dfRecoDzero.columns = vars
-    dfRecoBkg = FilterBitDf(dfRecoDzero, 'fCandType', [1])
-    dfRecoPrompt = FilterBitDf(dfRecoDzero, 'fCandType', [2])
-    dfRecoFD = FilterBitDf(dfRecoDzero, 'fCandType', [3])
-    for iDec, (recoSelBit, decay, massName) in enumerate(zip(recoSelBits['Dzero'], decays['Dzero'], massNames['Dzero'])):
-        dfRecoPromptSel = dfRecoPrompt.query(f'fDecay == {decay}')
-        dfRecoFDSel = dfRecoFD.query(f'fDecay == {decay}')
-        dfRecoBkgSel = FilterBitDf(dfRecoBkg, 'fSelBit', [recoSelBit, fidAccBit['Dzero']], 'and')
-        dfRecoPromptSel = FilterBitDf(dfRecoPromptSel, 'fSelBit', [recoSelBit, fidAccBit['Dzero']], 'and')
-        dfRecoFDSel = FilterBitDf(dfRecoFDSel, 'fSelBit', [recoSelBit, fidAccBit['Dzero']], 'and')
-        dfRecoBkgSel = dfRecoBkgSel.rename(columns = {massName: 'fInvMass'})
-        dfRecoPromptSel = dfRecoPromptSel.rename(columns = {massName: 'fInvMass'})
-        dfRecoFDSel = dfRecoFDSel.rename(columns = {massName: 'fInvMass'})
-        if cfg['channels']['Dzero']['vars'] is None or len(cfg['channels']['Dzero']['vars']) == 0:
-            varsToSave = vars.copy()
-            varsToSave.remove('fDecay')
-            varsToSave.remove('fSelBit')
-            varsToSave.remove('fCandType')
-            for massNameToRemove in massNames['Dzero']:
-                varsToSave.remove(massNameToRemove)                
-        else:
-            varsToSave = cfg['channels']['Dzero']['vars']
-            if 'fInvMass' not in varsToSave:
-                print('WARNING: invariant mass not included in variables to save, adding it')
-        varsToSave.append('fInvMass')
-        dfRecoBkgSel = dfRecoBkgSel[varsToSave]
-        dfRecoPromptSel = dfRecoPromptSel[varsToSave]
-        dfRecoFDSel = dfRecoFDSel[varsToSave]
-        dfRecoBkgSel.to_parquet(os.path.join(cfg['outfiles']['dir'], f'Reco_bkg_D0.parquet_{iDec}.gzip'),
-                                compression='gzip')
-        dfRecoPromptSel.to_parquet(os.path.join(cfg['outfiles']['dir'], f'Reco_prompt_D0.parquet_{iDec}.gzip'),
-                                   compression='gzip')
-        dfRecoFDSel.to_parquet(os.path.join(cfg['outfiles']['dir'], f'Reco_FD_D0.parquet_{iDec}.gzip'),
-                               compression='gzip')
-
-if cfg['channels']['Dplus']['enable'] or cfg['channels']['Ds']['enable'] or cfg['channels']['Lc']['enable']:
-    vars = [var for var in treeReco.keys() if ('Charm3Prong' in var) or var in ['Ntracklets', 'zVtxReco']]
-    dfReco3Prong = treeReco.arrays(filter_name=vars, library='pd')
-    for iVar, var in enumerate(vars):
-        vars[iVar] = var.replace('Charm3Prong/Charm3Prong.', '')
-    if 'Charm3Prong' in vars:
-        vars.remove('Charm3Prong')
-    dfReco3Prong.columns = vars
-    dfRecoBkg = FilterBitDf(dfReco3Prong, 'fCandType', [1])
-    dfRecoPrompt = FilterBitDf(dfReco3Prong, 'fCandType', [2])
-    dfRecoFD = FilterBitDf(dfReco3Prong, 'fCandType', [3])
-    for species in ['Dplus', 'Ds', 'Lc']:
-        for recoSelBit, decay, massName in zip(recoSelBits[species], decays[species], massNames[species]):
-            dfRecoPromptSel = dfRecoPrompt.query(f'fDecay == {decay}')
-            dfRecoFDSel = dfRecoFD.query(f'fDecay == {decay}')
-            dfRecoBkgSel = FilterBitDf(dfRecoBkg, 'fSelBit', [recoSelBit, fidAccBit[species]], 'and')
-            dfRecoPromptSel = FilterBitDf(dfRecoPromptSel, 'fSelBit', [recoSelBit, fidAccBit[species]], 'and')
-            dfRecoFDSel = FilterBitDf(dfRecoFDSel, 'fSelBit', [recoSelBit, fidAccBit[species]], 'and')
-            dfRecoBkgSel['fInvMass'] = dfRecoBkgSel[massName]
-            dfRecoPromptSel['fInvMass'] = dfRecoPromptSel[massName]
-            dfRecoFDSel['fInvMass'] = dfRecoFDSel[massName]
-            if cfg['channels'][species]['vars'] is None or len(cfg['channels'][species]['vars']) == 0:
-                varsToSave = vars.copy()
-                varsToSave.remove('fDecay')
-                varsToSave.remove('fSelBit')
-                varsToSave.remove('fCandType')
-            else:
-                varsToSave = cfg['channels'][species]['vars']
-                if 'fInvMass' not in varsToSave:
-                    print('WARNING: invariant mass not included in variables to save, adding it')
-                    varsToSave.append('fInvMass')
-            dfRecoBkgSel = dfRecoBkgSel[varsToSave]
-            dfRecoPromptSel = dfRecoPromptSel[varsToSave]
-            dfRecoFDSel = dfRecoFDSel[varsToSave]
-            dfRecoBkgSel.to_parquet(os.path.join(cfg['outfiles']['dir'], f'Reco_bkg_{species}.parquet.gzip'),
-                                    compression='gzip')
-            dfRecoPromptSel.to_parquet(os.path.join(cfg['outfiles']['dir'], f'Reco_prompt_{species}.parquet.gzip'),
-                                       compression='gzip')
-            dfRecoFDSel.to_parquet(os.path.join(cfg['outfiles']['dir'], f'Reco_FD_{species}.parquet.gzip'),
-                                   compression='gzip')
-            
-if cfg['channels']['Bplus']['enable']:
-    vars = [var for var in treeReco.keys() if ('Beauty3Prong' in var) or var in ['Ntracklets', 'zVtxReco']]
-    dfRecoDzero = treeReco.arrays(filter_name=vars, library='pd')
-    for iVar, var in enumerate(vars):
-        vars[iVar] = var.replace('Beauty3Prong/Beauty3Prong.', '')
-    if 'Beauty3Prong' in vars:
-        vars.remove('Beauty3Prong')
-    dfRecoDzero.columns = vars
-    dfRecoBkg = FilterBitDf(dfRecoDzero, 'fCandType', [1])
-    dfRecoPrompt = FilterBitDf(dfRecoDzero, 'fCandType', [2])
-    for recoSelBit, decay, massName in zip(recoSelBits['Bplus'], decays['Bplus'], massNames['Bplus']):
-        dfRecoPromptSel = dfRecoPrompt.query(f'fDecay == {decay}')
-        dfRecoBkgSel = FilterBitDf(dfRecoBkg, 'fSelBit', [recoSelBit, fidAccBit['Bplus']], 'and')
-        dfRecoPromptSel = FilterBitDf(dfRecoPromptSel, 'fSelBit', [recoSelBit, fidAccBit['Bplus']], 'and')
-        dfRecoBkgSel['fInvMass'] = dfRecoBkgSel[massName]
-        dfRecoPromptSel['fInvMass'] = dfRecoPromptSel[massName]
-        if cfg['channels']['Bplus']['vars'] is None or len(cfg['channels']['Bplus']['vars']) == 0:
-            varsToSave = vars.copy()
-            varsToSave.remove('fDecay')
-            varsToSave.remove('fSelBit')
-            varsToSave.remove('fCandType')
-        else:
-            varsToSave = cfg['channels']['Bplus']['vars']
-            if 'fInvMass' not in varsToSave:
-                print('WARNING: invariant mass not included in variables to save, adding it')
-                varsToSave.append('fInvMass')
-        dfRecoBkgSel = dfRecoBkgSel[varsToSave]
-        dfRecoPromptSel = dfRecoPromptSel[varsToSave]
-        dfRecoBkgSel.to_parquet(os.path.join(cfg['outfiles']['dir'], 'Reco_bkg_Bplus.parquet.gzip'),
-                                compression='gzip')
-        dfRecoPromptSel.to_parquet(os.path.join(cfg['outfiles']['dir'], 'Reco_Bplus.parquet.gzip'),
-                                   compression='gzip')
-
-if cfg['channels']['Bzero']['enable'] or cfg['channels']['Bs']['enable'] or cfg['channels']['Lb']['enable']:
-    vars = [var for var in treeReco.keys() if ('Beauty4Prong' in var) or var in ['Ntracklets', 'zVtxReco']]
-    dfReco3Prong = treeReco.arrays(filter_name=vars, library='pd')
-    for iVar, var in enumerate(vars):
-        vars[iVar] = var.replace('Beauty4Prong/Beauty4Prong.', '')
-    if 'Beauty4Prong' in vars:
-        vars.remove('Beauty4Prong')
-    dfReco3Prong.columns = vars
-    dfRecoBkg = FilterBitDf(dfReco3Prong, 'fCandType', [1])
-    dfRecoPrompt = FilterBitDf(dfReco3Prong, 'fCandType', [2])
-    for species in ['Bzero', 'Bs', 'Lb']:
-        for recoSelBit, decay, massName in zip(recoSelBits[species], decays[species], massNames[species]):
-            dfRecoPromptSel = dfRecoPrompt.query(f'fDecay == {decay}')
-            dfRecoBkgSel = FilterBitDf(dfRecoBkg, 'fSelBit', [recoSelBit, fidAccBit[species]], 'and')
-            dfRecoPromptSel = FilterBitDf(dfRecoPromptSel, 'fSelBit', [recoSelBit, fidAccBit[species]], 'and')
-            dfRecoBkgSel['fInvMass'] = dfRecoBkgSel[massName]
-            dfRecoPromptSel['fInvMass'] = dfRecoPromptSel[massName]
-            if cfg['channels'][species]['vars'] is None or len(cfg['channels'][species]['vars']) == 0:
-                varsToSave = vars.copy()
-                varsToSave.remove('fDecay')
-                varsToSave.remove('fSelBit')
-                varsToSave.remove('fCandType')
-            else:
-                varsToSave = cfg['channels'][species]['vars']
-                if 'fInvMass' not in varsToSave:
-                    print('WARNING: invariant mass not included in variables to save, adding it')
-                    varsToSave.append('fInvMass')
-            dfRecoBkgSel = dfRecoBkgSel[varsToSave]
-            dfRecoPromptSel = dfRecoPromptSel[varsToSave]
-            dfRecoBkgSel.to_parquet(os.path.join(cfg['outfiles']['dir'], f'Reco_bkg_{species}.parquet.gzip'),
-                                    compression='gzip')
-            dfRecoPromptSel.to_parquet(os.path.join(cfg['outfiles']['dir'], f'Reco_{species}.parquet.gzip'),
-                                       compression='gzip')
+groupsToProcess = [branchGroup for branchGroup, speciesInGroup in branchGroups.items()
+                   if any(cfg['channels'][species]['enable'] for species in speciesInGroup)]
+# branch groups are read in parallel, the species of each chunk are processed in parallel
+with ThreadPoolExecutor(max_workers=max(len(groupsToProcess), 1)) as groupExecutor, \
+     ThreadPoolExecutor(max_workers=nThreads) as speciesExecutor:
+    groupFutures = [groupExecutor.submit(ProcessBranchGroup, branchGroup, speciesExecutor)
+                    for branchGroup in groupsToProcess]
+    for groupFuture in groupFutures:
+        groupFuture.result()
+
+# optional bitmap index of the selection-bit columns saved in the outputs
+CloseParquetWriters(writers, cfg['outfiles'].get('bitindex'))
 
 # gen candidates
 #for iFile, file in enumerate(fileNameList):
@@ -189,4 +197,3 @@ if cfg['channels']['Bzero']['enable'] or cfg['channels']['Bs']['enable'] or cfg[
 # treeGen = uproot.open(f'{cfg["infile"]["name"]}:{cfg["infile"]["dir"]}/fGenTree')
 
 # if cfg['channels']['Dzero']['gen'] == 'tree':
-    
@@ -5,7 +5,7 @@ Script for benchmarks of time performances of different BDT applications
 '''
 
 import os
-import time
+import sys
 import argparse
 import pickle
 import numpy as np
@@ -21,10 +21,38 @@ from hipe4ml.model_handler import ModelHandler
 from hipe4ml.tree_handler import TreeHandler
 from hipe4ml.analysis_utils import train_test_generator
 from hipe4ml import plot_utils
+from hipe4ml_converter.h4ml_converter import H4MLConverter
+import hummingbird.ml
+sys.path.append('..')
+from pyutils.InferenceBenchmark import (RunBenchmark, RunEventReplay, SaveReport, GetOnnxSession, PredictOnnx,
+                                        onnxOptLevels, GetMultiplicitiesFromColumns, SampleMultiplicities)
+from pyutils.TreeEnsemble import LoadTreeEnsemble
+from pyutils.LookupTable import QuantileLookupClassifier, GetLookupTableReport
+from pyutils.BenchmarkStore import AppendRun
 
 parser = argparse.ArgumentParser(description='Arguments to pass')
-parser.add_argument('--batchSize', type=int, default=1000000000,
-                    help='batch size')
+parser.add_argument('--batchSizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                    help='batch sizes')
+parser.add_argument('--threads', type=int, nargs='+', default=[1],
+                    help='numbers of threads')
+parser.add_argument('--warmup', type=int, default=3,
+                    help='number of warm-up runs')
+parser.add_argument('--repeats', type=int, default=10,
+                    help='number of timed runs')
+parser.add_argument('--onnxOptLevel', default='all', choices=onnxOptLevels,
+                    help='graph optimisation level of the ONNX Runtime session')
+parser.add_argument('--onnxInterOpThreads', type=int, default=1,
+                    help='number of inter-op threads of the ONNX Runtime session')
+parser.add_argument('--replay', action='store_true', default=False,
+                    help='score also event by event, with realistic candidate multiplicities')
+parser.add_argument('--events', type=int, default=100000,
+                    help='number of events of the replay')
+parser.add_argument('--multiplicity', default='sample',
+                    help='multiplicities of the replay: sample (from the bkg sample) or mean of a Poisson distribution')
+parser.add_argument('--store', default='outputs/timetests/store',
+                    help='directory of the benchmark store to which the run is appended')
+parser.add_argument('--report', default=None,
+                    help='output report (.parquet.gzip or .json)')
 args = parser.parse_args()
 
 #**************************************************************************
@@ -55,11 +83,26 @@ plt.savefig(f'plots/VarsCorr_{"-".join(varsToDraw)}.pdf')
 plt.close('all')
 
 featuresForTrain = ['fd0MinDau', 'fDecayLength', 'fImpParProd', 'fCosP']
-timeAppl, yPredTrain, yPredTest, yPredAppl = ({} for _ in range(4))
+yPredTrain, yPredTest = {}, {}
+
+# per-event candidate multiplicities for the replay, the candidates of the same event are
+# consecutive in the samples and share the event-level variables
+if args.replay:
+    if args.multiplicity == 'sample':
+        multSample = GetMultiplicitiesFromColumns(bkgH.get_data_frame(), ['Ntracklets', 'zVtxReco'])
+        multReplay = SampleMultiplicities(args.events, multiplicities=multSample)
+    else:
+        multReplay = SampleMultiplicities(args.events, mean=float(args.multiplicity))
+    print(f'\033[32mReplay of {args.events} events with {np.mean(multReplay):.2f} candidates per event\033[0m')
+dfBench, lutReports = [], []
 
 nEstimList = [100, 200, 300, 500, 750, 1000, 1500]
 nBinsList = [2, 5, 10, 50, 100]
+qlutBinsList = [8, 16, 32]
 colors = ['forestgreen', 'lightseagreen', 'teal', 'steelblue', 'navy']
+# backends with the same model as XGBoost in the formats used for the deployment
+exportedNames = ['Treelite', 'ONNX', 'Hummingbird', 'NumPy'] + [f'QLUT{nBins}' for nBins in qlutBinsList]
+exportedColors = ['chocolate', 'darkorchid', 'goldenrod', 'slategray'] + ['pink', 'hotpink', 'crimson']
 
 for iEstim, nEstim in enumerate(nEstimList):
     #**************************************************************************
@@ -78,8 +121,10 @@ for iEstim, nEstim in enumerate(nEstimList):
         modelHdl.train_test_model(trainTestData)
         modelHdl.dump_original_model(xgbName, True)
         modelHdl.dump_model_handler(hdlName)
-    if iEstim == 0:
-        timeAppl['XGBoost'] = []
+    jsonName = hdlName.replace('.pickle', '.json')
+    if not os.path.isfile(jsonName):
+        modelClf.get_booster().save_model(jsonName)
+    treeEnsemble = LoadTreeEnsemble(jsonName)
 
     # Bonsai BDT
     bBDT = []
@@ -87,8 +132,6 @@ for iEstim, nEstim in enumerate(nEstimList):
         maxCells = nBins**4
         bBDT.append(LookupClassifier(base_estimator=modelClf, n_bins=nBins, max_cells=maxCells))
         bBDT[-1].fit(trainTestData[0][featuresForTrain], trainTestData[1], sample_weight=None)
-        if iEstim == 0:
-            timeAppl[f'BBDT{nBins}'] = []
 
     # Treelite
     modelTreeLite = treelite.Model.load(xgbName, model_format='xgboost')
@@ -98,40 +141,91 @@ for iEstim, nEstim in enumerate(nEstimList):
     predictorTreeLite = treelite_runtime.Predictor(libFile, verbose=True)
     dmatTrain = treelite_runtime.DMatrix(trainTestData[0][featuresForTrain], feature_names=featuresForTrain)
     dmatTest = treelite_runtime.DMatrix(trainTestData[2][featuresForTrain], feature_names=featuresForTrain)
-    if iEstim == 0:
-        timeAppl['Treelite'] = []
+
+    # ONNX and hummingbird, exported as in train_hf_triggers.py
+    onnxName = f'onnx/ModelHandler_onnx_XGBoost_v{xgb.__version__}_n_estimators{nEstim}_features_{"-".join(featuresForTrain)}.onnx'
+    hbName = f'onnx/ModelHandler_onnx_hummingbird_XGBoost_v{xgb.__version__}_n_estimators{nEstim}_features_{"-".join(featuresForTrain)}'
+    if not os.path.isfile(onnxName) or not (os.path.exists(hbName) or os.path.isfile(f'{hbName}.zip')):
+        os.makedirs('onnx', exist_ok=True)
+        modelConv = H4MLConverter(modelHdl)
+        modelConv.convert_model_onnx(1)
+        modelConv.dump_model_onnx(onnxName)
+        modelConv.convert_model_hummingbird('onnx', 1)
+        modelConv.dump_model_hummingbird(hbName)
+    sessionOnnx = GetOnnxSession(onnxName, 1, args.onnxOptLevel, args.onnxInterOpThreads)
+    modelHummingbird = hummingbird.ml.load(hbName)
 
     # RBDT
     #**************************************************************************
-    # Benchmark results
-    applSample = trainTestData[2][featuresForTrain].iloc[:args.batchSize]
-    dmatAppl = treelite_runtime.DMatrix(applSample, feature_names=featuresForTrain)
-    nCandApply = args.batchSize if args.batchSize < nCandTest else nCandTest
-
-    # XGBoost
-    yPredTrain['XGBoost'] = modelHdl.predict(trainTestData[0], False) # for ROC and residuals
-    yPredTest['XGBoost'] = modelHdl.predict(trainTestData[2], False) # for ROC and residuals
-    start = time.time()
-    yPredAppl['XGBoost'] = modelHdl.predict(applSample, False)
-    end = time.time()
-    timeAppl['XGBoost'].append((end-start)/nCandApply)
+    # Scores for ROC and residuals
+    yPredTrain['XGBoost'] = modelHdl.predict(trainTestData[0], False)
+    yPredTest['XGBoost'] = modelHdl.predict(trainTestData[2], False)
+    for classif, nBins in zip(bBDT, nBinsList):
+        yPredTrain[f'BBDT{nBins}'] = classif.predict_proba(trainTestData[0][featuresForTrain])
+        yPredTest[f'BBDT{nBins}'] = classif.predict_proba(trainTestData[2][featuresForTrain])
+    yPredTrain['Treelite'] = predictorTreeLite.predict(dmatTrain)
+    yPredTest['Treelite'] = predictorTreeLite.predict(dmatTest)
+    yPredTest['ONNX'] = PredictOnnx(sessionOnnx, trainTestData[2][featuresForTrain].to_numpy(np.float32))
+    yPredTest['Hummingbird'] = modelHummingbird.predict_proba(
+        trainTestData[2][featuresForTrain].to_numpy(np.float32))[:, 1]
+    yPredTest['NumPy'] = treeEnsemble.Predict(trainTestData[2][featuresForTrain], False)
+
+    # quantile lookup tables, populated with the XGBoost scores of the training sample
+    qLUT = []
+    for nBins in qlutBinsList:
+        qLUT.append(QuantileLookupClassifier(nBins, 16).Fit(trainTestData[0][featuresForTrain], yPredTrain['XGBoost']))
+        yPredTest[f'QLUT{nBins}'] = qLUT[-1].Predict(trainTestData[2])
+        lutReports.append(GetLookupTableReport(qLUT[-1], trainTestData[2], trainTestData[3], yPredTest['XGBoost']))
+        lutReports[-1].update({'n_estimators': nEstim, 'n_bins': nBins})
+
+    #**************************************************************************
+    # Benchmark results: warm-up and repeated runs for all batch sizes and numbers of threads
+    applSample = trainTestData[2][featuresForTrain]
+    # the treelite and ONNX inputs are converted outside of the timed function, as for the other backends
+    dmatAppl = {batchSize: treelite_runtime.DMatrix(applSample.iloc[:batchSize], feature_names=featuresForTrain)
+                for batchSize in args.batchSizes if batchSize <= nCandTest}
+    arrAppl = {batchSize: applSample.iloc[:batchSize].to_numpy(np.float32)
+               for batchSize in args.batchSizes if batchSize <= nCandTest}
+    predictors = {'Treelite': predictorTreeLite, 'ONNX': sessionOnnx}
 
-    # Bonsai BDT
+    def SetTreeliteThreads(nThreads):
+        predictors['Treelite'] = treelite_runtime.Predictor(libFile, nthread=nThreads, verbose=False)
+
+    def SetOnnxThreads(nThreads):
+        predictors['ONNX'] = GetOnnxSession(onnxName, nThreads, args.onnxOptLevel, args.onnxInterOpThreads)
+
+    backends = {'XGBoost': lambda batch: modelHdl.predict(batch, False),
+                'Treelite': lambda batch: predictors['Treelite'].predict(dmatAppl[len(batch)]),
+                'ONNX': lambda batch: PredictOnnx(predictors['ONNX'], arrAppl[len(batch)]),
+                'Hummingbird': lambda batch: modelHummingbird.predict_proba(arrAppl[len(batch)]),
+                'NumPy': lambda batch: treeEnsemble.Predict(arrAppl[len(batch)], False)}
     for classif, nBins in zip(bBDT, nBinsList):
-        yPredTrain[f'BBDT{nBins}'] = classif.predict_proba(trainTestData[0][featuresForTrain]) # for ROC and residuals
-        yPredTest[f'BBDT{nBins}'] = classif.predict_proba(trainTestData[2][featuresForTrain]) # for ROC and residuals
-        start = time.time()
-        yPredAppl[f'BBDT{nBins}'] = classif.predict_proba(applSample)
-        end = time.time()
-        timeAppl[f'BBDT{nBins}'].append((end-start)/nCandApply)
+        backends[f'BBDT{nBins}'] = classif.predict_proba
+    for lut, nBins in zip(qLUT, qlutBinsList):
+        backends[f'QLUT{nBins}'] = lambda batch, lut=lut: lut.Predict(arrAppl[len(batch)])
+    # the hummingbird session follows the thread pinning of the benchmark
+    threadSetters = {'XGBoost': lambda nThreads: modelClf.set_params(n_jobs=nThreads),
+                     'Treelite': SetTreeliteThreads,
+                     'ONNX': SetOnnxThreads}
+    dfBench.append(RunBenchmark(backends, applSample, args.batchSizes, args.threads, threadSetters,
+                                args.warmup, args.repeats,
+                                tags={'n_estimators': nEstim, 'onnx_opt_level': args.onnxOptLevel}))
 
-    # Treelite
-    yPredTrain['Treelite'] = predictorTreeLite.predict(dmatTrain) # for ROC and residuals
-    yPredTest['Treelite'] = predictorTreeLite.predict(dmatTest) # for ROC and residuals
-    start = time.time()
-    yPredAppl['Treelite'] = predictorTreeLite.predict(dmatAppl)
-    end = time.time()
-    timeAppl['Treelite'].append((end-start)/nCandApply)
+    # Single-event scoring: the input conversion is part of the latency of each call
+    if args.replay:
+        backendsReplay = {'XGBoost': lambda batch: modelClf.predict_proba(batch)[:, 1],
+                          'Treelite': lambda batch: predictors['Treelite'].predict(treelite_runtime.DMatrix(batch)),
+                          'ONNX': lambda batch: PredictOnnx(predictors['ONNX'], batch),
+                          'Hummingbird': modelHummingbird.predict_proba,
+                          'NumPy': lambda batch: treeEnsemble.Predict(batch, False)}
+        for classif, nBins in zip(bBDT, nBinsList):
+            backendsReplay[f'BBDT{nBins}'] = lambda batch, classif=classif: classif.predict_proba(
+                pd.DataFrame(batch, columns=featuresForTrain))
+        for lut, nBins in zip(qLUT, qlutBinsList):
+            backendsReplay[f'QLUT{nBins}'] = lut.Predict
+        dfBench.append(RunEventReplay(backendsReplay, applSample.to_numpy(np.float32), multReplay,
+                                      threads=args.threads, threadSetters=threadSetters,
+                                      tags={'n_estimators': nEstim, 'onnx_opt_level': args.onnxOptLevel}))
 
     #**************************************************************************
     # Some nice plots
@@ -158,14 +252,15 @@ for iEstim, nEstim in enumerate(nEstimList):
     for iBins, nBins in enumerate(nBinsList):
         plt.hist(yPredTest[f'BBDT{nBins}'][:, 1]-yPredTest['XGBoost'], bins=1000, histtype='step',
                  stacked=True, fill=False, label=f'BBDT nbins = {nBins}', color = colors[iBins])
-    plt.hist(yPredTest['Treelite']-yPredTest['XGBoost'], bins=1000, histtype='step',
-             stacked=True, fill=False, label='treelite', color='chocolate')
+    for name, color in zip(exportedNames, exportedColors):
+        plt.hist(yPredTest[name]-yPredTest['XGBoost'], bins=1000, histtype='step',
+                 stacked=True, fill=False, label=name.lower(), color=color)
     plt.ylabel('entries', size=15)
     plt.xlabel('BDT output residual to XGBoost', size=15)
     plt.legend(loc='best')
-    resFig.savefig(f'plots/Residuals_n_estimators_{nEstim}_batchSize{nCandApply}_lin.pdf')
+    resFig.savefig(f'plots/Residuals_n_estimators_{nEstim}_lin.pdf')
     plt.yscale('log')
-    resFig.savefig(f'plots/Residuals_n_estimators_{nEstim}_batchSize{nCandApply}_log.pdf')
+    resFig.savefig(f'plots/Residuals_n_estimators_{nEstim}_log.pdf')
     plt.close('all')
 
     # Score residuals vs XGBoost score
@@ -175,23 +270,25 @@ for iEstim, nEstim in enumerate(nEstimList):
                    range=np.array([(0., 1.), (-1., 1.)]), bins=(1000, 1000), norm=LogNorm(vmin=1.e-7))
         plt.ylabel(f'BDT output BBDT nbins = {nBins} - XGBoost', size=15)
         plt.xlabel(f'BDT output XGBoost', size=15)
-        resVsXGBoostFig.savefig(f'plots/ResidualsBBDT{nBins}_vs_XGBoost_n_estimators_{nEstim}_batchSize{nCandApply}_lin.pdf')
-
-    resVsXGBoostFig = plt.figure(figsize=(8, 8))
-    plt.hist2d(yPredTest['XGBoost'], yPredTest['Treelite']-yPredTest['XGBoost'], cmap='OrRd',
-               range=np.array([(0., 1.), (-1., 1.)]), bins=(1000, 1000), norm=LogNorm(vmin=1.e-7))
-    plt.ylabel(f'BDT output Treelite - XGBoost', size=15)
-    plt.xlabel(f'BDT output XGBoost', size=15)
-    resVsXGBoostFig.savefig(f'plots/ResidualsTreelite_vs_XGBoost_n_estimators_{nEstim}_batchSize{nCandApply}_lin.pdf')
+        resVsXGBoostFig.savefig(f'plots/ResidualsBBDT{nBins}_vs_XGBoost_n_estimators_{nEstim}_lin.pdf')
+
+    for name in exportedNames:
+        resVsXGBoostFig = plt.figure(figsize=(8, 8))
+        plt.hist2d(yPredTest['XGBoost'], yPredTest[name]-yPredTest['XGBoost'], cmap='OrRd',
+                   range=np.array([(0., 1.), (-1., 1.)]), bins=(1000, 1000), norm=LogNorm(vmin=1.e-7))
+        plt.ylabel(f'BDT output {name} - XGBoost', size=15)
+        plt.xlabel(f'BDT output XGBoost', size=15)
+        resVsXGBoostFig.savefig(f'plots/Residuals{name}_vs_XGBoost_n_estimators_{nEstim}_lin.pdf')
     plt.close('all')
 
-dictTime = dict()
-dictTime['n_estimators'] = nEstimList
-dictTime['XGBoost'] = timeAppl['XGBoost']
-dictTime['Treelite'] = timeAppl['Treelite']
-for iBins, nBins in enumerate(nBinsList):
-    dictTime[f'BBDT{nBins}'] = timeAppl[f'BBDT{nBins}']
-dfTime = pd.DataFrame(dictTime)
-dfTime.to_parquet(f'outputs/timetests/timeBench_XGBoost_v{xgb.__version__}_batchSize{nCandApply}'
-                  f'_features_{"-".join(featuresForTrain)}.parquet.gzip',
-                  compression='gzip')
+dfBench = pd.concat(dfBench, ignore_index=True)
+reportName = args.report if args.report else (f'outputs/timetests/timeBench_XGBoost_v{xgb.__version__}'
+                                              f'_features_{"-".join(featuresForTrain)}.parquet.gzip')
+SaveReport(dfBench, reportName)
+runId = AppendRun(args.store, dfBench, config={**vars(args), 'features': featuresForTrain, 'n_estimators': nEstimList,
+                                                'n_bins_bbdt': nBinsList, 'n_bins_qlut': qlutBinsList})
+print(f'\033[32mBenchmark run {runId} appended to {args.store}\033[0m')
+print(dfBench.drop(columns=['times_ns', 'hist_counts'], errors='ignore').to_string(index=False))
+dfLUT = pd.DataFrame(lutReports)
+dfLUT.to_parquet(f'outputs/timetests/lutReport_features_{"-".join(featuresForTrain)}.parquet.gzip')
+print(dfLUT.to_string(index=False))
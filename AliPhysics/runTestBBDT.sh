@@ -1,2 +1,2 @@
-declare -a batch_sizes=( 100 1000 10000 100000 )
-parallel -j4 python3 TestBonsaiBDT.py --batchSize {} ::: ${batch_sizes[@]}
\ No newline at end of file
+# all the batch sizes and numbers of threads are benchmarked in the same process
+python3 TestBonsaiBDT.py --batchSizes 100 1000 10000 100000 --threads 1 2 4 --warmup 3 --repeats 10
@@ -0,0 +1,232 @@
+"""
+Script for the compaction of a trained trigger BDT: the ensemble saved in the xgboost JSON
+format by train_hf_triggers.py is truncated to fewer boosting rounds, the trees with identical
+splits are merged and the thresholds and leaf values are quantised. For each compact model the
+latency of the numpy evaluator, the AUC and the signal efficiency at fixed background acceptance
+are computed on the test sample, and the smallest model within the latency budget and the
+allowed AUC loss is exported in a compact npz file
+run: python compact_bdt.py config_training_D0.yml [--trees 1000 500 200 100] [--merge]
+                            [--threshold_bits 8] [--leaf_bits 8] [--budget 1.e-6] [--max_auc_loss 0.001]
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import yaml
+
+sys.path.append('../..')
+from pyutils.TreeEnsemble import (LoadTreeEnsemble, TruncateEnsemble, MergeIdenticalTrees,  #pylint: disable=wrong-import-position,import-error
+                                  QuantiseThresholds, QuantiseLeaves, SaveCompactModel)
+from pyutils.LookupTable import GetRocAuc  #pylint: disable=wrong-import-position,import-error
+from pyutils.InferenceBenchmark import TimeFunction  #pylint: disable=wrong-import-position,import-error
+
+
+def compact_model(ensemble, n_trees, merge=False, threshold_bits=None, leaf_bits=None):
+    """
+    Function to build a compact version of a tree ensemble
+
+    Parameters
+    -----------------
+    - ensemble: TreeEnsemble
+    - n_trees: number of boosting rounds to be kept
+    - merge: merge the trees with identical splits
+    - threshold_bits: bits of the threshold index of each feature (no quantisation if None)
+    - leaf_bits: bits of the leaf values (no quantisation if None)
+
+    Outputs
+    -----------------
+    - compact: TreeEnsemble
+    """
+    compact = TruncateEnsemble(ensemble, n_trees)
+    if threshold_bits is not None:
+        compact = QuantiseThresholds(compact, threshold_bits)
+    # merging after the quantisation of the thresholds, which makes more trees identical
+    if merge:
+        compact = MergeIdenticalTrees(compact)
+    if leaf_bits is not None:
+        compact = QuantiseLeaves(compact, leaf_bits)
+    return compact
+
+
+def get_performance(scores, labels, bkg_acceptance):
+    """
+    Function to compute the AUC and the efficiency at fixed background acceptance of each signal class
+
+    Parameters
+    -----------------
+    - scores: probabilities (candidates, classes), as from TreeEnsemble.PredictProba
+    - labels: class of the candidates (0 for the background)
+    - bkg_acceptance: fraction of background candidates accepted by the working point
+
+    Outputs
+    -----------------
+    - performance: dictionary with auc_<class> and eff_<class>
+    """
+    performance = {}
+    is_bkg = labels == 0
+    for i_class in range(1, scores.shape[1]):
+        performance[f"auc_{i_class}"] = GetRocAuc(labels == i_class, scores[:, i_class])
+        threshold = np.quantile(scores[is_bkg, i_class], 1. - bkg_acceptance) if np.any(is_bkg) else 0.
+        is_sig = labels == i_class
+        performance[f"eff_{i_class}"] = float(np.mean(scores[is_sig, i_class] > threshold)) \
+            if np.any(is_sig) else np.nan
+    return performance
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def scan_compaction(ensemble, test_df, labels, trees_list, merge=False, threshold_bits=None, leaf_bits=None,
+                    bkg_acceptance=0.01, batch_size=10000, n_repeats=10):
+    """
+    Function to evaluate the full and the compact models
+
+    Parameters
+    -----------------
+    - ensemble: TreeEnsemble with the full model
+    - test_df: pandas dataframe with the training variables of the test sample, in the training order
+    - labels: class of the test candidates
+    - trees_list: list of numbers of boosting rounds
+    - merge, threshold_bits, leaf_bits: see compact_model
+    - bkg_acceptance: background acceptance of the working point for the efficiencies
+    - batch_size: number of candidates for the latency measurement
+    - n_repeats: number of timed runs
+
+    Outputs
+    -----------------
+    - table: pandas dataframe with one row per model (the first one is the full model)
+    - models: list of TreeEnsemble, in the same order
+    """
+    inputs = ensemble.GetInputArray(test_df)
+    batch = inputs[:batch_size]
+    n_rounds = len(ensemble.roots) // ensemble.nClasses
+    variants = [("full", ensemble)] + [
+        (f"trees{n_trees}", compact_model(ensemble, n_trees, merge, threshold_bits, leaf_bits))
+        for n_trees in sorted(trees_list, reverse=True) if n_trees <= n_rounds]
+
+    rows, models = [], []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, model in variants:
+            times = TimeFunction(lambda: model.PredictMargin(batch), 1, n_repeats)  # pylint: disable=cell-var-from-loop
+            row = {"model": name, "n_rounds": n_rounds if name == "full" else int(name[len("trees"):]),
+                   "n_trees": len(model.roots), "n_nodes": len(model.feature),
+                   "size": SaveCompactModel(model, os.path.join(tmp_dir, f"{name}.npz")),
+                   "time_per_cand": np.median(times) * 1.e-9 / len(batch)}
+            row.update(get_performance(model.PredictProba(inputs), labels, bkg_acceptance))
+            rows.append(row)
+            models.append(model)
+
+    table = pd.DataFrame(rows)
+    for col in [col for col in table.columns if col.startswith("auc_")]:
+        table[f"{col}_loss"] = table[col].iloc[0] - table[col]
+    return table, models
+
+
+def select_model(table, budget=None, max_auc_loss=None):
+    """
+    Function to select the smallest model within the latency budget and the allowed AUC loss
+
+    Parameters
+    -----------------
+    - table: output of scan_compaction
+    - budget: maximum time per candidate (s), no limit if None
+    - max_auc_loss: maximum AUC loss of each signal class, no limit if None
+
+    Outputs
+    -----------------
+    - index: row of the selected model, None if no model satisfies the requirements
+    """
+    selected = np.ones(len(table), dtype=bool)
+    if budget is not None:
+        selected &= table["time_per_cand"].to_numpy() <= budget
+    if max_auc_loss is not None:
+        for col in [col for col in table.columns if col.endswith("_loss")]:
+            selected &= table[col].to_numpy() <= max_auc_loss
+    if not np.any(selected):
+        return None
+    return table[selected].sort_values(["size", "time_per_cand"]).index[0]
+
+
+def plot_curve(table, out_file_name):
+    """
+    Function to plot the AUC and the efficiency as a function of the latency of the models
+    """
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    for i_class in [col[len("auc_"):] for col in table.columns if col.startswith("auc_") and
+                    not col.endswith("_loss")]:
+        for axis, var, label in zip(axes, ["auc", "eff"], ["AUC", "efficiency at fixed bkg acceptance"]):
+            axis.plot(table["time_per_cand"], table[f"{var}_{i_class}"], marker="o", label=f"class {i_class}")
+            axis.set_xlabel("time / candidate (s)")
+            axis.set_ylabel(label)
+            axis.set_xscale("log")
+            axis.grid(True)
+    for row in table.itertuples():
+        axes[0].annotate(row.model, (row.time_per_cand, row.auc_1), fontsize=8)
+    axes[0].legend(loc="best")
+    fig.tight_layout()
+    fig.savefig(out_file_name)
+    plt.close(fig)
+
+
+def main(config, trees_list, merge, threshold_bits, leaf_bits, bkg_acceptance, budget, max_auc_loss, batch_size):
+    """
+    Main function
+
+    Parameters
+    -----------------
+    - config: dictionary with the training config read from a yaml file
+    - see scan_compaction and select_model for the other parameters
+    """
+    out_dir = config["output"]["directory"]
+    channel = config["data_prep"]["channel"]
+    ensemble = LoadTreeEnsemble(f"{out_dir}/ModelHandler_{channel}.json")
+    test_df = pd.read_parquet(f"{out_dir}/{channel}_ModelApplied.parquet.gzip")
+    labels = test_df["Labels"].to_numpy()
+    # the feature names are not stored in the json of older xgboost versions (e.g. 1.3.3)
+    training_vars = config["ml"]["training_vars"]
+
+    table, models = scan_compaction(ensemble, test_df[training_vars], labels, trees_list, merge, threshold_bits, leaf_bits,
+                                    bkg_acceptance, batch_size)
+    table.to_csv(f"{out_dir}/CompactBDT_{channel}.csv", index=False)
+    plot_curve(table, f"{out_dir}/CompactBDT_{channel}.pdf")
+    print(table.to_string(index=False))
+
+    index = select_model(table, budget, max_auc_loss)
+    if index is None:
+        print("\033[93mWARNING: no model within the latency budget and the allowed AUC loss\033[0m")
+        return
+    out_file_name = f"{out_dir}/ModelHandler_{channel}_compact.npz"
+    SaveCompactModel(models[index], out_file_name)
+    print(f"\033[32mSelected model {table['model'][index]} ({table['n_trees'][index]} trees, "
+          f"{table['size'][index] / 1024:.1f} kB) saved in {out_file_name}\033[0m")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Arguments")
+    parser.add_argument("config", metavar="text", default="config_training.yml",
+                        help="config file used for the training")
+    parser.add_argument("--trees", type=int, nargs="+", default=[1000, 750, 500, 300, 200, 100, 50, 20],
+                        help="numbers of boosting rounds of the compact models")
+    parser.add_argument("--merge", action="store_true", default=False,
+                        help="merge the trees with identical splits")
+    parser.add_argument("--threshold_bits", type=int, default=None,
+                        help="bits of the threshold index of each feature")
+    parser.add_argument("--leaf_bits", type=int, default=None, choices=[8, 16],
+                        help="bits of the leaf values")
+    parser.add_argument("--bkg_acceptance", type=float, default=0.01,
+                        help="background acceptance of the working point for the efficiencies")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="maximum time per candidate (s)")
+    parser.add_argument("--max_auc_loss", type=float, default=None,
+                        help="maximum AUC loss with respect to the full model")
+    parser.add_argument("--batch", type=int, default=10000,
+                        help="number of candidates for the latency measurement")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as yml_cfg:  # pylint: disable=bad-option-value
+        cfg = yaml.load(yml_cfg, yaml.FullLoader)
+
+    main(cfg, args.trees, args.merge, args.threshold_bits, args.leaf_bits, args.bkg_acceptance, args.budget,
+         args.max_auc_loss, args.batch)
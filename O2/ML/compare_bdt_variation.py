@@ -1,304 +1,487 @@
 '''
 Script for the comparison of trigger class and rejection factor with or without BDT selection
 run: python compare_bdt_variation.py cfgFileName.yml
+     python compare_bdt_variation.py --batch 'scan/config_*.yml' --jobs 8 --outtable rejection.csv [--plots]
+In batch mode any number of configs (or glob patterns) is processed in a worker pool without
+interaction, and the rejection factors and per-species yields of all the variations are written
+in one table; plots are produced only on request. With several configs the root and pdf outputs
+are tagged with the config name, so that they do not overwrite each other
 '''
 
 import sys
-from os.path import join
+import glob
+from os.path import join, basename, splitext
 import argparse
-import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from itertools import zip_longest
+import numpy as np
+import pandas as pd
 import yaml
-from ROOT import TCanvas, TFile, TLegend, TLine, gPad  # pylint: disable=import-error,no-name-in-module
 
+from hf_filter_histos import get_histo_names, load_histos
 sys.path.append('../..')
-from pyutils.StyleFormatter import SetGlobalStyle, SetObjectStyle, GetROOTColor, GetROOTMarker  #pylint: disable=wrong-import-position,import-error
-
-# load inputs
-parser = argparse.ArgumentParser(description='Arguments')
-parser.add_argument('cfgFileName',
-                    metavar='text',
-                    default='config_comparison.yml')
-args = parser.parse_args()
-
-with open(args.cfgFileName, 'r') as ymlCfgFile:
-    inputCfg = yaml.load(ymlCfgFile, yaml.FullLoader)
-
-inDirName = inputCfg['inputs']['dirname']
-inFileNames = inputCfg['inputs']['filenames']
-
-particle_c = inputCfg['inputs']['charmhadron']
-particle_b = inputCfg['inputs']['beautyhadron']
-
-outFileName = inputCfg['output']['filename']
-
-colors = inputCfg['options']['colors']
-markers = inputCfg['options']['markers']
-markersize = inputCfg['options']['markersize']
-linewidth = inputCfg['options']['linewidth']
-fillstyles = inputCfg['options']['fillstyle']
-
-wCanv = inputCfg['options']['canvas']['width']
-hCanv = inputCfg['options']['canvas']['heigth']
-xLimitslow_c = inputCfg['options']['histos']['xLimitslow_c']
-xLimitshigh_c = inputCfg['options']['histos']['xLimitshigh_c']
-xLimitslow_b = inputCfg['options']['histos']['xLimitslow_b']
-xLimitshigh_b = inputCfg['options']['histos']['xLimitshigh_b']
-
-xTitle_c = inputCfg['options']['histos']['xaxistitle_c']
-xTitle_b = inputCfg['options']['histos']['xaxistitle_b']
-xTitle_h = inputCfg['options']['histos']['xaxistitle_hightpt']
-xTitle_k = inputCfg['options']['histos']['xaxistitle_kstar']
-
-yTitle = inputCfg['options']['histos']['yaxistitle']
-ptlow = inputCfg['options']['histos']['ptlow']
-pthigh = inputCfg['options']['histos']['pthigh']
-kstarlow = inputCfg['options']['histos']['kstarlow']
-kstarhigh = inputCfg['options']['histos']['kstarhigh']
-
-xLegLimits = inputCfg['options']['legend']['xlimits']
-yLegLimits = inputCfg['options']['legend']['ylimits']
-legHeader = inputCfg['options']['legend']['header']
-legNames = inputCfg['options']['legend']['titles']
-legOpt = inputCfg['options']['legend']['options']
-legTextSize = inputCfg['options']['legend']['textsize']
-ncolumns = inputCfg['options']['legend']['ncolumns']
-
-# set global style
-SetGlobalStyle(padbottommargin=0.14,
-               padtopmargin=0.08,
-               padleftmargin=0.15,
-               padrightmargin=0.1,
-               titleoffsety=1.45,
-               titleoffsetx=1.1,
-               titlesize=0.05,
-               labelsize=0.05,
-               maxdigits=2,
-               opttitle=1)
-
-CharmMass = [[], []]
-BeautyMass = [[], []]
-HighPt = [[], []]
-ProtonKstar = [[], []]
-ReJFactor = []
-Nevents = []
-
-for iFile, (inFileName) in enumerate(inFileNames):
-    if inDirName:
-        inFileName = join(inDirName, inFileName)
-    inFile = TFile.Open(inFileName)
-    if inFile == None:
-        print(f"ERROR: cannot open {inFileName}. Check your config. Exit!")
-        sys.exit()
-    Nevents.append(
-        inFile.Get('hf-filter/registry/fProcessedEvents').GetBinContent(1))
-    ReJFactor.append(inFile.Get('hf-filter/registry/fProcessedEvents'))
-    print(iFile, Nevents[iFile])
-    ReJFactor[iFile].Scale(1 / Nevents[iFile])
-    ReJFactor[iFile].SetNameTitle(f'hRej{iFile}', f'hRej{iFile}')
-    ReJFactor[-1].SetDirectory(0)
-
-    for i, (parc, parb) in enumerate(zip(particle_c, particle_b)):
-
-        CharmMass[iFile].append(
-            inFile.Get(f'hf-filter/registry/fMassVsPt{parc}').ProjectionY())
-        CharmMass[iFile][i].Scale(1 / Nevents[iFile])
-        CharmMass[iFile][i].SetNameTitle(f'{parc}{iFile}', f'{parc}{iFile}')
-        CharmMass[iFile][-1].SetDirectory(0)
-
-        BeautyMass[iFile].append(
-            inFile.Get(f'hf-filter/registry/fMassVsPt{parb}').ProjectionY())
-        BeautyMass[iFile][i].Scale(1 / Nevents[iFile])
-        BeautyMass[iFile][i].SetNameTitle(f'{parb}{iFile}', f'{parb}{iFile}')
-        BeautyMass[iFile][-1].SetDirectory(0)
-
-        if i < 4:
-            HighPt[iFile].append(
-                inFile.Get(f'hf-filter/registry/f{parc}HighPt'))
-            HighPt[iFile][i].Scale(1 / Nevents[iFile])
-            HighPt[iFile][i].SetNameTitle(f'Highpt{parc}{iFile}',
-                                          f'Highpt{parc}{iFile}')
-            HighPt[iFile][-1].SetDirectory(0)
-
-            ProtonKstar[iFile].append(
-                inFile.Get(f'hf-filter/registry/f{parc}ProtonKstarDistr'))
-            ProtonKstar[iFile][i].Scale(1 / Nevents[iFile])
-            ProtonKstar[iFile][i].SetNameTitle(f'hkstar{parb}{iFile}',
-                                               f'hkstar{parb}{iFile}')
-            ProtonKstar[iFile][-1].SetDirectory(0)
-
-legRej = TLegend(xLegLimits[0], yLegLimits[0], xLegLimits[1], yLegLimits[1])
-legRej.SetFillStyle(0)
-legRej.SetTextSize(legTextSize)
-legRej.SetNColumns(ncolumns)
-if legHeader is not None:
-    legRej.SetHeader(legHeader, 'C')
-
-legCmass = TLegend(xLegLimits[0], yLegLimits[0], xLegLimits[1], yLegLimits[1])
-legCmass.SetFillStyle(0)
-legCmass.SetTextSize(legTextSize)
-legCmass.SetNColumns(ncolumns)
-if legHeader is not None:
-    legCmass.SetHeader(legHeader, 'C')
-
-legBmass = TLegend(xLegLimits[0], yLegLimits[0], xLegLimits[1], yLegLimits[1])
-legBmass.SetFillStyle(0)
-legBmass.SetTextSize(legTextSize)
-legBmass.SetNColumns(ncolumns)
-if legHeader is not None:
-    legBmass.SetHeader(legHeader, 'C')
-
-legHighpt = TLegend(xLegLimits[0], yLegLimits[0], xLegLimits[1], yLegLimits[1])
-legHighpt.SetFillStyle(0)
-legHighpt.SetTextSize(legTextSize)
-legHighpt.SetNColumns(ncolumns)
-if legHeader is not None:
-    legHighpt.SetHeader(legHeader, 'C')
-
-legKstar = TLegend(xLegLimits[0], yLegLimits[0], xLegLimits[1], yLegLimits[1])
-legKstar.SetFillStyle(0)
-legKstar.SetTextSize(legTextSize)
-legKstar.SetNColumns(ncolumns)
-if legHeader is not None:
-    legKstar.SetHeader(legHeader, 'C')
-
-cRejFac = TCanvas('cRejFac', '', 1000, 800)
-cCharmMass = TCanvas('cCharmMass', '', wCanv, hCanv)
-cBeautyMass = TCanvas('cBeautyMass', '', wCanv, hCanv)
-cHighPt = TCanvas('cHighPt', '', wCanv, hCanv)
-cKstar = TCanvas('cKstar', '', wCanv, hCanv)
-
-cCharmMass.Divide(3, 2)
-cBeautyMass.Divide(3, 2)
-cHighPt.Divide(3, 2)
-cKstar.Divide(3, 2)
-
-line = TLine(-0.5, 1, 10.5, 1)
-line.SetLineColor(1)
-line.SetLineWidth(2)
-line.SetLineStyle(2)
-
-for i, (hrejfactor, hcharmmass, hbeautymass, hhighpt, hkstar, color, marker,
-        fillstyle) in enumerate(
-            zip(ReJFactor, CharmMass, BeautyMass, HighPt, ProtonKstar, colors,
-                markers, fillstyles)):
-
-    cRejFac.cd()
-    hrejfactor.SetBinContent(2, 1 - hrejfactor.GetBinContent(2))
-    hrejfactor.GetXaxis().SetBinLabel(2, "accpected")
-    hrejfactor.SetTitle("Rejection fractor;;Rejection fractor")
-    gPad.SetLogy()
-    gPad.SetGridx()
-    gPad.SetGridy()
-    print(hrejfactor.GetBinContent(2))
-    legRej.AddEntry(hrejfactor, legNames[i], legOpt[i])
-    hrejfactor.Draw('same')
-    legRej.Draw('same')
-    line.Draw()
-    hrejfactor.GetYaxis().SetRangeUser(hrejfactor.GetMinimum() * 0.002,
-                                       hrejfactor.GetMaximum() * 50)
-    SetObjectStyle(hrejfactor,
-                   color=GetROOTColor(color),
-                   markerstyle=GetROOTMarker(marker),
-                   markersize=markersize,
-                   linewidth=linewidth,
-                   fillstyle=fillstyle)
-
-    for p, (par_c, par_b, xl_c, xh_c, xl_b, xh_b, xT_c, xT_b, yT, pl, ph, kl,
-            kh) in enumerate(
-                zip_longest(particle_c, particle_b, xLimitslow_c,
-                            xLimitshigh_c, xLimitslow_b, xLimitshigh_b,
-                            xTitle_c, xTitle_b, yTitle, ptlow, pthigh,
-                            kstarlow, kstarhigh)):
-        if i == 0:
-            cCharmMass.cd(p + 1).DrawFrame(xl_c,
-                                           hcharmmass[p].GetMaximum() * 10e-5,
-                                           xh_c,
-                                           hcharmmass[p].GetMaximum() * 20,
-                                           f'{par_c};{xT_c};{yT}')
-            hcharmmass[p].Draw('same e')
-            gPad.SetLogy()
-            cBeautyMass.cd(p + 1).DrawFrame(
-                xl_b, hbeautymass[p].GetMaximum() * 10e-5, xh_b,
-                hbeautymass[p].GetMaximum() * 30, f'{par_b};{xT_b};{yT}')
-            hbeautymass[p].Draw('same e')
-            gPad.SetLogy()
-
-            if p < 4:
-                cHighPt.cd(p + 1).DrawFrame(pl,
-                                            hhighpt[p].GetMaximum() * 10e-5,
-                                            ph, hhighpt[p].GetMaximum() * 10,
-                                            f'{par_c};{xTitle_h};{yT}')
-                hhighpt[p].Draw('same e')
-                gPad.SetLogy()
-
-                cKstar.cd(p + 1).DrawFrame(kl, hkstar[p].GetMaximum() * 10e-5,
-                                           kh, hkstar[p].GetMaximum() * 10,
-                                           f'{par_c};{xTitle_k};{yT}')
-                hkstar[p].Draw('same e')
-                gPad.SetLogy()
-
-        else:
-            cCharmMass.cd(p + 1)
-            hcharmmass[p].Draw('same e')
-            cBeautyMass.cd(p + 1)
-            hbeautymass[p].Draw('same e')
-            if p < 4:
-                cHighPt.cd(p + 1)
-                hhighpt[p].Draw('same e')
-                cKstar.cd(p + 1)
-                hkstar[p].Draw('same e')
-
-        if p == 0:
-            cCharmMass.cd(p + 1)
-            legCmass.AddEntry(hcharmmass[p], legNames[i], legOpt[i])
-            legCmass.Draw()
-            cBeautyMass.cd(p + 1)
-            legBmass.AddEntry(hbeautymass[p], legNames[i], legOpt[i])
-            legBmass.Draw()
-            cHighPt.cd(p + 1)
-            legHighpt.AddEntry(hhighpt[p], legNames[i], legOpt[i])
-            legHighpt.Draw()
-            cKstar.cd(p + 1)
-            legKstar.AddEntry(hkstar[p], legNames[i], legOpt[i])
-            legKstar.Draw()
-
-        SetObjectStyle(hcharmmass[p],
+from pyutils.LazyROOT import ROOT  # pylint: disable=wrong-import-position,import-error
+# ROOT is loaded only when the style is applied or the histograms are drawn
+from pyutils.StyleFormatter import (SetGlobalStyle, SetObjectStyle,  # pylint: disable=wrong-import-position,import-error
+                                    GetROOTColor, GetROOTMarker)
+
+
+def MakeTH1(histo, name):
+    '''
+    Helper method to build a TH1 for drawing from the numpy histograms of hf_filter_histos
+    '''
+    edges = np.asarray(histo['edges'], dtype=np.float64)
+    hist = ROOT.TH1D(name, name, len(edges) - 1, edges)
+    hist.SetDirectory(0)
+    for iBin, (value, error) in enumerate(zip(histo['values'], histo['errors'])):
+        hist.SetBinContent(iBin + 1, value)
+        hist.SetBinError(iBin + 1, error)
+    if histo['labels'] is not None:
+        for iBin, label in enumerate(histo['labels']):
+            hist.GetXaxis().SetBinLabel(iBin + 1, label)
+    return hist
+
+
+def ExpandConfigs(cfgPatterns):
+    '''
+    Helper method to expand the config file names and glob patterns
+
+    Arguments
+    ----------
+    - cfgPatterns: list of config file names or glob patterns
+
+    Returns
+    ----------
+    - cfgFileNames: sorted list of config files, without duplicates
+    '''
+    cfgFileNames = []
+    for pattern in cfgPatterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            print(f"\033[93mWARNING: no config file matching {pattern}, skipped\033[0m")
+        cfgFileNames += matches
+    return list(dict.fromkeys(cfgFileNames))
+
+
+def LoadInputs(inputCfg, nJobs=None):
+    '''
+    Helper method to read the registry histograms of all the files of a config
+
+    Arguments
+    ----------
+    - inputCfg: dictionary with the config read from the yaml file
+    - nJobs: number of files read in parallel (value of the config if None)
+
+    Returns
+    ----------
+    - inFileNames: list of input files
+    - histosPerFile: list of dictionaries (one per file) from hf_filter_histos.load_histos
+    '''
+    inDirName = inputCfg['inputs']['dirname']
+    inFileNames = [join(inDirName, inFileName) if inDirName else inFileName
+                   for inFileName in inputCfg['inputs']['filenames']]
+    histoNames = get_histo_names(inputCfg['inputs']['charmhadron'], inputCfg['inputs']['beautyhadron'])
+    if nJobs is None:
+        nJobs = inputCfg['inputs'].get('njobs', 4)
+    histosPerFile = load_histos(inFileNames, histoNames, nJobs, inputCfg['inputs'].get('cachedir'))
+    return inFileNames, histosPerFile
+
+
+def ComputeVariationTable(inputCfg, cfgFileName, inFileNames, histosPerFile):
+    '''
+    Method to compute the trigger fractions, rejection factors and per-species yields of each variation
+
+    Arguments
+    ----------
+    - inputCfg: dictionary with the config read from the yaml file
+    - cfgFileName: name of the config file
+    - inFileNames: list of input files
+    - histosPerFile: list of dictionaries (one per file) from hf_filter_histos.load_histos
+
+    Returns
+    ----------
+    - table: pandas dataframe with one row per input file. The fProcessedEvents bins are given as
+      fraction of events (the second bin is converted to the accepted fraction as in the plots)
+      with the corresponding rejection factor = 1 / fraction, while the yields are the integrals
+      of the normalised mass, high-pT and k* projections (counts per event)
+    '''
+    particlesC = inputCfg['inputs']['charmhadron']
+    particlesB = inputCfg['inputs']['beautyhadron']
+    legNames = inputCfg['options']['legend']['titles']
+    rows = []
+    for iFile, (inFileName, histos) in enumerate(zip(inFileNames, histosPerFile)):
+        row = {'config': cfgFileName,
+               'variation': legNames[iFile] if iFile < len(legNames) else basename(inFileName),
+               'file': inFileName,
+               'n_events': histos['n_events']}
+
+        events = histos['fProcessedEvents']
+        fractions = np.array(events['values'], dtype=np.float64)
+        labels = list(events['labels']) if events['labels'] is not None else \
+            [str(iBin + 1) for iBin in range(len(fractions))]
+        fractions[1] = 1 - fractions[1]
+        labels[1] = 'accepted'
+        rejFactors = np.full_like(fractions, np.inf)
+        np.divide(1., fractions, out=rejFactors, where=fractions > 0)
+        for iBin, (label, fraction, rejFactor) in enumerate(zip(labels, fractions, rejFactors)):
+            label = label.replace(' ', '_')
+            row[f'fraction_{label}'] = fraction
+            if iBin > 0:
+                row[f'rejection_{label}'] = rejFactor
+
+        for iPart, (partC, partB) in enumerate(zip(particlesC, particlesB)):
+            row[f'yield_{partC}'] = np.sum(histos[f'fMassVsPt{partC}']['values'])
+            row[f'yield_{partB}'] = np.sum(histos[f'fMassVsPt{partB}']['values'])
+            if iPart < 4:
+                row[f'yield_highpt_{partC}'] = np.sum(histos[f'f{partC}HighPt']['values'])
+                row[f'yield_kstar_{partC}'] = np.sum(histos[f'f{partC}ProtonKstarDistr']['values'])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def ProcessConfig(cfgFileName, nJobs=None):
+    '''
+    Method to read the inputs of a config and compute its table, run in the worker pool in batch mode
+
+    Returns
+    ----------
+    - inputCfg: dictionary with the config read from the yaml file
+    - table: output of ComputeVariationTable
+    - histosPerFile: list of dictionaries (one per file) from hf_filter_histos.load_histos
+    '''
+    with open(cfgFileName, 'r') as ymlCfgFile:
+        inputCfg = yaml.load(ymlCfgFile, yaml.FullLoader)
+    inFileNames, histosPerFile = LoadInputs(inputCfg, nJobs)
+    table = ComputeVariationTable(inputCfg, cfgFileName, inFileNames, histosPerFile)
+    return inputCfg, table, histosPerFile
+
+
+def DrawComparison(inputCfg, histosPerFile, pdfPrefix='', suffix='', outFileName=None):
+    '''
+    Method to draw the comparison of the variations of a config and save it in the output
+    root file (and pdf files)
+
+    Arguments
+    ----------
+    - inputCfg: dictionary with the config read from the yaml file
+    - histosPerFile: list of dictionaries (one per file) from hf_filter_histos.load_histos
+    - pdfPrefix: prefix of the names of the pdf files
+    - suffix: suffix of the names of the canvases and histograms, to keep those of different
+      configs alive at the same time
+    - outFileName: name of the output root file without extension, output/filename of the config if None
+
+    Returns
+    ----------
+    - drawnObjects: list of the ROOT objects drawn, to be kept alive for interactive display
+    '''
+    # pylint: disable=too-many-locals,too-many-statements
+
+    particle_c = inputCfg['inputs']['charmhadron']
+    particle_b = inputCfg['inputs']['beautyhadron']
+
+    if outFileName is None:
+        outFileName = inputCfg['output']['filename']
+
+    colors = inputCfg['options']['colors']
+    markers = inputCfg['options']['markers']
+    markersize = inputCfg['options']['markersize']
+    linewidth = inputCfg['options']['linewidth']
+    fillstyles = inputCfg['options']['fillstyle']
+
+    wCanv = inputCfg['options']['canvas']['width']
+    hCanv = inputCfg['options']['canvas']['heigth']
+    xLimitslow_c = inputCfg['options']['histos']['xLimitslow_c']
+    xLimitshigh_c = inputCfg['options']['histos']['xLimitshigh_c']
+    xLimitslow_b = inputCfg['options']['histos']['xLimitslow_b']
+    xLimitshigh_b = inputCfg['options']['histos']['xLimitshigh_b']
+
+    xTitle_c = inputCfg['options']['histos']['xaxistitle_c']
+    xTitle_b = inputCfg['options']['histos']['xaxistitle_b']
+    xTitle_h = inputCfg['options']['histos']['xaxistitle_hightpt']
+    xTitle_k = inputCfg['options']['histos']['xaxistitle_kstar']
+
+    yTitle = inputCfg['options']['histos']['yaxistitle']
+    ptlow = inputCfg['options']['histos']['ptlow']
+    pthigh = inputCfg['options']['histos']['pthigh']
+    kstarlow = inputCfg['options']['histos']['kstarlow']
+    kstarhigh = inputCfg['options']['histos']['kstarhigh']
+
+    xLegLimits = inputCfg['options']['legend']['xlimits']
+    yLegLimits = inputCfg['options']['legend']['ylimits']
+    legHeader = inputCfg['options']['legend']['header']
+    legNames = inputCfg['options']['legend']['titles']
+    legOpt = inputCfg['options']['legend']['options']
+    legTextSize = inputCfg['options']['legend']['textsize']
+    ncolumns = inputCfg['options']['legend']['ncolumns']
+
+    # set global style
+    SetGlobalStyle(padbottommargin=0.14,
+                   padtopmargin=0.08,
+                   padleftmargin=0.15,
+                   padrightmargin=0.1,
+                   titleoffsety=1.45,
+                   titleoffsetx=1.1,
+                   titlesize=0.05,
+                   labelsize=0.05,
+                   maxdigits=2,
+                   opttitle=1)
+
+    CharmMass, BeautyMass, HighPt, ProtonKstar = [], [], [], []
+    ReJFactor = []
+
+    for iFile, histos in enumerate(histosPerFile):
+        print(iFile, histos['n_events'])
+        ReJFactor.append(MakeTH1(histos['fProcessedEvents'], f'hRej{iFile}{suffix}'))
+
+        CharmMass.append([])
+        BeautyMass.append([])
+        HighPt.append([])
+        ProtonKstar.append([])
+        for i, (parc, parb) in enumerate(zip(particle_c, particle_b)):
+            CharmMass[iFile].append(MakeTH1(histos[f'fMassVsPt{parc}'], f'{parc}{iFile}{suffix}'))
+            BeautyMass[iFile].append(MakeTH1(histos[f'fMassVsPt{parb}'], f'{parb}{iFile}{suffix}'))
+            if i < 4:
+                HighPt[iFile].append(MakeTH1(histos[f'f{parc}HighPt'], f'Highpt{parc}{iFile}{suffix}'))
+                ProtonKstar[iFile].append(MakeTH1(histos[f'f{parc}ProtonKstarDistr'], f'hkstar{parb}{iFile}{suffix}'))
+
+    legends = []
+    for _ in range(5):
+        leg = ROOT.TLegend(xLegLimits[0], yLegLimits[0], xLegLimits[1], yLegLimits[1])
+        leg.SetFillStyle(0)
+        leg.SetTextSize(legTextSize)
+        leg.SetNColumns(ncolumns)
+        if legHeader is not None:
+            leg.SetHeader(legHeader, 'C')
+        legends.append(leg)
+    legRej, legCmass, legBmass, legHighpt, legKstar = legends
+
+    cRejFac = ROOT.TCanvas(f'cRejFac{suffix}', '', 1000, 800)
+    cCharmMass = ROOT.TCanvas(f'cCharmMass{suffix}', '', wCanv, hCanv)
+    cBeautyMass = ROOT.TCanvas(f'cBeautyMass{suffix}', '', wCanv, hCanv)
+    cHighPt = ROOT.TCanvas(f'cHighPt{suffix}', '', wCanv, hCanv)
+    cKstar = ROOT.TCanvas(f'cKstar{suffix}', '', wCanv, hCanv)
+
+    cCharmMass.Divide(3, 2)
+    cBeautyMass.Divide(3, 2)
+    cHighPt.Divide(3, 2)
+    cKstar.Divide(3, 2)
+
+    line = ROOT.TLine(-0.5, 1, 10.5, 1)
+    line.SetLineColor(1)
+    line.SetLineWidth(2)
+    line.SetLineStyle(2)
+
+    for i, (hrejfactor, hcharmmass, hbeautymass, hhighpt, hkstar, color, marker,
+            fillstyle) in enumerate(
+                zip(ReJFactor, CharmMass, BeautyMass, HighPt, ProtonKstar, colors,
+                    markers, fillstyles)):
+
+        cRejFac.cd()
+        hrejfactor.SetBinContent(2, 1 - hrejfactor.GetBinContent(2))
+        hrejfactor.GetXaxis().SetBinLabel(2, "accpected")
+        hrejfactor.SetTitle("Rejection fractor;;Rejection fractor")
+        ROOT.gPad.SetLogy()
+        ROOT.gPad.SetGridx()
+        ROOT.gPad.SetGridy()
+        print(hrejfactor.GetBinContent(2))
+        legRej.AddEntry(hrejfactor, legNames[i], legOpt[i])
+        hrejfactor.Draw('same')
+        legRej.Draw('same')
+        line.Draw()
+        hrejfactor.GetYaxis().SetRangeUser(hrejfactor.GetMinimum() * 0.002,
+                                           hrejfactor.GetMaximum() * 50)
+        SetObjectStyle(hrejfactor,
                        color=GetROOTColor(color),
                        markerstyle=GetROOTMarker(marker),
                        markersize=markersize,
                        linewidth=linewidth,
                        fillstyle=fillstyle)
-        SetObjectStyle(hbeautymass[p],
-                       color=GetROOTColor(color),
-                       markerstyle=GetROOTMarker(marker),
-                       markersize=markersize,
-                       linewidth=linewidth,
-                       fillstyle=fillstyle)
-        if p < 4:
-            SetObjectStyle(hhighpt[p],
+
+        for p, (par_c, par_b, xl_c, xh_c, xl_b, xh_b, xT_c, xT_b, yT, pl, ph, kl,
+                kh) in enumerate(
+                    zip_longest(particle_c, particle_b, xLimitslow_c,
+                                xLimitshigh_c, xLimitslow_b, xLimitshigh_b,
+                                xTitle_c, xTitle_b, yTitle, ptlow, pthigh,
+                                kstarlow, kstarhigh)):
+            if i == 0:
+                cCharmMass.cd(p + 1).DrawFrame(xl_c,
+                                               hcharmmass[p].GetMaximum() * 10e-5,
+                                               xh_c,
+                                               hcharmmass[p].GetMaximum() * 20,
+                                               f'{par_c};{xT_c};{yT}')
+                hcharmmass[p].Draw('same e')
+                ROOT.gPad.SetLogy()
+                cBeautyMass.cd(p + 1).DrawFrame(
+                    xl_b, hbeautymass[p].GetMaximum() * 10e-5, xh_b,
+                    hbeautymass[p].GetMaximum() * 30, f'{par_b};{xT_b};{yT}')
+                hbeautymass[p].Draw('same e')
+                ROOT.gPad.SetLogy()
+
+                if p < 4:
+                    cHighPt.cd(p + 1).DrawFrame(pl,
+                                                hhighpt[p].GetMaximum() * 10e-5,
+                                                ph, hhighpt[p].GetMaximum() * 10,
+                                                f'{par_c};{xTitle_h};{yT}')
+                    hhighpt[p].Draw('same e')
+                    ROOT.gPad.SetLogy()
+
+                    cKstar.cd(p + 1).DrawFrame(kl, hkstar[p].GetMaximum() * 10e-5,
+                                               kh, hkstar[p].GetMaximum() * 10,
+                                               f'{par_c};{xTitle_k};{yT}')
+                    hkstar[p].Draw('same e')
+                    ROOT.gPad.SetLogy()
+
+            else:
+                cCharmMass.cd(p + 1)
+                hcharmmass[p].Draw('same e')
+                cBeautyMass.cd(p + 1)
+                hbeautymass[p].Draw('same e')
+                if p < 4:
+                    cHighPt.cd(p + 1)
+                    hhighpt[p].Draw('same e')
+                    cKstar.cd(p + 1)
+                    hkstar[p].Draw('same e')
+
+            if p == 0:
+                cCharmMass.cd(p + 1)
+                legCmass.AddEntry(hcharmmass[p], legNames[i], legOpt[i])
+                legCmass.Draw()
+                cBeautyMass.cd(p + 1)
+                legBmass.AddEntry(hbeautymass[p], legNames[i], legOpt[i])
+                legBmass.Draw()
+                cHighPt.cd(p + 1)
+                legHighpt.AddEntry(hhighpt[p], legNames[i], legOpt[i])
+                legHighpt.Draw()
+                cKstar.cd(p + 1)
+                legKstar.AddEntry(hkstar[p], legNames[i], legOpt[i])
+                legKstar.Draw()
+
+            SetObjectStyle(hcharmmass[p],
                            color=GetROOTColor(color),
                            markerstyle=GetROOTMarker(marker),
                            markersize=markersize,
                            linewidth=linewidth,
                            fillstyle=fillstyle)
-            SetObjectStyle(hkstar[p],
+            SetObjectStyle(hbeautymass[p],
                            color=GetROOTColor(color),
                            markerstyle=GetROOTMarker(marker),
                            markersize=markersize,
                            linewidth=linewidth,
                            fillstyle=fillstyle)
-
-outFile = TFile(f'{outFileName}.root', 'recreate')
-cRejFac.Write()
-cCharmMass.Write()
-cBeautyMass.Write()
-cHighPt.Write()
-cKstar.Write()
-cRejFac.SaveAs("RecFractor.pdf")
-cCharmMass.SaveAs("CharmInvMass.pdf")
-cBeautyMass.SaveAs("BeautyInvMass.pdf")
-cHighPt.SaveAs("HighPt.pdf")
-cKstar.SaveAs("ProtonKstarDis.pdf")
-
-input("Press enter to exit")
+            if p < 4:
+                SetObjectStyle(hhighpt[p],
+                               color=GetROOTColor(color),
+                               markerstyle=GetROOTMarker(marker),
+                               markersize=markersize,
+                               linewidth=linewidth,
+                               fillstyle=fillstyle)
+                SetObjectStyle(hkstar[p],
+                               color=GetROOTColor(color),
+                               markerstyle=GetROOTMarker(marker),
+                               markersize=markersize,
+                               linewidth=linewidth,
+                               fillstyle=fillstyle)
+
+    outFile = ROOT.TFile(f'{outFileName}.root', 'recreate')
+    cRejFac.Write('cRejFac')
+    cCharmMass.Write('cCharmMass')
+    cBeautyMass.Write('cBeautyMass')
+    cHighPt.Write('cHighPt')
+    cKstar.Write('cKstar')
+    outFile.Close()
+    cRejFac.SaveAs(f"{pdfPrefix}RecFractor.pdf")
+    cCharmMass.SaveAs(f"{pdfPrefix}CharmInvMass.pdf")
+    cBeautyMass.SaveAs(f"{pdfPrefix}BeautyInvMass.pdf")
+    cHighPt.SaveAs(f"{pdfPrefix}HighPt.pdf")
+    cKstar.SaveAs(f"{pdfPrefix}ProtonKstarDis.pdf")
+
+    return [ReJFactor, CharmMass, BeautyMass, HighPt, ProtonKstar, legends, line,
+            cRejFac, cCharmMass, cBeautyMass, cHighPt, cKstar]
+
+
+def WriteTable(table, outTableName):
+    '''
+    Helper method to write the consolidated table, in parquet format if the name ends with .parquet
+    and in csv format otherwise
+    '''
+    if outTableName.endswith('.parquet'):
+        table.to_parquet(outTableName, index=False)
+    else:
+        table.to_csv(outTableName, index=False)
+    print(f"\033[32mTable of {len(table)} variations saved in {outTableName}\033[0m")
+
+
+def main(cfgPatterns, batch=False, nJobs=1, outTableName=None, doPlots=False):
+    '''
+    Main function
+
+    Arguments
+    ----------
+    - cfgPatterns: list of config file names or glob patterns
+    - batch: if True, the configs are processed in a worker pool without interaction
+      and plots are produced only if doPlots is True
+    - nJobs: number of configs processed in parallel in batch mode
+    - outTableName: name of the output table (csv or parquet)
+    - doPlots: produce the plots in batch mode
+    '''
+    cfgFileNames = ExpandConfigs(cfgPatterns)
+    if not cfgFileNames:
+        print("\033[91mERROR: no config file found. Exit!\033[0m")
+        sys.exit(1)
+
+    try:
+        if batch and nJobs > 1 and len(cfgFileNames) > 1:
+            # each worker reads its files sequentially, the configs are parallelised
+            with ProcessPoolExecutor(max_workers=nJobs) as executor:
+                outputs = list(executor.map(partial(ProcessConfig, nJobs=1), cfgFileNames))
+        else:
+            outputs = [ProcessConfig(cfgFileName) for cfgFileName in cfgFileNames]
+    except FileNotFoundError as err:
+        print(f"ERROR: {err}. Check your config. Exit!")
+        sys.exit(1)
+
+    table = pd.concat([output[1] for output in outputs], ignore_index=True)
+    print(table.to_string(index=False))
+    if outTableName:
+        WriteTable(table, outTableName)
+
+    if batch and not doPlots:
+        return
+
+    if batch:
+        ROOT.gROOT.SetBatch(True)
+    # with several configs (which often share output/filename) the root and pdf files are tagged with
+    # the config name, or with its index if the names are not unique
+    cfgTags = [splitext(basename(cfgFileName))[0] for cfgFileName in cfgFileNames]
+    if len(set(cfgTags)) < len(cfgTags):
+        cfgTags = [f'cfg{iCfg}' for iCfg in range(len(cfgFileNames))]
+    drawnObjects = []
+    for iCfg, (inputCfg, _, histosPerFile) in enumerate(outputs):
+        outFileName = inputCfg['output']['filename']
+        if len(outputs) > 1:
+            outFileName = f'{outFileName}_{cfgTags[iCfg]}'
+        pdfPrefix = f'{outFileName}_' if batch or len(outputs) > 1 else ''
+        drawnObjects.append(DrawComparison(inputCfg, histosPerFile, pdfPrefix, f'_cfg{iCfg}', outFileName))
+
+    if not batch:
+        input("Press enter to exit")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Arguments')
+    parser.add_argument('cfgFileNames',
+                        metavar='text',
+                        nargs='+',
+                        help='config files or glob patterns')
+    parser.add_argument('--batch', action='store_true', default=False,
+                        help='process the configs without interaction')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of configs processed in parallel in batch mode')
+    parser.add_argument('--outtable', default=None,
+                        help='output table with all the variations (.csv or .parquet)')
+    parser.add_argument('--plots', action='store_true', default=False,
+                        help='produce the plots also in batch mode')
+    args = parser.parse_args()
+
+    main(args.cfgFileNames, args.batch, args.jobs, args.outtable, args.plots)
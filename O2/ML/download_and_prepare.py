@@ -0,0 +1,179 @@
+"""
+Script for the download of the train outputs overlapped with the preparation of the samples:
+each AO2D file is queued for the conversion to parquet in a pool of workers as soon as its
+download is complete. The number of AO2D files downloaded but not yet converted is bounded,
+so that the downloads do not fill the local disk, and the AO2D files can be deleted once the
+parquet files produced from them have been verified
+run: python download_and_prepare.py list.txt outpath [--backend local] [--jobs 8] [--workers 4]
+                                     [--max_pending 8] [--delete_raw]
+"""
+
+import os
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from download_train_output import get_backend, read_list_of_dirs, collect_files, download_file
+from prepare_samples import prepare_file, get_output_files
+
+
+def verify_outputs(output_files, verbose=True):
+    """
+    Helper function to check that the parquet files produced from an AO2D file are readable
+
+    Parameters
+    -----------------
+    - output_files: list of parquet files
+    - verbose: print the invalid files
+
+    Outputs
+    -----------------
+    - is_valid: True if all the files exist and their metadata can be read
+    """
+    for output_file in output_files:
+        try:
+            pq.read_metadata(output_file)
+        except (OSError, pa.ArrowException) as err:
+            if verbose:
+                print(f"\033[91mERROR: invalid output {output_file}: {err}\033[0m")
+            return False
+    return True
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+async def run_pipeline(backend, list_of_dirs, outpath, n_jobs=8, n_workers=4, max_pending=8,
+                       check="size", retries=3, backoff=2., downscale_bkg=1., force=False,
+                       do_smearing=False, delete_raw=False, bit_index=False,
+                       prepare_function=prepare_file):
+    """
+    Function to run the download and the preparation of the samples as a producer/consumer pipeline
+
+    Parameters
+    -----------------
+    - backend: storage backend
+    - list_of_dirs: list of train output directories
+    - outpath: output path
+    - n_jobs: maximum number of concurrent transfers
+    - n_workers: number of AO2D files converted in parallel
+    - max_pending: maximum number of AO2D files downloaded (or being downloaded) but not yet converted
+    - check: completeness check of the files already downloaded, options: size, md5
+    - retries: number of retries of each transfer
+    - backoff: waiting time before the first retry (s)
+    - downscale_bkg: fraction of bkg to be kept
+    - force: force re-creation of output files
+    - do_smearing: do smearing on the dca of daughter tracks
+    - delete_raw: delete the AO2D files once their outputs have been verified
+    - bit_index: write the bitmap index of fHFSelBit next to each output
+    - prepare_function: function converting one AO2D file, returning the list of parquet files
+
+    Outputs
+    -----------------
+    - statuses: dictionary {local path: status}, with status "skipped", "downloaded" or "failed" for
+      the files other than AO2D and "prepared", "download failed" or "preparation failed" for the AO2D
+    """
+    loop = asyncio.get_running_loop()
+    transfers = asyncio.Semaphore(n_jobs)
+    pending = asyncio.Semaphore(max_pending)
+    files = await collect_files(backend, list_of_dirs, outpath, semaphore=transfers)
+    n_ao2d = sum(os.path.basename(local) == "AO2D.root" for _, local in files)
+    print(f"\033[32mDownload {len(files)} files ({n_ao2d} AO2D to be prepared) "
+          f"from {len(list_of_dirs)} directories\033[0m")
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        prepare = partial(prepare_function, downscale_bkg=downscale_bkg, force=force, do_smearing=do_smearing,
+                          bit_index=bit_index)
+
+        async def process(remote, local):
+            if os.path.basename(local) != "AO2D.root":
+                return await download_file(backend, remote, local, transfers, check, retries, backoff)
+            # AO2D files already prepared (and possibly deleted) in a previous run are not downloaded again
+            if not force and await asyncio.to_thread(verify_outputs, get_output_files(os.path.dirname(local)), False):
+                return "prepared"
+            # the slot is released only once the AO2D file has been converted (backpressure)
+            async with pending:
+                status = await download_file(backend, remote, local, transfers, check, retries, backoff)
+                if status == "failed":
+                    return "download failed"
+                try:
+                    output_files = await loop.run_in_executor(executor, prepare, local)
+                except Exception as err:  # pylint: disable=broad-except
+                    print(f"\033[91mERROR: preparation of {local} failed: {err}\033[0m")
+                    return "preparation failed"
+                if not await asyncio.to_thread(verify_outputs, output_files):
+                    return "preparation failed"
+                if delete_raw:
+                    os.remove(local)
+                print(f"\033[32mPrepared {local}\033[0m")
+                return "prepared"
+
+        statuses = await asyncio.gather(*[process(remote, local) for remote, local in files])
+    return {local: status for (_, local), status in zip(files, statuses)}
+
+
+# main function
+
+
+def main(infile, outpath, backend_name="alien", n_jobs=8, n_workers=4, max_pending=8, check="size",
+         retries=3, backoff=2., downscale_bkg=1., force=False, do_smearing=False, delete_raw=False,
+         bit_index=False):
+    """
+    Main function
+
+    Parameters
+    -----------------
+    - infile: input file with list of directories separated by ','
+    - outpath: output path
+    - backend_name: storage backend, options: alien, local
+    - see run_pipeline for the other parameters
+    """
+
+    list_of_dirs = read_list_of_dirs(infile, backend_name)
+    statuses = asyncio.run(run_pipeline(get_backend(backend_name), list_of_dirs, outpath, n_jobs, n_workers,
+                                        max_pending, check, retries, backoff, downscale_bkg, force,
+                                        do_smearing, delete_raw, bit_index))
+    counts = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    print("\033[32m" + ", ".join(f"{status}: {count}" for status, count in sorted(counts.items())) + "\033[0m")
+    return all(status in ["skipped", "downloaded", "prepared"] for status in statuses.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Arguments")
+    parser.add_argument("infile", metavar="text", default="list.txt",
+                        help="list of directories with input files")
+    parser.add_argument("outpath", metavar="text", default=".",
+                        help="output path")
+    parser.add_argument("--backend", default="alien", choices=["alien", "local"],
+                        help="storage backend")
+    parser.add_argument("--jobs", type=int, default=8,
+                        help="maximum number of concurrent transfers")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="number of AO2D files prepared in parallel")
+    parser.add_argument("--max_pending", type=int, default=8,
+                        help="maximum number of AO2D files downloaded but not yet prepared")
+    parser.add_argument("--check", default="size", choices=["size", "md5"],
+                        help="completeness check of the files already downloaded")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="number of retries of each transfer")
+    parser.add_argument("--backoff", type=float, default=2.,
+                        help="waiting time before the first retry (s), doubled at each retry")
+    parser.add_argument("--downscale_bkg", type=float, default=1.,
+                        help="fraction of bkg to be kept")
+    parser.add_argument("--force", action="store_true", default=False,
+                        help="force re-creation of output files")
+    parser.add_argument("--dosmearing", action="store_true", default=False,
+                        help="do smearing on the dca of daughter tracks ")
+    parser.add_argument("--delete_raw", action="store_true", default=False,
+                        help="delete the AO2D files once their parquet outputs have been verified")
+    parser.add_argument("--bitindex", action="store_true", default=False,
+                        help="keep fHFSelBit and write its bitmap index next to each output")
+    args = parser.parse_args()
+
+    if not main(args.infile, args.outpath, args.backend, args.jobs, args.workers, args.max_pending, args.check,
+                args.retries, args.backoff, args.downscale_bkg, args.force, args.dosmearing, args.delete_raw,
+                args.bitindex):
+        raise SystemExit(1)
@@ -1,15 +1,270 @@
 """
 Script for the download of files from hyperloop
+Files are downloaded concurrently (bounded number of transfers across all the directories),
+each transfer is retried with exponential backoff and files already downloaded (same size
+or same md5 checksum) are skipped, so that an interrupted download can be resumed.
+The storage is accessed through a backend: AliEn for the grid, or a local directory
+for offline mirrors and tests
+run: python download_train_output.py list.txt outpath [--backend local] [--jobs 8] [--check md5]
 """
 
 import os
+import re
+import shutil
+import fnmatch
+import hashlib
+import asyncio
 import argparse
-from ROOT import TGrid  # pylint: disable=no-name-in-module
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+FileInfo = namedtuple("FileInfo", ["size", "md5"])
+
+
+def get_md5(file_name, chunk_size=1 << 22):
+    """
+    Helper function to compute the md5 checksum of a local file
+    """
+    md5 = hashlib.md5()
+    with open(file_name, "rb") as in_file:
+        for chunk in iter(lambda: in_file.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class StorageBackend(ABC):
+    """
+    Abstract interface of the storage from which the train outputs are downloaded
+    """
+
+    @abstractmethod
+    async def list_dir(self, path):
+        """
+        Method to list the names of the entries of a directory
+        """
+
+    @abstractmethod
+    async def list_files(self, path, pattern):
+        """
+        Method to list recursively the files below a directory whose name matches a pattern
+        """
+
+    @abstractmethod
+    async def stat(self, path, checksum=False):
+        """
+        Method to get the size (and the md5 checksum if requested, None otherwise) of a file
+        """
+
+    @abstractmethod
+    async def fetch(self, path, local_path):
+        """
+        Method to copy a file to a local path
+        """
+
+
+class AlienBackend(StorageBackend):
+    """
+    Backend for the AliEn grid, based on the alien.py command-line tools
+    """
+
+    def __init__(self, n_sources=2):
+        self.n_sources = n_sources
+
+    @staticmethod
+    async def _run(*command):
+        proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} failed with exit code {proc.returncode}: "
+                               f"{stderr.decode().strip()}")
+        return stdout.decode()
+
+    async def list_dir(self, path):
+        output = await self._run("alien_ls", path)
+        return [line.strip().rstrip("/") for line in output.splitlines() if line.strip()]
+
+    async def list_files(self, path, pattern):
+        output = await self._run("alien_find", path, pattern)
+        return [line.strip() for line in output.splitlines() if line.strip().startswith("/")]
+
+    async def stat(self, path, checksum=False):
+        output = await self._run("alien_stat", path)
+        size = re.search(r"Size:\s*(\d+)", output)
+        md5 = re.search(r"MD5:\s*([0-9a-fA-F]{32})", output)
+        if size is None:
+            raise RuntimeError(f"cannot parse the size of {path} from alien_stat")
+        return FileInfo(int(size.group(1)), md5.group(1).lower() if md5 and checksum else None)
+
+    async def fetch(self, path, local_path):
+        await self._run("alien_cp", "-y", str(self.n_sources), f"alien://{path}", f"file://{local_path}")
+
+
+class LocalBackend(StorageBackend):
+    """
+    Backend for a local directory tree with the same layout as the grid
+    """
+
+    async def list_dir(self, path):
+        return sorted(os.listdir(path))
+
+    async def list_files(self, path, pattern):
+        def find():
+            return sorted(os.path.join(root, file_name) for root, _, file_names in os.walk(path)
+                          for file_name in file_names if fnmatch.fnmatch(file_name, pattern))
+        return await asyncio.to_thread(find)
+
+    async def stat(self, path, checksum=False):
+        size = os.stat(path).st_size
+        return FileInfo(size, await asyncio.to_thread(get_md5, path) if checksum else None)
+
+    async def fetch(self, path, local_path):
+        await asyncio.to_thread(shutil.copyfile, path, local_path)
+
+
+def get_backend(name):
+    """
+    Helper function to get a storage backend by name
+    """
+    if name == "alien":
+        return AlienBackend()
+    if name == "local":
+        return LocalBackend()
+    raise ValueError(f"backend {name} not implemented, options: alien, local")
+
+
+def select_subdirs(subdirs):
+    """
+    Helper function to select the subdirectories to be downloaded: the merged AOD
+    directory if present, otherwise all the numbered job directories
+    """
+    for subdir in subdirs:
+        if "AOD" in subdir:
+            return [subdir]
+    return [subdir for subdir in subdirs if subdir.isdigit()]
+
+
+async def collect_files(backend, list_of_dirs, outpath, pattern="*root*", semaphore=None):
+    """
+    Function to list the files to be downloaded from all the directories
+
+    Parameters
+    -----------------
+    - backend: storage backend
+    - list_of_dirs: list of train output directories
+    - outpath: output path
+    - pattern: pattern of the names of the files to be downloaded
+    - semaphore: optional semaphore bounding the number of concurrent requests
+
+    Outputs
+    -----------------
+    - files: list of (remote path, local path), with local path outpath/jobdir/subdir/...
+    """
+    semaphore = semaphore or asyncio.Semaphore(8)
+
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    async def collect_dir(indir):
+        jobdir = indir.rstrip("/").split("/")[-1]
+        subdirs = select_subdirs(await bounded(backend.list_dir(indir)))
+        files = []
+        for subdir in subdirs:
+            remote_dir = f"{indir.rstrip('/')}/{subdir}"
+            for remote in await bounded(backend.list_files(remote_dir, pattern)):
+                local = os.path.join(outpath, jobdir, subdir, os.path.relpath(remote, remote_dir))
+                files.append((remote, local))
+        return files
+
+    files_per_dir = await asyncio.gather(*[collect_dir(indir) for indir in list_of_dirs])
+    return [file for files in files_per_dir for file in files]
+
+
+def is_complete(local, info):
+    """
+    Helper function to check whether a local file matches the remote one
+    """
+    if not os.path.isfile(local) or os.path.getsize(local) != info.size:
+        return False
+    return info.md5 is None or get_md5(local) == info.md5
+
+
+async def download_file(backend, remote, local, semaphore, check="size", retries=3, backoff=2.):
+    """
+    Function to download one file, with retries and exponential backoff
+
+    Parameters
+    -----------------
+    - backend: storage backend
+    - remote: remote path
+    - local: local path
+    - semaphore: semaphore bounding the number of concurrent transfers
+    - check: completeness check of existing files, options: size, md5
+    - retries: number of retries after the first attempt
+    - backoff: waiting time before the first retry, doubled at each retry (s)
+
+    Outputs
+    -----------------
+    - status: "skipped", "downloaded" or "failed"
+    """
+    for attempt in range(retries + 1):
+        try:
+            # the transfer slot is not kept while waiting for a retry
+            async with semaphore:
+                info = await backend.stat(remote, checksum=check == "md5")
+                if await asyncio.to_thread(is_complete, local, info):
+                    return "skipped"
+                os.makedirs(os.path.dirname(local), exist_ok=True)
+                # the file is moved to its final name only once complete
+                part = f"{local}.part"
+                await backend.fetch(remote, part)
+                if not await asyncio.to_thread(is_complete, part, info):
+                    raise RuntimeError(f"size or checksum mismatch for {remote}")
+                os.replace(part, local)
+                return "downloaded"
+        except (RuntimeError, OSError) as err:
+            if attempt == retries:
+                print(f"\033[91mERROR: download of {remote} failed after {retries + 1} attempts: {err}\033[0m")
+                return "failed"
+            wait = backoff * 2**attempt
+            print(f"\033[93mWARNING: {err}, retry in {wait:.0f} s\033[0m")
+            await asyncio.sleep(wait)
+    return "failed"
+
+
+async def download(backend, list_of_dirs, outpath, n_jobs=8, check="size", retries=3, backoff=2., pattern="*root*"):
+    """
+    Function to download the files of all the directories concurrently
+
+    Outputs
+    -----------------
+    - statuses: dictionary {local path: status}
+    """
+    semaphore = asyncio.Semaphore(n_jobs)
+    files = await collect_files(backend, list_of_dirs, outpath, pattern, semaphore)
+    print(f"\033[32mDownload {len(files)} files from {len(list_of_dirs)} directories\033[0m")
+    statuses = await asyncio.gather(*[download_file(backend, remote, local, semaphore, check, retries, backoff)
+                                      for remote, local in files])
+    return {local: status for (_, local), status in zip(files, statuses)}
+
+
+def read_list_of_dirs(infile, backend_name):
+    """
+    Helper function to read the list of directories separated by ','
+    """
+    with open(infile) as f_txt:  # pylint: disable=unspecified-encoding
+        contents = f_txt.read()
+    list_of_dirs = [indir.strip() for indir in contents.split(",") if indir.strip()]
+    if backend_name == "alien":
+        list_of_dirs = [indir.replace("alien://", "") for indir in list_of_dirs]
+    return list_of_dirs
+
 
 # main function
 
 
-def main(infile, outpath):
+def main(infile, outpath, backend_name="alien", n_jobs=8, check="size", retries=3, backoff=2.):
     """
     Main function
 
@@ -17,37 +272,20 @@ def main(infile, outpath):
     -----------------
     - infile: input file with list of directories separated by ','
     - outpath: output path
+    - backend_name: storage backend, options: alien, local
+    - n_jobs: maximum number of concurrent transfers
+    - check: completeness check of existing files, options: size, md5
+    - retries: number of retries of each transfer
+    - backoff: waiting time before the first retry (s)
     """
 
-    with open(infile) as f_txt:  # pylint: disable=unspecified-encoding
-        contents = f_txt.read()
-    list_of_dirs = contents.split(",")
-
-    grid = TGrid.Connect("alien://")
-
-    for i_dir, indir in enumerate(list_of_dirs):
-        jobdir = indir.split("/")[-1]
-        outdir = os.path.join(outpath, jobdir)
-        if not os.path.isdir(outdir):
-            os.mkdir(outdir)
-        list_of_subdirs = grid.Ls(indir.replace("alien://", ""))
-        print(f"\033[32mDownload outputs from directory {i_dir+1}/{len(list_of_dirs)}"
-              f" ({indir})\033[0m")
-        is_merged = -1
-        for i_sub, _ in enumerate(list_of_subdirs):
-            if "AOD" in list_of_subdirs.GetFileName(i_sub):
-                is_merged = i_sub
-                break
-        if is_merged >= 0:
-            subdir = list_of_subdirs.GetFileName(is_merged)
-            os.system("alien_cp -y 2 -T 32 -name contain_root "
-                      f"{indir}/{subdir} file://{outdir}")
-        else:
-            for i_sub, _ in enumerate(list_of_subdirs):
-                if list_of_subdirs.GetFileName(i_sub).isdigit():
-                    subdir = list_of_subdirs.GetFileName(i_sub)
-                    os.system("alien_cp -y 2 -T 32 -name contain_root "
-                            f"{indir}/{subdir} file://{outdir}")
+    list_of_dirs = read_list_of_dirs(infile, backend_name)
+    statuses = asyncio.run(download(get_backend(backend_name), list_of_dirs, outpath,
+                                    n_jobs, check, retries, backoff))
+    counts = {status: list(statuses.values()).count(status) for status in ["downloaded", "skipped", "failed"]}
+    print(f"\033[32mDownloaded: {counts['downloaded']}, skipped: {counts['skipped']}, "
+          f"failed: {counts['failed']}\033[0m")
+    return counts["failed"] == 0
 
 
 if __name__ == "__main__":
@@ -56,6 +294,17 @@ if __name__ == "__main__":
                         help="list of directories with input files")
     parser.add_argument("outpath", metavar="text", default=".",
                         help="output path")
+    parser.add_argument("--backend", default="alien", choices=["alien", "local"],
+                        help="storage backend")
+    parser.add_argument("--jobs", type=int, default=8,
+                        help="maximum number of concurrent transfers")
+    parser.add_argument("--check", default="size", choices=["size", "md5"],
+                        help="completeness check of the files already downloaded")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="number of retries of each transfer")
+    parser.add_argument("--backoff", type=float, default=2.,
+                        help="waiting time before the first retry (s), doubled at each retry")
     args = parser.parse_args()
 
-    main(args.infile, args.outpath)
+    if not main(args.infile, args.outpath, args.backend, args.jobs, args.check, args.retries, args.backoff):
+        raise SystemExit(1)
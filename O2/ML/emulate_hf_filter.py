@@ -0,0 +1,281 @@
+"""
+Script for the offline emulation of the hf-filter trigger decisions on the prepared candidate
+tables (e.g. the <channel>_ModelApplied.parquet.gzip files of train_hf_triggers.py): the pT
+thresholds, the BDT score cuts (per pT bin) and the beauty mass windows are read from the same
+keys of dpl-config-triggerHF.json, the decisions are computed as vectorised per-candidate masks and
+reduced per collision with np.bincount, and the fraction of triggered collisions (and rejection
+factor) of each category is returned without running the DPL workflow
+run: python emulate_hf_filter.py config_emulate_hf_filter.yml [--set hf-filter/pTThreshold2Prong=8 ...]
+                                 [--n_events 1000000] [--output trigger_fractions.csv]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import yaml
+
+sys.path.append("..")
+from run_filter_scan import set_parameter  # pylint: disable=wrong-import-position,import-error
+
+# channels of the hf-filter: number of prongs and table of the BDT thresholds
+CHANNELS = {"D0ToKPi": (2, "thresholdBDTScoreD0ToKPi"),
+            "DplusToPiKPi": (3, "thresholdBDFScoreDPlusToPiKPi"),
+            "DsToKKPi": (3, "thresholdBDFScoreDSToPiKK"),
+            "LcToPKPi": (3, "thresholdBDFScoreLcToPiKP"),
+            "XicToPKPi": (3, "thresholdBDFScoreXicToPiKP")}
+# beauty categories: mass window key, PDG mass (GeV/c2) and charm channels
+BEAUTY_CATEGORIES = {"BPlus": ("deltaMassBPlus", 5.27934, ["D0ToKPi"]),
+                     "B0": ("deltaMassB0", 5.27965, ["DplusToPiKPi"]),
+                     "Bs": ("deltaMassBs", 5.36688, ["DsToKKPi"]),
+                     "Lb": ("deltaMassLb", 5.61960, ["LcToPKPi"]),
+                     "Xib": ("deltaMassXib", 5.7970, ["XicToPKPi"])}
+SCORE_COLUMNS = ["ML_output_Bkg", "ML_output_Prompt", "ML_output_Nonprompt"]
+
+
+def to_float_array(values):
+    """
+    Helper function to convert the values of the DPL json (strings, possibly nested) to floats
+    """
+    return np.asarray(values, dtype=np.float64)
+
+
+def get_bdt_thresholds(filter_config, channel):
+    """
+    Function to get the BDT thresholds of a channel
+
+    Parameters
+    -----------------
+    - filter_config: dictionary with the hf-filter configuration
+    - channel: charm-hadron channel
+
+    Outputs
+    -----------------
+    - pt_bins: edges of the pT bins of the thresholds
+    - thresholds: array (pT bins, 3) with the thresholds on the bkg, prompt and nonprompt scores
+    """
+    pt_bins = to_float_array(filter_config["pTBinsBDT"]["values"])
+    thresholds = to_float_array(filter_config[CHANNELS[channel][1]]["values"]).reshape(-1, 3)
+    if len(thresholds) != len(pt_bins) - 1:
+        raise ValueError(f"{len(thresholds)} rows of BDT thresholds for {len(pt_bins) - 1} pT bins ({channel})")
+    return pt_bins, thresholds
+
+
+def get_bdt_tags(pt_cand, scores, pt_bins, thresholds):
+    """
+    Function to apply the BDT selection of the hf-filter to all the candidates at once: the candidates
+    with bkg score above the threshold are rejected, the others are tagged as prompt (nonprompt) if
+    the prompt (nonprompt) score is above the threshold of the pT bin. As in the hf-filter, the prompt
+    tag is the charm tag (high-pT triggers) and the nonprompt tag is the beauty tag (beauty triggers)
+
+    Parameters
+    -----------------
+    - pt_cand: array with the pT of the candidates
+    - scores: array (candidates, 3) with the bkg, prompt and nonprompt scores
+    - pt_bins, thresholds: output of get_bdt_thresholds
+
+    Outputs
+    -----------------
+    - is_prompt: boolean array, True for the candidates tagged as prompt (charm tag)
+    - is_nonprompt: boolean array, True for the candidates tagged as nonprompt (beauty tag)
+    """
+    i_bin = np.searchsorted(pt_bins, pt_cand, side="right") - 1
+    in_range = (i_bin >= 0) & (i_bin < len(thresholds))
+    thr = thresholds[np.clip(i_bin, 0, len(thresholds) - 1)]
+    is_not_bkg = in_range & (scores[:, 0] <= thr[:, 0])
+    return is_not_bkg & (scores[:, 1] > thr[:, 1]), is_not_bkg & (scores[:, 2] > thr[:, 2])
+
+
+# pylint: disable=too-many-arguments
+def get_candidate_decisions(df_cand, channel, filter_config, pt_columns, beauty_columns=None, apply_ml=None):
+    """
+    Function to compute the decisions of the hf-filter categories for the candidates of a channel
+
+    Parameters
+    -----------------
+    - df_cand: pandas dataframe with the candidates
+    - channel: charm-hadron channel
+    - filter_config: dictionary with the hf-filter configuration
+    - pt_columns: dictionary {number of prongs: pT column}
+    - beauty_columns: dictionary {beauty category: invariant-mass column}, categories without column are skipped
+    - apply_ml: apply the BDT selection (applyML of the configuration if None)
+
+    Outputs
+    -----------------
+    - decisions: dictionary {category: boolean array}
+    """
+    n_prongs = CHANNELS[channel][0]
+    pt_cand = df_cand[pt_columns[n_prongs]].to_numpy()
+    if apply_ml is None:
+        apply_ml = str(filter_config.get("applyML", "true")).lower() == "true"
+    if apply_ml:
+        pt_bins, thresholds = get_bdt_thresholds(filter_config, channel)
+        is_charm_tagged, is_beauty_tagged = get_bdt_tags(pt_cand, df_cand[SCORE_COLUMNS].to_numpy(),
+                                                         pt_bins, thresholds)
+    else:
+        is_charm_tagged = is_beauty_tagged = np.ones(len(df_cand), dtype=bool)
+
+    decisions = {f"CharmTagged{n_prongs}P": is_charm_tagged,
+                 f"HighPt{n_prongs}P": is_charm_tagged & (pt_cand >= float(filter_config[f"pTThreshold{n_prongs}Prong"]))}
+    for category, (key, mass, charm_channels) in BEAUTY_CATEGORIES.items():
+        mass_col = (beauty_columns or {}).get(category)
+        if channel not in charm_channels or mass_col is None or mass_col not in df_cand.columns:
+            continue
+        in_window = np.abs(df_cand[mass_col].to_numpy() - mass) <= float(filter_config[key])
+        decisions[f"Beauty{category}"] = is_beauty_tagged & in_window
+    return decisions
+
+
+def get_collision_index(df_cand, collision_col, i_file):
+    """
+    Helper function to get a collision identifier unique across the input files
+
+    Outputs
+    -----------------
+    - collision_ids: int64 array, None if the collision column is not available
+    """
+    if collision_col is None or collision_col not in df_cand.columns:
+        return None
+    return np.int64(i_file) << np.int64(32) | df_cand[collision_col].to_numpy().astype(np.int64)
+
+
+def reduce_per_collision(collision_ids, decisions):
+    """
+    Function to reduce the per-candidate decisions per collision: a collision is triggered by a
+    category if at least one of its candidates is selected
+
+    Parameters
+    -----------------
+    - collision_ids: array with the collision of each candidate
+    - decisions: dictionary {category: boolean array} with the decisions of the candidates
+
+    Outputs
+    -----------------
+    - n_collisions: number of collisions with at least one candidate
+    - triggered: dictionary {category: number of triggered collisions}, Any for the OR of the triggers
+    """
+    _, inverse = np.unique(collision_ids, return_inverse=True)
+    n_collisions = inverse.max() + 1 if len(inverse) > 0 else 0
+    triggered = {category: int(np.count_nonzero(np.bincount(inverse, weights=mask, minlength=n_collisions)))
+                 for category, mask in decisions.items()}
+    # the charm tagging alone is not a trigger category
+    any_mask = np.zeros(len(inverse), dtype=bool)
+    for category, mask in decisions.items():
+        if not category.startswith("CharmTagged"):
+            any_mask |= mask
+    triggered["Any"] = int(np.count_nonzero(np.bincount(inverse, weights=any_mask, minlength=n_collisions)))
+    return n_collisions, triggered
+
+
+# pylint: disable=too-many-locals
+def emulate(tables, filter_config, pt_columns, collision_col=None, beauty_columns=None, n_events=None):
+    """
+    Function to emulate the hf-filter on the candidate tables
+
+    Parameters
+    -----------------
+    - tables: dictionary {channel: list of pandas dataframes (one per input file)}
+    - filter_config: dictionary with the hf-filter configuration
+    - pt_columns, beauty_columns: see get_candidate_decisions
+    - collision_col: column with the collision index (each candidate is a collision if not available)
+    - n_events: number of processed events (collisions with at least one candidate if None)
+
+    Outputs
+    -----------------
+    - fractions: pandas dataframe with the triggered collisions, fraction and rejection factor per category
+    """
+    collision_ids, table_decisions = [], []
+    n_cand = 0
+    for channel, dfs in tables.items():
+        for i_file, df_cand in enumerate(dfs):
+            ids = get_collision_index(df_cand, collision_col, i_file)
+            if ids is None:
+                # every candidate treated as a collision: upper limit of the trigger fractions
+                ids = np.arange(n_cand, n_cand + len(df_cand), dtype=np.int64) | (np.int64(1) << np.int64(62))
+            collision_ids.append(ids)
+            table_decisions.append(get_candidate_decisions(df_cand, channel, filter_config, pt_columns,
+                                                           beauty_columns))
+            n_cand += len(df_cand)
+
+    # decisions of all the tables concatenated, False for the candidates of the channels without the category
+    categories = sorted({category for decisions in table_decisions for category in decisions})
+    decisions = {category: np.concatenate([table.get(category, np.zeros(len(ids), dtype=bool))
+                                           for table, ids in zip(table_decisions, collision_ids)])
+                 for category in categories}
+    n_collisions, triggered = reduce_per_collision(np.concatenate(collision_ids) if collision_ids
+                                                   else np.array([], dtype=np.int64), decisions)
+    n_events = n_events if n_events is not None else n_collisions
+    rows = [{"category": category, "triggered": n_trig, "fraction": n_trig / n_events if n_events else np.nan,
+             "rejection": n_events / n_trig if n_trig else np.inf}
+            for category, n_trig in sorted(triggered.items())]
+    return pd.DataFrame(rows)
+
+
+def load_filter_config(dpl_config_file, overrides=None):
+    """
+    Function to read the hf-filter configuration, with optional overrides
+
+    Parameters
+    -----------------
+    - dpl_config_file: DPL json configuration (e.g. dpl-config-triggerHF.json)
+    - overrides: list of strings task/parameter=value (values parsed as yaml, e.g. lists for the tables)
+
+    Outputs
+    -----------------
+    - filter_config: dictionary with the hf-filter configuration
+    """
+    with open(dpl_config_file) as in_file:
+        config = json.load(in_file)
+    for override in overrides or []:
+        path, value = override.split("=", 1)
+        set_parameter(config, path, yaml.safe_load(value))
+    return config["hf-filter"]
+
+
+def main():
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(description="Arguments")
+    parser.add_argument("config", metavar="text", default="config_emulate_hf_filter.yml",
+                        help="yaml config file of the emulation")
+    parser.add_argument("--set", nargs="+", default=[], dest="overrides",
+                        help="overrides of the DPL configuration, e.g. hf-filter/pTThreshold2Prong=8")
+    parser.add_argument("--n_events", type=float, default=None,
+                        help="number of processed events (n_events of the config if not set)")
+    parser.add_argument("--output", default=None, help="csv file with the trigger fractions")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as yml_cfg:  # pylint: disable=bad-option-value
+        cfg = yaml.load(yml_cfg, yaml.FullLoader)
+
+    filter_config = load_filter_config(cfg["dpl_config"], args.overrides)
+    tables = {}
+    for channel, file_names in cfg["inputs"].items():
+        if channel not in CHANNELS:
+            print(f"\033[93mWARNING: channel {channel} not in the hf-filter, skipped\033[0m")
+            continue
+        tables[channel] = [pd.read_parquet(file_name) for file_name in file_names if os.path.isfile(file_name)]
+        if len(tables[channel]) < len(file_names):
+            print(f"\033[93mWARNING: {len(file_names) - len(tables[channel])} input files of {channel} not found\033[0m")
+    collision_col = cfg.get("collision_column")
+    if collision_col is None or not all(collision_col in df.columns for dfs in tables.values() for df in dfs):
+        print("\033[93mWARNING: collision index not available, each candidate is treated as a collision\033[0m")
+    n_events = args.n_events if args.n_events is not None else cfg.get("n_events")
+
+    start = time.perf_counter()
+    fractions = emulate(tables, filter_config, {int(n_prongs): col for n_prongs, col in cfg["pt_columns"].items()},
+                        collision_col, cfg.get("beauty_mass_columns"), int(n_events) if n_events else None)
+    elapsed = time.perf_counter() - start
+    print(fractions.to_string(index=False))
+    n_cand = sum(len(df) for dfs in tables.values() for df in dfs)
+    print(f"\033[32m{n_cand} candidates processed in {elapsed:.3f} s\033[0m")
+    if args.output is not None:
+        fractions.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Module for the bulk reading of the hf-filter registry histograms from many AnalysisResults files.
+Histograms are read with uproot in parallel, converted to numpy (values, errors, edges) and
+normalised by the number of processed events. The results are cached by file identity, so that
+the comparison of variations does not need any ROOT I/O once the files have been read
+"""
+
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import uproot
+
+REGISTRY_DIR = "hf-filter/registry"
+EVENTS_HISTO = "fProcessedEvents"
+
+
+def get_histo_names(particles_c, particles_b):
+    """
+    Function that returns the names of the registry histograms used in the comparisons
+
+    Parameters
+    -----------------
+    - particles_c: list of charm hadrons
+    - particles_b: list of beauty hadrons
+
+    Outputs
+    -----------------
+    - histo_names: list of histogram names in the hf-filter registry
+    """
+    histo_names = [EVENTS_HISTO]
+    for i_part, (part_c, part_b) in enumerate(zip(particles_c, particles_b)):
+        histo_names += [f"fMassVsPt{part_c}", f"fMassVsPt{part_b}"]
+        if i_part < 4:
+            histo_names += [f"f{part_c}HighPt", f"f{part_c}ProtonKstarDistr"]
+    return histo_names
+
+
+def get_cache_file_name(file_name, histo_names, cache_dir):
+    """
+    Function that returns the cache file of an input file, keyed by path, size,
+    modification time and requested histograms
+    """
+    stat = os.stat(file_name)
+    identity = [os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns, sorted(histo_names)]
+    key = hashlib.sha1(json.dumps(identity).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(file_name))[0]}_{key}.npz")
+
+
+def convert_histo(histo):
+    """
+    Function that converts an uproot histogram to numpy, projecting 2D histograms
+    on the y axis (all x bins, including under- and overflow, as TH2::ProjectionY)
+
+    Outputs
+    -----------------
+    - dictionary with values, errors, edges and bin labels (None if not labelled)
+    """
+    if len(histo.axes) == 2:
+        values = histo.values(flow=True).sum(axis=0)[1:-1]
+        variances = histo.variances(flow=True).sum(axis=0)[1:-1]
+        axis = histo.axis(1)
+    else:
+        values = histo.values()
+        variances = histo.variances()
+        axis = histo.axis()
+    labels = axis.labels()
+    return {"values": np.asarray(values, dtype=np.float64),
+            "errors": np.sqrt(np.asarray(variances, dtype=np.float64)),
+            "edges": np.asarray(axis.edges(), dtype=np.float64),
+            "labels": None if labels is None else [str(label) for label in labels]}
+
+
+def read_histos(file_name, histo_names, registry_dir=REGISTRY_DIR):
+    """
+    Function that reads the requested histograms of one file, normalised by the
+    number of processed events
+
+    Parameters
+    -----------------
+    - file_name: AnalysisResults file
+    - histo_names: names of the histograms in the registry
+    - registry_dir: directory of the registry
+
+    Outputs
+    -----------------
+    - histos: dictionary {histogram name: {values, errors, edges, labels}},
+      with the number of processed events stored in histos["n_events"]
+    """
+    histos = {}
+    with uproot.open(file_name) as in_file:
+        for name in histo_names:
+            histos[name] = convert_histo(in_file[f"{registry_dir}/{name}"])
+        if EVENTS_HISTO not in histos:
+            histos[EVENTS_HISTO] = convert_histo(in_file[f"{registry_dir}/{EVENTS_HISTO}"])
+    n_events = histos[EVENTS_HISTO]["values"][0]
+    for histo in histos.values():
+        histo["values"] /= n_events
+        histo["errors"] /= n_events
+    histos["n_events"] = n_events
+    return histos
+
+
+def save_histos(histos, cache_file):
+    """
+    Function that stores the histograms of one file in a npz cache
+    """
+    arrays = {"n_events": np.asarray(histos["n_events"])}
+    for name, histo in histos.items():
+        if name == "n_events":
+            continue
+        for field in ["values", "errors", "edges"]:
+            arrays[f"{name}__{field}"] = histo[field]
+        if histo["labels"] is not None:
+            arrays[f"{name}__labels"] = np.array(histo["labels"])
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    np.savez(cache_file, **arrays)
+
+
+def load_cached_histos(cache_file):
+    """
+    Function that loads the histograms of one file from a npz cache
+    """
+    histos = {}
+    with np.load(cache_file) as npz:
+        histos["n_events"] = float(npz["n_events"])
+        for key in npz.files:
+            if "__" not in key:
+                continue
+            name, field = key.rsplit("__", 1)
+            histos.setdefault(name, {"labels": None})
+            histos[name][field] = [str(label) for label in npz[key]] if field == "labels" else npz[key]
+    return histos
+
+
+def load_file_histos(file_name, histo_names, cache_dir=None, registry_dir=REGISTRY_DIR):
+    """
+    Function that returns the histograms of one file, from the cache if available
+    """
+    if cache_dir is None:
+        return read_histos(file_name, histo_names, registry_dir)
+    cache_file = get_cache_file_name(file_name, histo_names, cache_dir)
+    if os.path.isfile(cache_file):
+        return load_cached_histos(cache_file)
+    histos = read_histos(file_name, histo_names, registry_dir)
+    save_histos(histos, cache_file)
+    return histos
+
+
+def load_histos(file_names, histo_names, n_jobs=4, cache_dir=None, registry_dir=REGISTRY_DIR):
+    """
+    Function that reads the requested histograms from N files in parallel
+
+    Parameters
+    -----------------
+    - file_names: list of AnalysisResults files
+    - histo_names: names of the histograms in the registry
+    - n_jobs: number of files read in parallel
+    - cache_dir: directory of the npz cache (no cache if None)
+    - registry_dir: directory of the registry
+
+    Outputs
+    -----------------
+    - list of dictionaries (one per file) {histogram name: {values, errors, edges, labels}}
+    """
+    for file_name in file_names:
+        if not os.path.isfile(file_name):
+            raise FileNotFoundError(f"cannot open {file_name}")
+    reader = partial(load_file_histos, histo_names=histo_names, cache_dir=cache_dir, registry_dir=registry_dir)
+    if n_jobs <= 1 or len(file_names) <= 1:
+        return [reader(file_name) for file_name in file_names]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(reader, file_names))
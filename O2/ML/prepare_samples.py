@@ -4,12 +4,16 @@ training of ML models to be used in the HF triggers
 """
 
 import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 import argparse
 import uproot
 from alive_progress import alive_bar
-from ROOT import TFile, gRandom
+sys.path.append('../..')
+from pyutils.DfUtils import WriteBitIndex  #pylint: disable=wrong-import-position,import-error
+# ROOT is loaded only if the DCA smearing is applied
+from pyutils.LazyROOT import ROOT  #pylint: disable=wrong-import-position,import-error
 
 # bits for 3 prongs
 bits_3p = {"DplusToPiKPi": 0,
@@ -40,7 +44,7 @@ def do_dca_smearing(df, nProng=None):
     print("Start to do the smearing")
     # Open the input files
     file_names = ["sigmaDcaXY_LHC22q_pass2_LHCC.root", "sigmaDcaZ_LHC22q_pass2_LHCC.root"]
-    input_files = [TFile.Open(name) for name in file_names]
+    input_files = [ROOT.TFile.Open(name) for name in file_names]
     
     # Extract DCA resolution histograms
     dca_reso_data,  dca_reso_mc= {}, {}
@@ -57,7 +61,7 @@ def do_dca_smearing(df, nProng=None):
         dca_col = f"fDCAPrim{col}"
         pt_col = f"fPT{col[-1]}"
         df[f"{dca_col}_SMEAR"] = [
-            gRandom.Gaus(dca, np.sqrt(dca_reso_data[col[:-1]].Eval(pt)**2 - dca_reso_mc[col[:-1]].Eval(pt)**2) * 1e-4)
+            ROOT.gRandom.Gaus(dca, np.sqrt(dca_reso_data[col[:-1]].Eval(pt)**2 - dca_reso_mc[col[:-1]].Eval(pt)**2) * 1e-4)
             for dca, pt in zip(df[dca_col], df[pt_col])
         ]
     
@@ -123,16 +127,37 @@ def divide_df_for_origin(df, cols_to_remove=None, channel=None):
     return df_prompt, df_nonprompt, df_bkg
 
 
-# pylint: disable=too-many-locals,too-many-branches,too-many-nested-blocks
-def main(input_dir, max_files=1000, downscale_bkg=1., force=False):
+def get_output_files(indir):
     """
-    Main function
+    Helper method to get the names of the parquet files produced from an AO2D file
 
     Parameters
     -----------------
-    - config: dictionary with configs
+    - indir: directory of the AO2D file
+
+    Outputs
+    -----------------
+    - output_files: list of parquet files
     """
+    output_files = []
+    for channel in ["D0ToKPi"] + list(bits_3p):
+        for label in ["Prompt", "Nonprompt", "Bkg"]:
+            output_files.append(os.path.join(indir, f"{label}_{channel}.parquet.gzip"))
+    return output_files
+
+
+def get_input_files(input_dir):
+    """
+    Helper method to find the AO2D files in the directory tree of the downloaded train outputs
+
+    Parameters
+    -----------------
+    - input_dir: input directory with AO2D input files
 
+    Outputs
+    -----------------
+    - input_files: list of AO2D files
+    """
     input_files = []
     for subdir in os.listdir(input_dir):
         if os.path.isdir(os.path.join(input_dir, subdir)):
@@ -148,94 +173,142 @@ def main(input_dir, max_files=1000, downscale_bkg=1., force=False):
                                 if "AO2D.root" in file2:
                                     input_files.append(os.path.join(
                                         input_dir, subdir, subsubdir, file, file2))
+    return input_files
+
+
+# pylint: disable=too-many-locals
+def prepare_file(file, downscale_bkg=1., force=False, do_smearing=False, bit_index=False):
+    """
+    Function for the preparation of the samples from one AO2D file, the parquet
+    files are stored in the same directory
+
+    Parameters
+    -----------------
+    - file: AO2D file
+    - downscale_bkg: fraction of bkg to be kept
+    - force: force re-creation of output files
+    - do_smearing: do smearing on the dca of daughter tracks
+    - bit_index: keep the fHFSelBit column and write its bitmap index next to each output
+
+    Outputs
+    -----------------
+    - output_files: list of parquet files produced from the AO2D file
+    """
+
+    print(f"\033[32mExtracting dataframes from input "
+          f"{file}\033[0m")
+
+    file_root = uproot.open(file)
+    indir = os.path.split(file)[0]
+
+    # 2-prongs --> only D0
+    is_d0_filtered = False
+    for exfile in os.listdir(indir):
+        if "D0ToKPi.parquet.gzip" in exfile:
+            is_d0_filtered = True
+            break
+    if not is_d0_filtered or force:
+        list_of_2p_df = []
+        for tree_name in file_root.keys():
+            if "O2hftrigtrain2p" in tree_name:
+                list_of_2p_df.append(f"{file}:{tree_name}")
+        df_2p = uproot.concatenate(list_of_2p_df, library="pd")
+        if do_smearing:
+            df_2p = do_dca_smearing(df_2p, 2)
+
+        df_2p_prompt, df_2p_nonprompt, df_2p_bkg = divide_df_for_origin(
+            df_2p)
+        df_2p_bkg = df_2p_bkg.sample(
+            frac=downscale_bkg, random_state=42)
+        df_2p_prompt.to_parquet(
+            os.path.join(indir, "Prompt_D0ToKPi.parquet.gzip"),
+            compression="gzip"
+        )
+        df_2p_nonprompt.to_parquet(
+            os.path.join(indir, "Nonprompt_D0ToKPi.parquet.gzip"),
+            compression="gzip"
+        )
+        df_2p_bkg.to_parquet(
+            os.path.join(indir, "Bkg_D0ToKPi.parquet.gzip"),
+            compression="gzip"
+        )
+        df_2p = None
+
+    # 3-prongs --> D+, Ds+, Lc+, Xic+
+    is_3p_filtered = False
+    for channel_3p in bits_3p:
+        for exfile in os.listdir(indir):
+            if f"{channel_3p}.parquet.gzip" in exfile:
+                is_3p_filtered = True
+                break
+
+    list_of_3p_df = []
+    if not is_3p_filtered or force:
+        for tree_name in file_root.keys():
+            if "O2hftrigtrain3p" in tree_name:
+                list_of_3p_df.append(f"{file}:{tree_name}")
+        df_3p = uproot.concatenate(list_of_3p_df, library="pd")
+        if do_smearing:
+            df_3p = do_dca_smearing(df_3p, 3)
+
+        for channel_3p in bits_3p:
+            flags = df_3p["fHFSelBit"].astype(
+                int) & 2**bits_3p[channel_3p]
+            df_channel_3p = df_3p[flags.astype("bool").to_numpy()]
+            df_3p_prompt, df_3p_nonprompt, df_3p_bkg = divide_df_for_origin(
+                df_channel_3p,
+                ["fFlagOrigin", "fChannel"] + ([] if bit_index else ["fHFSelBit"]),
+                channel=channels_3p[channel_3p]
+            )
+            df_3p_bkg = df_3p_bkg.sample(
+                frac=downscale_bkg, random_state=42)
+            df_3p_prompt.to_parquet(
+                os.path.join(
+                    indir, f"Prompt_{channel_3p}.parquet.gzip"),
+                compression="gzip"
+            )
+            df_3p_nonprompt.to_parquet(
+                os.path.join(
+                    indir, f"Nonprompt_{channel_3p}.parquet.gzip"),
+                compression="gzip"
+            )
+            df_3p_bkg.to_parquet(
+                os.path.join(indir, f"Bkg_{channel_3p}.parquet.gzip"),
+                compression="gzip"
+            )
+
+        df_3p = None
+
+    file_root.close()
+
+    output_files = get_output_files(indir)
+    if bit_index:
+        for output_file in output_files:
+            if os.path.isfile(output_file):
+                WriteBitIndex(output_file, ["fHFSelBit"])
+
+    return output_files
+
+
+def main(input_dir, max_files=1000, downscale_bkg=1., force=False, do_smearing=False, bit_index=False):
+    """
+    Main function
+
+    Parameters
+    -----------------
+    - input_dir: input directory with AO2D input files
+    - max_files: max input files to be processed
+    - downscale_bkg: fraction of bkg to be kept
+    - force: force re-creation of output files
+    - do_smearing: do smearing on the dca of daughter tracks
+    - bit_index: keep the fHFSelBit column and write its bitmap index next to each output
+    """
+
+    input_files = get_input_files(input_dir)
 
-    df_2p, df_3p = None, None
     with alive_bar(len(input_files[:max_files])) as bar_alive:
         for file in input_files[:max_files]:
-            print(f"\033[32mExtracting dataframes from input "
-                  f"{file}\033[0m")
-
-            file_root = uproot.open(file)
-            indir = os.path.split(file)[0]
-
-            # 2-prongs --> only D0
-            is_d0_filtered = False
-            for exfile in os.listdir(indir):
-                if "D0ToKPi.parquet.gzip" in exfile:
-                    is_d0_filtered = True
-                    break
-            if not is_d0_filtered or force:
-                list_of_2p_df = []
-                for tree_name in file_root.keys():
-                    if "O2hftrigtrain2p" in tree_name:
-                        list_of_2p_df.append(f"{file}:{tree_name}")
-                df_2p = uproot.concatenate(list_of_2p_df, library="pd")
-                if args.dosmearing:
-                    df_2p = do_dca_smearing(df_2p, 2)
-
-                df_2p_prompt, df_2p_nonprompt, df_2p_bkg = divide_df_for_origin(
-                    df_2p)
-                df_2p_bkg = df_2p_bkg.sample(
-                    frac=downscale_bkg, random_state=42)
-                df_2p_prompt.to_parquet(
-                    os.path.join(indir, "Prompt_D0ToKPi.parquet.gzip"),
-                    compression="gzip"
-                )
-                df_2p_nonprompt.to_parquet(
-                    os.path.join(indir, "Nonprompt_D0ToKPi.parquet.gzip"),
-                    compression="gzip"
-                )
-                df_2p_bkg.to_parquet(
-                    os.path.join(indir, "Bkg_D0ToKPi.parquet.gzip"),
-                    compression="gzip"
-                )
-                df_2p = None
-
-            # 3-prongs --> D+, Ds+, Lc+, Xic+
-            is_3p_filtered = False
-            for channel_3p in bits_3p:
-                for exfile in os.listdir(indir):
-                    if f"{channel_3p}.parquet.gzip" in exfile:
-                        is_3p_filtered = True
-                        break
-
-            list_of_3p_df = []
-            if not is_3p_filtered or force:
-                for tree_name in file_root.keys():
-                    if "O2hftrigtrain3p" in tree_name:
-                        list_of_3p_df.append(f"{file}:{tree_name}")
-                df_3p = uproot.concatenate(list_of_3p_df, library="pd")
-                if args.dosmearing:
-                    df_3p = do_dca_smearing(df_3p, 3)
-
-                for channel_3p in bits_3p:
-                    flags = df_3p["fHFSelBit"].astype(
-                        int) & 2**bits_3p[channel_3p]
-                    df_channel_3p = df_3p[flags.astype("bool").to_numpy()]
-                    df_3p_prompt, df_3p_nonprompt, df_3p_bkg = divide_df_for_origin(
-                        df_channel_3p,
-                        ["fFlagOrigin", "fChannel", "fHFSelBit"],
-                        channel=channels_3p[channel_3p]
-                    )
-                    df_3p_bkg = df_3p_bkg.sample(
-                        frac=downscale_bkg, random_state=42)
-                    df_3p_prompt.to_parquet(
-                        os.path.join(
-                            indir, f"Prompt_{channel_3p}.parquet.gzip"),
-                        compression="gzip"
-                    )
-                    df_3p_nonprompt.to_parquet(
-                        os.path.join(
-                            indir, f"Nonprompt_{channel_3p}.parquet.gzip"),
-                        compression="gzip"
-                    )
-                    df_3p_bkg.to_parquet(
-                        os.path.join(indir, f"Bkg_{channel_3p}.parquet.gzip"),
-                        compression="gzip"
-                    )
-
-                df_3p = None
-
+            prepare_file(file, downscale_bkg, force, do_smearing, bit_index)
             bar_alive()
 
 
@@ -251,6 +324,8 @@ if __name__ == "__main__":
                         help="force re-creation of output files")
     parser.add_argument("--dosmearing", action="store_true", default=False,
                         help="do smearing on the dca of daughter tracks ")
+    parser.add_argument("--bitindex", action="store_true", default=False,
+                        help="keep fHFSelBit and write its bitmap index next to each output")
     args = parser.parse_args()
 
-    main(args.input_dir, args.max_files, args.downscale_bkg, args.force)
+    main(args.input_dir, args.max_files, args.downscale_bkg, args.force, args.dosmearing, args.bitindex)
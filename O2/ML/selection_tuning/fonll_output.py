@@ -1,30 +1,130 @@
+import os
+import argparse
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import uproot
 
-def integrate_dsigma_dpt_BR(self):
+# in-memory cache of the FONLL tables, filled once per file: {file name: {key: FONLL_table}}
+_FONLL_TABLES = {}
+
+
+class FONLL_table:
+    """
+    Class to store a FONLL dsigma/dpt*BR prediction as a cumulative integral table.
+    Integrals over any pT range are obtained in O(1), with linear interpolation inside partial bins
+    """
+
+    def __init__(self, pt_edges, dsigma_dpt_BR):
+        self.pt_edges = np.asarray(pt_edges, dtype=np.float64)
+        self.dsigma_dpt_BR = np.asarray(dsigma_dpt_BR, dtype=np.float64)
+        # cumulative[i] = integral of dsigma/dpt*BR between pt_edges[0] and pt_edges[i]
+        self.cumulative = np.concatenate(([0.], np.cumsum(self.dsigma_dpt_BR * np.diff(self.pt_edges))))
+
+    def integral(self, pt_min, pt_max):
+        """
+        Method to integrate dsigma/dpt*BR over [pt_min, pt_max]
+
+        --------------------------------
+        Parameters
+        - pt_min, pt_max: limits of the pT interval (scalars or arrays of the same shape)
+        --------------------------------
+        Output
+        - integral of dsigma/dpt*BR over the pT interval(s)
+        """
+        # the cumulative integral of a piecewise-constant function is piecewise linear
+        return np.interp(pt_max, self.pt_edges, self.cumulative) - np.interp(pt_min, self.pt_edges, self.cumulative)
+
+
+def get_cache_file_name(file_name):
+    """
+    Helper method to get the name of the npz cache of a FONLL file
+    """
+    return f"{os.path.splitext(file_name)[0]}_cumulative.npz"
+
+def read_fonll_file(file_name):
+    """
+    Method to convert all the predictions of a FONLL file into cumulative integral tables
+
+    --------------------------------
+    Parameter
+    - file_name: name of the FONLL file
+    --------------------------------
+    Output
+    - tables: dictionary {key: FONLL_table}
+    """
+    tables = {}
+    with uproot.open(file_name) as FONLL_file:
+        for key, class_name in FONLL_file.classnames().items():
+            if not class_name.startswith("TH1"):
+                continue
+            dsigma_dpt_BR, pt_edges = FONLL_file[key].to_numpy()
+            tables[key] = FONLL_table(pt_edges, dsigma_dpt_BR)
+    return tables
+
+def save_fonll_cache(tables, cache_name):
+    """
+    Method to store the cumulative tables of a FONLL file in a npz cache
+    """
+    arrays = {}
+    for ikey, table in enumerate(tables.values()):
+        arrays[f"pt_edges_{ikey}"] = table.pt_edges
+        arrays[f"cumulative_{ikey}"] = table.cumulative
+    np.savez(cache_name, keys=np.array(list(tables)), **arrays)
+
+def precompile_fonll_file(file_name):
     """
-    Method to sum all dsigma/dpt*BR bins over a given pT interval
+    Method to convert all the predictions of a FONLL file into cumulative integral tables
+    and to store them in a npz cache next to the input file
+
+    --------------------------------
+    Parameter
+    - file_name: name of the FONLL file
+    --------------------------------
+    Output
+    - cache_name: name of the npz cache
+    """
+    cache_name = get_cache_file_name(file_name)
+    save_fonll_cache(read_fonll_file(file_name), cache_name)
+    return cache_name
+
+def load_fonll_tables(file_name):
     """
-    dsigma_dpt_BR = self.data_array[0]
-    pt = self.data_array[1]
-    pt_min, pt_max = self.pt_bin[0], self.pt_bin[1]
-    # list of indices corresponding to Delta_pt interval
-    idx_list, = np.where( (pt >= pt_min) & (pt <= pt_max) )
-    # select data in this interval
-    boolean = []
-    for i, _ in enumerate(dsigma_dpt_BR):
-        boolean.append(True) if i in idx_list else boolean.append(False)
-    # integrate dsigma_dpt_BR over Delta_pt interval
-    sum = np.sum(dsigma_dpt_BR, where = boolean)
-    return sum
+    Method to load all the cumulative tables of a FONLL file from the npz cache, recompiling
+    it if it is missing or older than the FONLL file. If the cache cannot be written (e.g. the
+    FONLL file is on read-only storage) the tables are kept only in memory. Tables are read
+    only once per process
+
+    --------------------------------
+    Parameter
+    - file_name: name of the FONLL file
+    --------------------------------
+    Output
+    - tables: dictionary {key: FONLL_table}
+    """
+    if file_name in _FONLL_TABLES:
+        return _FONLL_TABLES[file_name]
+    cache_name = get_cache_file_name(file_name)
+    if os.path.isfile(cache_name) and os.path.getmtime(cache_name) >= os.path.getmtime(file_name):
+        tables = {}
+        with np.load(cache_name) as cache:
+            for ikey, key in enumerate(cache["keys"]):
+                pt_edges = cache[f"pt_edges_{ikey}"]
+                tables[str(key)] = FONLL_table(pt_edges, np.diff(cache[f"cumulative_{ikey}"]) / np.diff(pt_edges))
+    else:
+        tables = read_fonll_file(file_name)
+        try:
+            save_fonll_cache(tables, cache_name)
+        except OSError as err:
+            print(f"\033[93mWARNING: FONLL cache {cache_name} not written ({err}), tables kept in memory\033[0m")
+    _FONLL_TABLES[file_name] = tables
+    return tables
 
 def get_channel_key(self):
     """
     Method to get branch name for our channel in FONLL file
     """
-    keys = self.FONLL_file.keys()
+    keys = self.FONLL_keys
     for key in keys:
         if self.channel+"pred" in key and "max" in key:
             prompt_key = key
@@ -42,10 +142,12 @@ class FONLL_output:
 
     def __init__(self, promptness, FONLL_file, channel, pt_bins, n_points):
         self.promptness = promptness
-        self.FONLL_file = FONLL_file
+        # either the file name or an uproot file opened from it
+        self.FONLL_file = FONLL_file if isinstance(FONLL_file, str) else FONLL_file.file_path
         self.channel = channel
         self.pt_bins = pt_bins
         self.n_points = n_points
+        self._table = None
 
     @property
     def thresholds(self):
@@ -66,21 +168,46 @@ class FONLL_output:
         return [self.number_of_events]*len(self.thresholds)
 
     @property
+    def FONLL_keys(self):
+        return list(load_fonll_tables(self.FONLL_file))
+    @property
     def channel_key(self):
         return get_channel_key(self)
     @property
+    def table(self):
+        if self._table is None:
+            self._table = load_fonll_tables(self.FONLL_file)[self.channel_key]
+        return self._table
+    @property
     def data_array(self):
-        return self.FONLL_file[self.channel_key].to_hist().to_numpy()
+        return self.table.dsigma_dpt_BR, self.table.pt_edges
     @property
     def dsigma_dpt_BR(self):
-        return self.data_array[0]
+        return self.table.dsigma_dpt_BR
     @property
     def integrated_dsigma_dpt_BR(self):
-        return integrate_dsigma_dpt_BR(self)
+        return self.table.integral(self.pt_bin[0], self.pt_bin[1])
+    @property
+    def integrated_dsigma_dpt_BR_array(self):
+        """
+        Integrals of dsigma/dpt*BR for all the pT bins of the config at once
+        """
+        pt_bins = np.asarray(self.pt_bins, dtype=np.float64)
+        return self.table.integral(pt_bins[:-1], pt_bins[1:])
 
     @property
     def pt_bin(self):
         return self._pt_bin
     @pt_bin.setter
     def pt_bin(self, pt_bin):
-        self._pt_bin = pt_bin
\ No newline at end of file
+        self._pt_bin = pt_bin
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompile FONLL predictions into npz caches")
+    parser.add_argument("files", metavar="text", nargs="+",
+                        help="FONLL files to precompile")
+    args = parser.parse_args()
+
+    for file_name in args.files:
+        print(f"{file_name} -> {precompile_fonll_file(file_name)}")
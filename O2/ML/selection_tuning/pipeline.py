@@ -0,0 +1,287 @@
+"""
+Staged pipeline for the selection tuning: preselection efficiencies, BDT efficiencies,
+FONLL integrals and expected signal. Each stage persists its output in a npz file keyed by
+a hash of its config section and input files, so that only the stages affected by a config
+change are recomputed
+"""
+
+import os
+import json
+import hashlib
+from dataclasses import dataclass, fields
+import numpy as np
+import uproot
+
+import preselection # module for Preselection study
+import ml_output # module for ML output study
+import fonll_output # module for FONLL output study
+
+CLASSES = ["Bkg", "Prompt", "Nonprompt"]
+
+
+@dataclass
+class PreselectionResult:
+    """
+    Output of the preselection stage: efficiencies[pt bin] for prompt and nonprompt
+    """
+    pt_bins: np.ndarray
+    prompt_efficiencies: np.ndarray
+    nonprompt_efficiencies: np.ndarray
+
+@dataclass
+class BDTEfficiencyResult:
+    """
+    Output of the BDT efficiency stage: efficiencies[label][pt bin][clas][ithr]
+    """
+    pt_bins: np.ndarray
+    thresholds: np.ndarray
+    efficiencies: np.ndarray
+
+    def as_dict(self):
+        """
+        Method to get the efficiencies in the format of ML_output.efficiencies for each label
+        """
+        pt_bins = list(zip(self.pt_bins[:-1], self.pt_bins[1:]))
+        return {label: {pt_bin: {clas: list(self.efficiencies[ilabel, ipt, iclas])
+                                 for iclas, clas in enumerate(CLASSES)}
+                        for ipt, pt_bin in enumerate(pt_bins)}
+                for ilabel, label in enumerate(CLASSES)}
+
+    def at_BDT_cut(self, BDT_cuts):
+        """
+        Method to get the efficiencies vs pT at the chosen BDT cuts,
+        in the format of ML_output.compute_efficiencies_at_BDT_cut for each label
+        """
+        eff_at_BDT_cut = {}
+        for ilabel, label in enumerate(CLASSES):
+            eff_at_BDT_cut[label] = {}
+            for iclas, clas in enumerate(CLASSES):
+                ithr = np.argmin(np.abs(self.thresholds - BDT_cuts[clas]))
+                eff_at_BDT_cut[label][clas] = list(self.efficiencies[ilabel, :, iclas, ithr])
+        return eff_at_BDT_cut
+
+@dataclass
+class FONLLResult:
+    """
+    Output of the FONLL stage: integrals of dsigma/dpt*BR[pt bin] for prompt and nonprompt
+    """
+    pt_bins: np.ndarray
+    prompt_integrals: np.ndarray
+    nonprompt_integrals: np.ndarray
+    luminosity: np.ndarray
+    number_of_events: np.ndarray
+
+@dataclass
+class ExpectedSignalResult:
+    """
+    Output of the expected signal stage: arrays[pt bin][clas][ithr]
+    """
+    prompt_total_efficiencies: np.ndarray
+    nonprompt_total_efficiencies: np.ndarray
+    fprompt: np.ndarray
+    fnonprompt: np.ndarray
+    expected_signal: np.ndarray
+
+
+def get_file_identity(file_name):
+    """
+    Helper method to identify an input file by its path, size and modification time
+    """
+    stat = os.stat(file_name)
+    return [os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns]
+
+def get_hash(inputs):
+    """
+    Helper method to compute the hash of the inputs of a stage
+    """
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def save_result(result, file_name):
+    """
+    Helper method to persist a stage result in a npz file
+    """
+    np.savez(file_name, **{field.name: np.asarray(getattr(result, field.name)) for field in fields(result)})
+
+def load_result(result_class, file_name):
+    """
+    Helper method to load a stage result from a npz file
+    """
+    with np.load(file_name) as npz:
+        return result_class(**{field.name: npz[field.name] for field in fields(result_class)})
+
+def run_stage(name, inputs, compute, result_class, cache_dir=None, force=False):
+    """
+    Method to run a stage, or to load its result from the cache if its inputs did not change
+
+    --------------------------------
+    Parameters
+    - name: name of the stage
+    - inputs: json-serialisable inputs of the stage (config section, input files, upstream keys)
+    - compute: function returning the result of the stage
+    - result_class: class of the result of the stage
+    - cache_dir: directory of the cache (no cache if None)
+    - force: recompute the stage even if a cached result exists
+    --------------------------------
+    Outputs
+    - result: result of the stage
+    - key: hash of the stage inputs, to be used as input of downstream stages
+    """
+    key = get_hash({"stage": name, "inputs": inputs})
+    if cache_dir is None:
+        return compute(), key
+    cache_file = os.path.join(cache_dir, f"{name}_{key}.npz")
+    if os.path.isfile(cache_file) and not force:
+        print(f"\033[32mStage {name}: loaded from {cache_file}\033[0m")
+        return load_result(result_class, cache_file), key
+    print(f"\033[33mStage {name}: computing\033[0m")
+    result = compute()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    save_result(result, cache_file)
+    return result, key
+
+
+def compute_preselection(config):
+    """
+    Method to compute the preselection efficiencies for prompt and nonprompt
+    """
+    pt_bins = config["pt_bins"]
+    channel = config["Preselection"]["channel"]
+    with uproot.open(config["Preselection"]["file"]["name"]) as preselectionFile:
+        tree_mc_rec = preselectionFile[config["Preselection"]["file"]["tree_mc_rec"]]
+        tree_mc_gen = preselectionFile[config["Preselection"]["file"]["tree_mc_gen"]]
+        efficiencies = {}
+        for promptness in ["prompt", "nonprompt"]:
+            presel = preselection.Preselection(channel, promptness, pt_bins, tree_mc_rec, tree_mc_gen)
+            efficiencies[promptness] = presel.compute_efficiencies()
+    return PreselectionResult(np.asarray(pt_bins), efficiencies["prompt"], efficiencies["nonprompt"])
+
+def compute_bdt_efficiencies(config):
+    """
+    Method to compute the BDT efficiencies for the three labels
+    """
+    pt_bins = config["pt_bins"]
+    cfg_ml = config["ML_output"]
+    efficiencies = []
+    for ilabel, label in enumerate(CLASSES):
+        ML_output = ml_output.ML_output(ilabel, cfg_ml["file"], cfg_ml["channel"], pt_bins,
+                                        cfg_ml["BDT_cuts"], cfg_ml["n_points"])
+        eff = ML_output.efficiencies
+        efficiencies.append([[eff[pt_bin][clas] for clas in CLASSES] for pt_bin in zip(pt_bins[:-1], pt_bins[1:])])
+    return BDTEfficiencyResult(np.asarray(pt_bins), np.linspace(0., 1., cfg_ml["n_points"]), np.asarray(efficiencies))
+
+def compute_fonll(config):
+    """
+    Method to compute the FONLL integrals for prompt and nonprompt in each pT bin
+    """
+    pt_bins = config["pt_bins"]
+    cfg_fonll = config["FONLL_output"]
+    n_points = config["ML_output"]["n_points"]
+    prompt_fonll = fonll_output.FONLL_output("prompt", cfg_fonll["file"], cfg_fonll["channel"], pt_bins, n_points)
+    nonprompt_fonll = fonll_output.FONLL_output("nonprompt", cfg_fonll["file"], cfg_fonll["channel"], pt_bins, n_points)
+    return FONLLResult(np.asarray(pt_bins), prompt_fonll.integrated_dsigma_dpt_BR_array,
+                       nonprompt_fonll.integrated_dsigma_dpt_BR_array,
+                       np.asarray(prompt_fonll.luminosity), np.asarray(prompt_fonll.number_of_events))
+
+
+def compute_total_efficiencies(preselection_eff, BDT_eff):
+    """
+    Helper method to compute total efficiencies
+
+    --------------------------------
+    Parameters
+    - preselection_eff: preselection efficiencies (1D array [pt bin])
+    - BDT_eff: BDT efficiencies (3D array [pt bin][clas][ithr])
+    --------------------------------
+    Outputs
+    - total_efficiencies: 3D array total_efficiencies[pt bin][clas][ithr]
+    """
+    return np.asarray(preselection_eff)[:, np.newaxis, np.newaxis] * BDT_eff
+
+def compute_fprompt(prompt_integrals, nonprompt_integrals, prompt_total_eff, nonprompt_total_eff):
+    """
+    Helper method to compute prompt fraction
+
+    --------------------------------
+    Parameters
+    - prompt_integrals: FONLL integrals for prompt (1D array [pt bin])
+    - nonprompt_integrals: FONLL integrals for nonprompt (1D array [pt bin])
+    - prompt_total_eff: total efficiency (preselection*BDT) for prompt (3D array)
+    - nonprompt_total_eff: total efficiency (preselection*BDT) for nonprompt (3D array)
+    --------------------------------
+    Outputs
+    - fprompt: prompt fraction fprompt[pt bin][clas][ithr] (3D array), 0 if no prompt signal
+    """
+    num = nonprompt_total_eff * np.asarray(nonprompt_integrals)[:, np.newaxis, np.newaxis]
+    denom = prompt_total_eff * np.asarray(prompt_integrals)[:, np.newaxis, np.newaxis]
+    fprompt = np.zeros_like(denom, dtype=np.float64)
+    np.divide(denom, denom + num, out=fprompt, where=denom != 0)
+    return fprompt
+
+def compute_expected_signal(prompt_integrals, fprompt, prompt_total_eff, luminosity):
+    """
+    Helper method to compute expected signal
+
+    --------------------------------
+    Parameters
+    - prompt_integrals: FONLL integrals for prompt (1D array [pt bin])
+    - fprompt: prompt fraction (3D array)
+    - prompt_total_eff: total efficiency (preselection*BDT) for prompt (3D array)
+    - luminosity: integrated luminosity
+    --------------------------------
+    Outputs
+    - expected_signal: expected signal expected_signal[pt bin][clas][ithr] (3D array), 0 if fprompt is 0
+    """
+    signal = 2 * np.asarray(prompt_integrals)[:, np.newaxis, np.newaxis] * prompt_total_eff * luminosity
+    expected_signal = np.zeros_like(signal, dtype=np.float64)
+    np.divide(signal, fprompt, out=expected_signal, where=fprompt != 0)
+    return expected_signal
+
+def compute_expected_signal_stage(presel, bdt, fonll):
+    """
+    Method to combine the outputs of the preselection, BDT and FONLL stages
+    """
+    prompt_total_eff = compute_total_efficiencies(presel.prompt_efficiencies, bdt.efficiencies[CLASSES.index("Prompt")])
+    nonprompt_total_eff = compute_total_efficiencies(presel.nonprompt_efficiencies, bdt.efficiencies[CLASSES.index("Nonprompt")])
+    fprompt = compute_fprompt(fonll.prompt_integrals, fonll.nonprompt_integrals, prompt_total_eff, nonprompt_total_eff)
+    expected_signal = compute_expected_signal(fonll.prompt_integrals, fprompt, prompt_total_eff, fonll.luminosity)
+    return ExpectedSignalResult(prompt_total_eff, nonprompt_total_eff, fprompt, 1 - fprompt, expected_signal)
+
+
+def run_pipeline(config, force=False):
+    """
+    Method to run all the stages of the selection tuning
+
+    --------------------------------
+    Parameters
+    - config: dictionary with config read from a yaml file
+    - force: recompute all the stages ignoring the cache
+    --------------------------------
+    Outputs
+    - results: dictionary {stage name: stage result}
+    """
+    cfg_cache = config.get("cache", {})
+    cache_dir = cfg_cache.get("dir", ".selection_tuning_cache") if cfg_cache.get("enable", True) else None
+    pt_bins = config["pt_bins"]
+
+    presel, presel_key = run_stage(
+        "preselection",
+        {"config": config["Preselection"], "pt_bins": pt_bins,
+         "file": get_file_identity(config["Preselection"]["file"]["name"])},
+        lambda: compute_preselection(config), PreselectionResult, cache_dir, force)
+    bdt, bdt_key = run_stage(
+        "bdt_efficiencies",
+        {"config": config["ML_output"], "pt_bins": pt_bins,
+         "file": get_file_identity(config["ML_output"]["file"])},
+        lambda: compute_bdt_efficiencies(config), BDTEfficiencyResult, cache_dir, force)
+    fonll, fonll_key = run_stage(
+        "fonll",
+        {"config": config["FONLL_output"], "pt_bins": pt_bins,
+         "file": get_file_identity(config["FONLL_output"]["file"])},
+        lambda: compute_fonll(config), FONLLResult, cache_dir, force)
+    signal, _ = run_stage(
+        "expected_signal",
+        {"preselection": presel_key, "bdt_efficiencies": bdt_key, "fonll": fonll_key},
+        lambda: compute_expected_signal_stage(presel, bdt, fonll), ExpectedSignalResult, cache_dir, force)
+
+    return {"preselection": presel, "bdt_efficiencies": bdt, "fonll": fonll, "expected_signal": signal}
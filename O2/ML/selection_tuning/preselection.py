@@ -36,36 +36,47 @@ def get_gen_keys(self, keys):
     if (self.promptness == "prompt"): return prompt_key
     else: return nonprompt_key
 
-def get_pt_bins_correspondance(self, X_pt_bins):
+def get_pt_bins_correspondance(pt_bins, X_pt_bins):
     """
-    Helper method to get pT binning correspondance between rec/gen binning and the binning in config file
+    Helper method to get pT binning correspondance between rec/gen binning and a given binning
+
+    --------------------------------
+    Parameters
+    - pt_bins: pT bin edges to look up
+    - X_pt_bins: pT bin edges of the rec/gen histogram
+    --------------------------------
+    Output
+    - idx: array of indices of X_pt_bins matching each edge of pt_bins
     """
-    idx_min_list, idx_max_list = [], []
-    pt_mins, pt_maxs = self.pt_bins[:-1], self.pt_bins[1:]
-    bin_width = X_pt_bins[1] - X_pt_bins[0]
-    for ipt, (pt_min, pt_max) in enumerate(zip(pt_mins, pt_maxs)):
-        idx_min, = np.where( ((X_pt_bins >= pt_min - 0.1*bin_width) & (X_pt_bins <= pt_min + 0.1*bin_width)))
-        idx_max, =  np.where( ((X_pt_bins >= pt_max - 0.1*bin_width) & (X_pt_bins <= pt_max + 0.1*bin_width)))
-        idx_min_list.append(idx_min[0])
-        idx_max_list.append(idx_max[0])
-    return idx_min_list, idx_max_list
-
-def compute_yield_per_pt(self, array, idx_lists):
+    pt_bins = np.asarray(pt_bins, dtype=np.float64)
+    tolerance = 0.1 * np.min(np.diff(X_pt_bins))
+    idx = np.searchsorted(X_pt_bins, pt_bins - tolerance)
+    idx_valid = np.minimum(idx, len(X_pt_bins) - 1)
+    if np.any(np.abs(X_pt_bins[idx_valid] - pt_bins) > tolerance):
+        raise ValueError(f"pT bins {pt_bins.tolist()} not compatible with the histogram binning")
+    return idx_valid
+
+def compute_yield_per_pt(cumulative, X_pt_bins, pt_bins):
     """
-    Helper method to get yield for a given pT bin
+    Helper method to get yields for all the pT bins at once from the prefix sums of a histogram
+
+    --------------------------------
+    Parameters
+    - cumulative: prefix sums of the histogram contents (cumulative[i] = sum of the first i bins)
+    - X_pt_bins: pT bin edges of the histogram
+    - pt_bins: pT bin edges where the yields are computed
+    --------------------------------
+    Output
+    - yields: array with the yield in each [pt_min, pt_max) bin
     """
-    pt_mins, pt_maxs = self.pt_bins[:-1], self.pt_bins[1:]
-    idx_min_list, idx_max_list = idx_lists[0], idx_lists[1]
-    number_list = {}
-    for ipt, pt_bin in enumerate(zip(pt_mins, pt_maxs)):
-        #a[i:j+1].sum() sum of all elements in a between indices i and j
-        sum = array[ idx_min_list[ipt]:idx_max_list[ipt]+1 ].sum()
-        number_list[pt_bin] = sum
-    return number_list
+    idx = get_pt_bins_correspondance(pt_bins, X_pt_bins)
+    return cumulative[idx[1:]] - cumulative[idx[:-1]]
 
 class Preselection:
     """
-    Preselection class to get the efficiencies
+    Preselection class to get the efficiencies.
+    The rec and gen histograms are read once when the object is built, and the efficiencies
+    for any pT binning compatible with the histograms are then obtained from prefix sums
     """
     particles_dico = ["D0", "Dplus", "Ds", "Lc", "Xic"]
     channels_dico = ["D0ToKPi", "DplusToPiKPi", "DsToKKPi", "LcToPKPi", "XicToPKPi"]
@@ -80,67 +91,57 @@ class Preselection:
         for name in self.particles_dico:
             if name in channel:
                 self.particleName = name
+        # read the histograms only once
+        self.rec_array, self.rec_pt_bins = self.tree_mc_rec[self.rec_key].to_numpy()
+        gen_histo = self.tree_mc_gen[self.gen_key]
+        self.gen_particles_labels = list(gen_histo.axis(0))
+        gen_array, _, self.gen_pt_bins = gen_histo.to_numpy()
+        self.gen_array = gen_array[self.gen_particle_idx]
+        # prefix sums used for the yields in any pT binning
+        self.rec_cumulative = np.concatenate(([0.], np.cumsum(self.rec_array)))
+        self.gen_cumulative = np.concatenate(([0.], np.cumsum(self.gen_array)))
+
     @property
     def rec_key(self):
         return get_rec_keys(self, self.tree_mc_rec.keys())
     @property
     def gen_key(self):
         return get_gen_keys(self, self.tree_mc_gen.keys())
-    @property
-    def rec_array(self):
-        return self.tree_mc_rec[self.rec_key].to_hist().to_numpy()[0]
-    @property
-    def rec_pt_bins(self):
-        return self.tree_mc_rec[self.rec_key].to_hist().to_numpy()[1]
-    
-    @property
-    def gen_particles_labels(self):
-        gen_prompt_TH2D = self.tree_mc_gen[self.gen_key]
-        gen_prompt_TH2D_x_labels = []
-        for x_label in gen_prompt_TH2D.axis(0):
-            gen_prompt_TH2D_x_labels.append(x_label)
-        return gen_prompt_TH2D_x_labels
+
     @property
     def gen_particle_idx(self):
         channel_idx = self.channels_dico.index(self.channel)
         particle_idx = self.gen_particles_labels.index(self.gen_particles_dico[channel_idx])
         return particle_idx
-    @property
-    def gen_array(self):
-        return self.tree_mc_gen[self.gen_key].to_hist().to_numpy()[0][self.gen_particle_idx]
-    @property
-    def gen_pt_bins(self):
-        return self.tree_mc_gen[self.gen_key].to_hist().to_numpy()[2]
 
-    @property
-    def rec_idx_lists(self):
-        return get_pt_bins_correspondance(self, self.rec_pt_bins)
-    @property
-    def gen_idx_lists(self):
-        return get_pt_bins_correspondance(self, self.gen_pt_bins)
+    def rec_yield_array(self, pt_bins=None):
+        return compute_yield_per_pt(self.rec_cumulative, self.rec_pt_bins, self.pt_bins if pt_bins is None else pt_bins)
+    def gen_yield_array(self, pt_bins=None):
+        return compute_yield_per_pt(self.gen_cumulative, self.gen_pt_bins, self.pt_bins if pt_bins is None else pt_bins)
 
     @property
     def rec_yield(self):
-        return compute_yield_per_pt(self, self.rec_array, self.rec_idx_lists)
+        pt_mins, pt_maxs = self.pt_bins[:-1], self.pt_bins[1:]
+        return dict(zip(zip(pt_mins, pt_maxs), self.rec_yield_array()))
     @property
     def gen_yield(self):
-        return compute_yield_per_pt(self, self.gen_array, self.gen_idx_lists)
+        pt_mins, pt_maxs = self.pt_bins[:-1], self.pt_bins[1:]
+        return dict(zip(zip(pt_mins, pt_maxs), self.gen_yield_array()))
 
     # preselection efficiency = (rec MC) / (gen MC)
+    def compute_efficiencies(self, pt_bins=None):
+        """
+        Method to compute the preselection efficiencies for a given pT binning
+        without reading again the input file (binning of the config by default)
+        """
+        return self.rec_yield_array(pt_bins) / self.gen_yield_array(pt_bins)
     @property
     def efficiencies_dico(self):
         pt_mins, pt_maxs = self.pt_bins[:-1], self.pt_bins[1:]
-        efficiencies = {}
-        for ipt, pt_bin in enumerate(zip(pt_mins, pt_maxs)):
-            efficiencies[pt_bin] = self.rec_yield[pt_bin] / self.gen_yield[pt_bin]
-        return efficiencies
+        return dict(zip(zip(pt_mins, pt_maxs), self.compute_efficiencies()))
     @property
     def efficiencies_array(self):
-        pt_mins, pt_maxs = self.pt_bins[:-1], self.pt_bins[1:]
-        efficiencies = []
-        for ipt, pt_bin in enumerate(zip(pt_mins, pt_maxs)):
-            efficiencies.append(self.rec_yield[pt_bin] / self.gen_yield[pt_bin])
-        return efficiencies
+        return list(self.compute_efficiencies())
 
 
 def plot_preselection_efficiency(channel, preselection_object, prompt_preselection_efficiencies_array, nonprompt_preselection_efficiencies_array, pt_bins, save):
@@ -0,0 +1,257 @@
+"""
+Script for the computation of the BDT thresholds corresponding to target background fractions
+in each pT bin. The ML_output_* columns of the background application outputs are streamed
+shard by shard: a first pass counts the candidates in each pT bin, a second pass keeps only
+the most extreme scores in mergeable tail sketches, from which the exact cuts are extracted
+run: python rejection_thresholds.py file1.parquet [file2.parquet ...] --pt_bins 1 2 4 6 10 --fractions 1e-4 1e-3
+"""
+
+import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+class TailSketch:
+    """
+    Exact sketch of the `capacity` most extreme values of a stream: the largest ones for
+    side="upper" (cuts like score > thr), the smallest ones for side="lower" (cuts like score < thr).
+    Sketches with the same side can be merged, so that shards can be processed independently
+    """
+
+    def __init__(self, capacity, side="upper"):
+        if side not in ["upper", "lower"]:
+            raise ValueError(f"side {side} not implemented, options: upper, lower")
+        self.capacity = int(capacity)
+        self.side = side
+        # values stored with the sign flipped for the lower side, to always keep the largest ones
+        self.values = np.empty(0, dtype=np.float64)
+
+    def _signed(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        return values if self.side == "upper" else -values
+
+    def _update_signed(self, values):
+        values = values[~np.isnan(values)]
+        if self.capacity == 0 or len(values) == 0:
+            return
+        values = np.concatenate((self.values, values))
+        if len(values) > self.capacity:
+            values = np.partition(values, len(values) - self.capacity)[-self.capacity:]
+        self.values = values
+
+    def update(self, values):
+        """
+        Method to add a batch of values to the sketch
+        """
+        self._update_signed(self._signed(values))
+
+    def merge(self, other):
+        """
+        Method to merge another sketch with the same side into this one
+        """
+        if other.side != self.side:
+            raise ValueError("cannot merge sketches with different sides")
+        self.capacity = max(self.capacity, other.capacity)
+        self._update_signed(other.values)
+        return self
+
+    def extreme(self, rank):
+        """
+        Method to get the rank-th most extreme value (rank = 1 is the most extreme),
+        nan if fewer values were seen
+        """
+        if rank > len(self.values) or rank < 1:
+            return np.nan
+        value = np.partition(self.values, len(self.values) - rank)[len(self.values) - rank]
+        return value if self.side == "upper" else -value
+
+
+def get_threshold(sketch, n_candidates, fraction):
+    """
+    Helper method to get the cut keeping at most a given fraction of the candidates
+
+    --------------------------------
+    Parameters
+    - sketch: TailSketch filled with the (preselected) scores
+    - n_candidates: total number of candidates (denominator of the fraction)
+    - fraction: target fraction of candidates passing the cut
+    --------------------------------
+    Output
+    - threshold: cut such that score > threshold (upper) or score < threshold (lower) is passed by
+      floor(fraction * n_candidates) candidates (fewer in case of ties); -inf (upper) or +inf (lower)
+      if fewer candidates are available, meaning that no cut is needed
+    """
+    n_keep = int(np.floor(fraction * n_candidates))
+    if n_keep >= len(sketch.values):
+        return -np.inf if sketch.side == "upper" else np.inf
+    return sketch.extreme(n_keep + 1)
+
+def read_batches(file_name, columns, batch_size, preselection=None, label=None):
+    """
+    Helper method to iterate over a parquet file in batches, reading only the requested columns
+
+    --------------------------------
+    Parameters
+    - file_name: name of the parquet file
+    - columns: columns to read
+    - batch_size: number of rows per batch
+    - preselection: optional query applied to each batch
+    - label: optional value of the Labels column to be selected
+    --------------------------------
+    Output
+    - generator of pandas dataframes
+    """
+    parquet_file = pq.ParquetFile(file_name)
+    if label is not None:
+        columns = columns + ["Labels"]
+    if preselection is not None:
+        # columns used in the preselection query
+        columns = columns + [col for col in parquet_file.schema_arrow.names
+                             if re.search(rf"\b{re.escape(col)}\b", preselection)]
+    columns = list(dict.fromkeys(columns))
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        df = batch.to_pandas()
+        if label is not None:
+            df = df[df["Labels"].to_numpy() == label]
+        if preselection is not None:
+            df = df.query(preselection)
+        yield df
+
+def get_pt_bin_index(pt, pt_bins):
+    """
+    Helper method to get the pT bin of each candidate, shared by the two passes so that the
+    counts and the sketches use the same binning
+
+    --------------------------------
+    Parameters
+    - pt: array with the pT of the candidates
+    - pt_bins: pT bin edges
+    --------------------------------
+    Output
+    - ipts: index of the pT bin, with bins closed on the left and open on the right (also the
+      last one, i.e. pt = pt_bins[-1] is outside the range); -1 or len(pt_bins) - 1 outside the range
+    """
+    return np.searchsorted(pt_bins, pt, side="right") - 1
+
+def count_candidates(file_name, pt_col, pt_bins, batch_size, label=None):
+    """
+    Method to count the candidates in each pT bin of a shard (first pass)
+    """
+    n_bins = len(pt_bins) - 1
+    counts = np.zeros(n_bins, dtype=np.int64)
+    for df in read_batches(file_name, [pt_col], batch_size, label=label):
+        ipts = get_pt_bin_index(df[pt_col].to_numpy(), pt_bins)
+        ipts = ipts[(ipts >= 0) & (ipts < n_bins)]
+        counts += np.bincount(ipts, minlength=n_bins)
+    return counts
+
+def fill_sketches(file_name, pt_col, pt_bins, score_cols, capacities, lower_scores, batch_size,
+                  preselection=None, label=None):
+    """
+    Method to fill the tail sketches of a shard (second pass)
+
+    --------------------------------
+    Output
+    - sketches: dictionary {(ipt, score column): TailSketch}
+    """
+    sketches = {(ipt, col): TailSketch(capacity, "lower" if col in lower_scores else "upper")
+                for ipt, capacity in enumerate(capacities) for col in score_cols}
+    for df in read_batches(file_name, [pt_col] + score_cols, batch_size, preselection, label):
+        ipts = get_pt_bin_index(df[pt_col].to_numpy(), pt_bins)
+        for col in score_cols:
+            scores = df[col].to_numpy()
+            for ipt in range(len(capacities)):
+                sketches[(ipt, col)].update(scores[ipts == ipt])
+    return sketches
+
+def compute_thresholds(file_names, pt_col, pt_bins, fractions, score_cols, lower_scores=("ML_output_Bkg",),
+                       preselection=None, label=None, batch_size=1000000, n_jobs=1):
+    """
+    Method to compute the thresholds corresponding to target background fractions in each pT bin
+
+    --------------------------------
+    Parameters
+    - file_names: list of parquet files with the BDT application outputs (shards)
+    - pt_col: name of the pT column
+    - pt_bins: pT bin edges
+    - fractions: target fractions of background candidates passing the cut
+    - score_cols: ML_output_* columns for which the thresholds are computed
+    - lower_scores: columns for which the candidates are selected below the threshold
+    - preselection: optional query applied before the cut (e.g. "ML_output_Bkg < 0.1"); the
+      fractions are always computed with respect to all the candidates in the pT bin
+    - label: optional value of the Labels column to be selected
+    - batch_size: number of rows read at once
+    - n_jobs: number of shards processed in parallel
+    --------------------------------
+    Output
+    - thresholds: pandas dataframe with one row per pT bin, score column and fraction
+    """
+    file_names = list(file_names)
+    if not file_names:
+        raise ValueError("no input file given, at least one parquet file is needed")
+    pt_bins = np.asarray(pt_bins, dtype=np.float64)
+    score_cols = list(score_cols)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        # first pass: number of candidates per pT bin, only the pT column is read
+        counts = sum(executor.map(partial(count_candidates, pt_col=pt_col, pt_bins=pt_bins,
+                                          batch_size=batch_size, label=label), file_names))
+        # second pass: only the most extreme scores needed for the largest fraction are kept
+        capacities = [int(np.floor(max(fractions) * count)) + 1 for count in counts]
+        shard_sketches = executor.map(partial(fill_sketches, pt_col=pt_col, pt_bins=pt_bins,
+                                              score_cols=score_cols, capacities=capacities,
+                                              lower_scores=lower_scores, batch_size=batch_size,
+                                              preselection=preselection, label=label), file_names)
+        sketches = None
+        for shard_sketch in shard_sketches:
+            if sketches is None:
+                sketches = shard_sketch
+            else:
+                for key, sketch in shard_sketch.items():
+                    sketches[key].merge(sketch)
+
+    rows = []
+    for ipt, (pt_min, pt_max) in enumerate(zip(pt_bins[:-1], pt_bins[1:])):
+        for col in score_cols:
+            sketch = sketches[(ipt, col)]
+            for fraction in fractions:
+                rows.append({"pt_min": pt_min, "pt_max": pt_max, "score": col, "side": sketch.side,
+                             "bkg_fraction": fraction, "n_candidates": counts[ipt],
+                             "threshold": get_threshold(sketch, counts[ipt], fraction)})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Arguments")
+    parser.add_argument("files", metavar="text", nargs="+",
+                        help="parquet files with the BDT application outputs on background")
+    parser.add_argument("--pt_col", default="fPT2Prong",
+                        help="name of the pT column")
+    parser.add_argument("--pt_bins", type=float, nargs="+", required=True,
+                        help="pT bin edges")
+    parser.add_argument("--fractions", type=float, nargs="+", default=[1.e-4],
+                        help="target fractions of background passing the cut")
+    parser.add_argument("--scores", nargs="+", default=["ML_output_Prompt", "ML_output_Nonprompt"],
+                        help="ML_output columns for which the thresholds are computed")
+    parser.add_argument("--lower_scores", nargs="*", default=["ML_output_Bkg"],
+                        help="ML_output columns selected below the threshold")
+    parser.add_argument("--preselection", default=None,
+                        help="query applied before the cut, e.g. 'ML_output_Bkg < 0.1'")
+    parser.add_argument("--label", type=int, default=None,
+                        help="value of the Labels column to be selected (e.g. 0 for background)")
+    parser.add_argument("--batch_size", type=int, default=1000000,
+                        help="number of rows read at once")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of shards processed in parallel")
+    parser.add_argument("--output", default=None,
+                        help="csv output file")
+    args = parser.parse_args()
+
+    df_thr = compute_thresholds(args.files, args.pt_col, args.pt_bins, args.fractions, args.scores,
+                                args.lower_scores, args.preselection, args.label, args.batch_size, args.jobs)
+    print(df_thr.to_string(index=False))
+    if args.output:
+        df_thr.to_csv(args.output, index=False)
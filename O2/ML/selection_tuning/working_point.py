@@ -0,0 +1,160 @@
+"""
+Optimisation of the BDT working point in each pT bin: S, B, S/B and significance are computed
+on the full threshold grid for all the pT bins at once, starting from the outputs of the
+selection-tuning pipeline
+"""
+
+import json
+import numpy as np
+import pandas as pd
+
+from pipeline import CLASSES
+
+# names of the BDT threshold tables in the hf-filter configuration
+trigger_config_keys = {"D0ToKPi": "thresholdBDTScoreD0ToKPi",
+                       "DplusToPiKPi": "thresholdBDFScoreDPlusToPiKPi",
+                       "DsToKKPi": "thresholdBDFScoreDSToPiKK",
+                       "LcToPKPi": "thresholdBDFScoreLcToPiKP",
+                       "XicToPKPi": "thresholdBDFScoreXicToPiKP"}
+
+
+def compute_background(bkg_efficiencies, bkg_candidates_per_event, n_events):
+    """
+    Helper method to compute the expected background
+
+    --------------------------------
+    Parameters
+    - bkg_efficiencies: BDT efficiencies of the background label (3D array [pt bin][clas][ithr])
+    - bkg_candidates_per_event: background candidates per event after the preselection
+      (scalar or 1D array [pt bin])
+    - n_events: number of events
+    --------------------------------
+    Output
+    - background: expected background background[pt bin][clas][ithr] (3D array)
+    """
+    bkg_norm = np.broadcast_to(np.asarray(bkg_candidates_per_event, dtype=np.float64), bkg_efficiencies.shape[:1])
+    return bkg_norm[:, np.newaxis, np.newaxis] * n_events * bkg_efficiencies
+
+def compute_figures_of_merit(signal, background):
+    """
+    Helper method to compute S/B and significance S/sqrt(S+B) on the full grid
+
+    --------------------------------
+    Parameters
+    - signal: expected signal (3D array [pt bin][clas][ithr])
+    - background: expected background (3D array [pt bin][clas][ithr])
+    --------------------------------
+    Outputs
+    - s_over_b: S/B (3D array), nan where B = 0
+    - significance: S/sqrt(S+B) (3D array), 0 where S+B = 0
+    """
+    s_over_b = np.full_like(signal, np.nan, dtype=np.float64)
+    np.divide(signal, background, out=s_over_b, where=background > 0)
+    significance = np.zeros_like(signal, dtype=np.float64)
+    np.divide(signal, np.sqrt(signal + background), out=significance, where=(signal + background) > 0)
+    return s_over_b, significance
+
+def find_working_points(pt_bins, thresholds, signal, background, BDT_cuts, figure_of_merit="significance",
+                        min_signal=0., classes=("Prompt", "Nonprompt")):
+    """
+    Method to find the optimal BDT thresholds in each pT bin
+
+    --------------------------------
+    Parameters
+    - pt_bins: pT bin edges
+    - thresholds: BDT thresholds of the grid
+    - signal: expected signal (3D array [pt bin][clas][ithr])
+    - background: expected background (3D array [pt bin][clas][ithr])
+    - BDT_cuts: dictionary with the BDT cuts of the config (the Bkg one is kept fixed)
+    - figure_of_merit: quantity to maximise, options: significance, s_over_b
+    - min_signal: minimum expected signal required for a threshold to be considered
+    - classes: classes for which the threshold is optimised
+    --------------------------------
+    Output
+    - working_points: pandas dataframe with one row per pT bin
+    """
+    s_over_b, significance = compute_figures_of_merit(signal, background)
+    if figure_of_merit == "significance":
+        fom = significance.copy()
+    elif figure_of_merit == "s_over_b":
+        fom = np.nan_to_num(s_over_b, nan=-np.inf)
+    else:
+        raise ValueError(f"figure of merit {figure_of_merit} not implemented")
+    fom[signal < min_signal] = -np.inf
+
+    # best threshold for all pT bins and classes at once
+    ithr_best = np.argmax(fom, axis=-1)
+    best = lambda array: np.take_along_axis(array, ithr_best[..., np.newaxis], axis=-1)[..., 0]
+    thresholds = np.asarray(thresholds)
+
+    working_points = {"pt_min": pt_bins[:-1], "pt_max": pt_bins[1:],
+                      "threshold_Bkg": np.full(len(pt_bins) - 1, BDT_cuts["Bkg"])}
+    for clas in classes:
+        iclas = CLASSES.index(clas)
+        working_points[f"threshold_{clas}"] = thresholds[ithr_best[:, iclas]]
+        working_points[f"S_{clas}"] = best(signal)[:, iclas]
+        working_points[f"B_{clas}"] = best(background)[:, iclas]
+        working_points[f"S_over_B_{clas}"] = best(s_over_b)[:, iclas]
+        working_points[f"significance_{clas}"] = best(significance)[:, iclas]
+        # flag pT bins where no threshold satisfies the requirements
+        working_points[f"valid_{clas}"] = np.isfinite(best(fom)[:, iclas])
+    # classes not optimised keep the thresholds of the config
+    for clas in CLASSES:
+        if f"threshold_{clas}" not in working_points:
+            working_points[f"threshold_{clas}"] = np.full(len(pt_bins) - 1, BDT_cuts[clas])
+
+    return pd.DataFrame(working_points)
+
+def get_trigger_config(working_points, channel):
+    """
+    Method to format the working points as the hf-filter configuration (dpl-config-triggerHF.json)
+
+    --------------------------------
+    Parameters
+    - working_points: output of find_working_points
+    - channel: decay channel
+    --------------------------------
+    Output
+    - trigger_config: dictionary with the pTBinsBDT and BDT threshold entries
+    """
+    pt_bins = list(working_points["pt_min"]) + [working_points["pt_max"].iloc[-1]]
+    values = []
+    for _, row in working_points.iterrows():
+        values.append([f"{row[f'threshold_{clas}']:g}" for clas in CLASSES])
+    return {"pTBinsBDT": {"values": [f"{pt:g}" for pt in pt_bins]},
+            trigger_config_keys[channel]: {"labels_rows": "",
+                                           "labels_cols": ["BDTbkg", "BDTprompt", "BDTnonprompt"],
+                                           "values": values}}
+
+def optimise_working_points(config, results):
+    """
+    Method to optimise the working points from the outputs of the selection-tuning pipeline
+
+    --------------------------------
+    Parameters
+    - config: dictionary with config read from a yaml file
+    - results: output of pipeline.run_pipeline
+    --------------------------------
+    Outputs
+    - working_points: pandas dataframe with one row per pT bin
+    - trigger_config: dictionary ready to be pasted in the hf-filter configuration
+    """
+    cfg_wp = config["working_point"]
+    bdt = results["bdt_efficiencies"]
+    fonll = results["fonll"]
+    signal = results["expected_signal"].expected_signal
+    n_events = cfg_wp.get("n_events") or float(fonll.number_of_events)
+    background = compute_background(bdt.efficiencies[CLASSES.index("Bkg")],
+                                    cfg_wp["bkg_candidates_per_event"], n_events)
+    working_points = find_working_points(np.asarray(config["pt_bins"]), bdt.thresholds, signal, background,
+                                         config["ML_output"]["BDT_cuts"],
+                                         cfg_wp.get("figure_of_merit", "significance"),
+                                         cfg_wp.get("min_signal", 0.))
+    trigger_config = get_trigger_config(working_points, config["ML_output"]["channel"])
+
+    if cfg_wp.get("output"):
+        working_points.to_csv(cfg_wp["output"], index=False)
+    print(working_points.to_string(index=False))
+    print(json.dumps(trigger_config, indent=2))
+
+    return working_points, trigger_config
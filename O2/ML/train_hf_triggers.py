@@ -17,6 +17,8 @@ from hipe4ml import plot_utils
 from hipe4ml.model_handler import ModelHandler
 from hipe4ml.tree_handler import TreeHandler
 from hipe4ml_converter.h4ml_converter import H4MLConverter
+sys.path.append('../..')
+from pyutils.LookupTable import BuildLookupTable, GetLookupTableReport  #pylint: disable=wrong-import-position,import-error
 
 
 def is_selected_massKK(cand, mass_cut):
@@ -256,7 +258,8 @@ def train(config, train_test_data):  # pylint: disable=too-many-locals
     df_column_to_save_list = config["output"]["column_to_save_list"]
 
     test_set_df = train_test_data[2]
-    test_set_df = test_set_df.loc[:, df_column_to_save_list]
+    # the training variables are kept to evaluate compact versions of the model (compact_bdt.py)
+    test_set_df = test_set_df.loc[:, list(dict.fromkeys(df_column_to_save_list + training_vars))]
     test_set_df[f'Labels'] = train_test_data[3]
 
     for pred, lab in enumerate(output_labels):
@@ -272,6 +275,8 @@ def train(config, train_test_data):  # pylint: disable=too-many-locals
         os.remove(f"{out_dir}/ModelHandler_onnx_hummingbird_{channel}")
 
     model_hdl.dump_model_handler(f"{out_dir}/ModelHandler_{channel}.pickle")
+    # xgboost JSON dump, can be applied without xgboost with pyutils/TreeEnsemble.py
+    model_hdl.get_original_model().get_booster().save_model(f"{out_dir}/ModelHandler_{channel}.json")
     model_conv = H4MLConverter(model_hdl)
     model_conv.convert_model_onnx(1)
     model_conv.dump_model_onnx(f"{out_dir}/ModelHandler_onnx_{channel}.onnx")
@@ -279,6 +284,17 @@ def train(config, train_test_data):  # pylint: disable=too-many-locals
     model_conv.dump_model_hummingbird(
         f"{out_dir}/ModelHandler_onnx_hummingbird_{channel}")
 
+    # quantile-binned lookup table, populated with the training sample and compared on the test sample
+    lut_cfg = config["ml"].get("lookup_table", {"activate": False})
+    if lut_cfg["activate"]:
+        lut = BuildLookupTable(model_hdl, train_test_data[0], lut_cfg["n_bins"], lut_cfg["n_bits"],
+                               lut_cfg["n_levels"], outputMargin=config["ml"]["raw_output"])
+        lut.Save(f"{out_dir}/LookupTable_{channel}")
+        lut_report = GetLookupTableReport(lut, train_test_data[2], train_test_data[3], y_pred_test)
+        pd.DataFrame([lut_report]).to_csv(f"{out_dir}/LookupTable_{channel}/report.csv", index=False)
+        print(f"\033[32mLookup table: {lut_report['table_size'] / 1024**2:.2f} MB, "
+              f"{lut_report['n_cells']} cells, max AUC loss {lut_report['max_auc_loss']:.4f}\033[0m")
+
     # plots
     leg_labels = ["bkg", "prompt", "nonprompt"]
 
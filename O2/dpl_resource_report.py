@@ -0,0 +1,315 @@
+"""
+Script for the report of the resources used by the devices of a DPL workflow run with
+--resources-monitoring (e.g. runTrigger.sh or runOpt.sh): the performance-metrics json dump of
+the driver is parsed, and CPU time, RSS, shared-memory usage, message rates and throughput are
+summarised per device. The bottleneck device (largest CPU time) is flagged, and the peak
+shared-memory usage and AOD bytes in flight are compared with --shm-segment-size and
+--aod-memory-rate-limit of the workflow
+run: python dpl_resource_report.py performanceMetrics.json [--script runTrigger.sh]
+                                   [--shm_segment_size 7500000000] [--aod_memory_rate_limit 1000000000]
+                                   [--output resources.csv]
+"""
+
+import re
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+# names of the metrics in the different O2 versions (compared after normalise_name)
+METRIC_ALIASES = {
+    "cpu_percent": ["cpuUsedPercentage", "cpu-usage-percentage", "cpuUsage", "cpu_usage_fraction"],
+    "cpu_time": ["cpuUsedAbsolute", "cpu-used-absolute", "cpuTime"],
+    "rss": ["proc-rss", "memoryUsage", "rss", "resident-memory"],
+    "shm_created": ["arrow-bytes-created", "shm-bytes-allocated"],
+    "shm_destroyed": ["arrow-bytes-destroyed", "shm-bytes-freed"],
+    "shm_offered": ["shm-offer-bytes-consumed"],
+    "messages": ["arrow-messages-created", "total-signals", "processed-messages"],
+    "aod_read": ["aod-bytes-read-uncompressed", "aod-bytes-read"],
+    "aod_read_compressed": ["aod-bytes-read-compressed"],
+    "input_rate": ["input_rate_mb_s", "input-rate-mb-s"],
+    "output_rate": ["output_rate_mb_s", "output-rate-mb-s"],
+}
+# units of the metrics converted to seconds and bytes
+CPU_TIME_UNIT = 1.e-6  # cpuUsedAbsolute in us
+RSS_UNIT = 1024.  # proc-rss in kB
+READER_DEVICE = "internal-dpl-aod-reader"
+SATURATION_PERCENT = 90.
+
+
+def normalise_name(name):
+    """
+    Helper function to compare metric names independently of case and separators
+    """
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+ALIAS_LOOKUP = {normalise_name(alias): quantity for quantity, aliases in METRIC_ALIASES.items()
+                for alias in aliases}
+
+
+def parse_series(entries):
+    """
+    Function to convert the entries of a metric to time series, tolerating the different formats
+    ({timestamp, value} dictionaries, [timestamp, value] pairs or plain values, values as strings)
+
+    Outputs
+    -----------------
+    - times: numpy array with the timestamps (s), the index of the entry if not available
+    - values: numpy array with the values
+    """
+    if isinstance(entries, dict):
+        entries = entries.get("values", entries.get("entries", [entries]))
+    if not isinstance(entries, list):
+        entries = [entries]
+    times, values = [], []
+    for i_entry, entry in enumerate(entries):
+        if isinstance(entry, dict):
+            time_stamp, value = entry.get("timestamp", entry.get("time", i_entry)), entry.get("value")
+        elif isinstance(entry, (list, tuple)) and len(entry) == 2:
+            time_stamp, value = entry
+        else:
+            time_stamp, value = i_entry, entry
+        try:
+            times.append(float(time_stamp))
+            values.append(float(value))
+        except (TypeError, ValueError):
+            continue
+    times, values = np.asarray(times), np.asarray(values)
+    # timestamps in ms
+    if len(times) > 1 and np.median(times) > 1.e11:
+        times = times * 1.e-3
+    order = np.argsort(times, kind="stable")
+    return times[order], values[order]
+
+
+def load_metrics(file_name):
+    """
+    Function to read the performance-metrics dump
+
+    Parameters
+    -----------------
+    - file_name: json file with {device: {metric: entries}} (or a list of devices with name and metrics)
+
+    Outputs
+    -----------------
+    - metrics: dictionary {device: {quantity: (times, values)}}, with the quantities of METRIC_ALIASES
+    - unknown: set of metric names not recognised
+    """
+    with open(file_name) as in_file:
+        dump = json.load(in_file)
+    if isinstance(dump, dict) and isinstance(dump.get("devices"), list):
+        dump = dump["devices"]
+    if isinstance(dump, list):
+        dump = {device.get("name", f"device_{i_dev}"): device.get("metrics", device)
+                for i_dev, device in enumerate(dump)}
+
+    metrics, unknown = {}, set()
+    for device, device_metrics in dump.items():
+        if not isinstance(device_metrics, dict):
+            continue
+        metrics[device] = {}
+        for name, entries in device_metrics.items():
+            quantity = ALIAS_LOOKUP.get(normalise_name(name))
+            if quantity is None:
+                unknown.add(name)
+                continue
+            if quantity not in metrics[device]:
+                metrics[device][quantity] = parse_series(entries)
+    return metrics, unknown
+
+
+def get_increase(values):
+    """
+    Helper function to get the increase of a counter, or the sum of the values if they are per
+    interval (not increasing, e.g. constant)
+    """
+    if len(values) == 0:
+        return np.nan
+    if len(values) > 1 and np.all(np.diff(values) >= 0) and values[-1] > values[0]:
+        return values[-1] - values[0]
+    return np.sum(values)
+
+
+def get_shm_in_use(device_metrics):
+    """
+    Helper function to get the shared memory in use by a device (bytes created and not yet destroyed)
+
+    Outputs
+    -----------------
+    - in_use: numpy array with the bytes in use at the times of the created-bytes metric (empty if not available)
+    """
+    times_created, created = device_metrics.get("shm_created", (np.array([]), np.array([])))
+    times_destroyed, destroyed = device_metrics.get("shm_destroyed", (np.array([]), np.array([])))
+    if len(destroyed) == 0:
+        return created
+    return created - np.interp(times_created, times_destroyed, destroyed, left=0.)
+
+
+def summarise_device(device_metrics):
+    """
+    Function to summarise the metrics of a device
+
+    Outputs
+    -----------------
+    - summary: dictionary with wall time, CPU time and usage, peak RSS and shared memory,
+               messages and message rate, bytes read and throughput (nan if not available)
+    """
+    all_times = np.concatenate([times for times, _ in device_metrics.values()]) \
+        if device_metrics else np.array([])
+    wall_time = all_times.max() - all_times.min() if len(all_times) > 1 else np.nan
+    summary = {"wall_time_s": wall_time}
+
+    def get(quantity):
+        return device_metrics.get(quantity, (np.array([]), np.array([])))
+
+    cpu_percent = get("cpu_percent")[1]
+    cpu_time = get_increase(get("cpu_time")[1]) * CPU_TIME_UNIT
+    if np.isnan(cpu_time) and len(cpu_percent) > 0 and not np.isnan(wall_time):
+        cpu_time = np.mean(cpu_percent) / 100. * wall_time
+    summary["cpu_time_s"] = cpu_time
+    summary["cpu_mean_percent"] = np.mean(cpu_percent) if len(cpu_percent) > 0 else \
+        (100. * cpu_time / wall_time if wall_time and not np.isnan(wall_time) else np.nan)
+    summary["cpu_max_percent"] = np.max(cpu_percent) if len(cpu_percent) > 0 else np.nan
+
+    rss = get("rss")[1]
+    summary["rss_max_mb"] = np.max(rss) * RSS_UNIT / 1.e6 if len(rss) > 0 else np.nan
+
+    # shared memory in use, or bytes offered by the segment if the created bytes are not available
+    in_use = get_shm_in_use(device_metrics)
+    if len(in_use) > 0:
+        summary["shm_max_mb"] = np.max(in_use) / 1.e6
+    else:
+        offered = get("shm_offered")[1]
+        summary["shm_max_mb"] = np.max(offered) / 1.e6 if len(offered) > 0 else np.nan
+
+    messages = get_increase(get("messages")[1])
+    summary["messages"] = messages
+    summary["message_rate_hz"] = messages / wall_time if wall_time and not np.isnan(wall_time) else np.nan
+
+    aod_read = get_increase(get("aod_read")[1])
+    summary["read_mb"] = aod_read / 1.e6
+    rates = [np.mean(get(quantity)[1]) for quantity in ("input_rate", "output_rate") if len(get(quantity)[1]) > 0]
+    if not np.isnan(aod_read) and wall_time and not np.isnan(wall_time):
+        summary["throughput_mb_s"] = aod_read / 1.e6 / wall_time
+    else:
+        summary["throughput_mb_s"] = max(rates) if rates else np.nan
+    return summary
+
+
+def get_workflow_options(script_name):
+    """
+    Function to read --shm-segment-size and --aod-memory-rate-limit from a workflow script
+
+    Outputs
+    -----------------
+    - options: dictionary with shm_segment_size and aod_memory_rate_limit (None if not set)
+    """
+    with open(script_name) as in_file:
+        script = in_file.read()
+    options = {}
+    for key, option in [("shm_segment_size", "--shm-segment-size"), ("aod_memory_rate_limit", "--aod-memory-rate-limit")]:
+        values = [float(value) for value in re.findall(rf"{option}[ =](\d+)", script)]
+        options[key] = max(values) if values else None
+    return options
+
+
+def get_report(metrics):
+    """
+    Function to build the table of the devices and flag the bottleneck
+
+    Outputs
+    -----------------
+    - table: pandas dataframe with one row per device, sorted by CPU time
+    - bottleneck: name of the bottleneck device (None if no CPU information)
+    """
+    table = pd.DataFrame([{"device": device, **summarise_device(device_metrics)}
+                          for device, device_metrics in metrics.items()])
+    if table.empty:
+        return table, None
+    table = table.sort_values("cpu_time_s", ascending=False, na_position="last").reset_index(drop=True)
+    table["cpu_fraction"] = table["cpu_time_s"] / table["cpu_time_s"].sum()
+    # the device with the largest CPU time paces the workflow (its input queues fill up)
+    table["saturated"] = table["cpu_mean_percent"] > SATURATION_PERCENT
+    bottleneck = table["device"].iloc[0] if not np.isnan(table["cpu_time_s"].iloc[0]) else None
+    table["bottleneck"] = table["device"] == bottleneck
+    return table, bottleneck
+
+
+def check_limits(table, metrics, shm_segment_size=None, aod_memory_rate_limit=None):
+    """
+    Function to compare the peak usage with the shm segment size and the AOD memory rate limit
+
+    Outputs
+    -----------------
+    - messages: list of (level, message), level in info or warning
+    """
+    messages = []
+    peak_shm = np.nansum(table["shm_max_mb"].to_numpy()) * 1.e6 if not table.empty else 0.
+    if shm_segment_size:
+        usage = peak_shm / shm_segment_size
+        messages.append(("info", f"peak shared memory {peak_shm / 1.e9:.2f} GB (sum of the device peaks) = "
+                                 f"{usage:.0%} of --shm-segment-size {shm_segment_size / 1.e9:.2f} GB"))
+        if usage > 0.8:
+            messages.append(("warning", f"shm segment close to full, increase --shm-segment-size to at least "
+                                        f"{1.5 * peak_shm:.0f}"))
+        elif 0 < usage < 0.2:
+            messages.append(("info", f"shm segment mostly unused, --shm-segment-size {int(2 * peak_shm)} "
+                                     "would be enough and leaves memory for parallel workflows"))
+    if aod_memory_rate_limit:
+        in_flight = get_shm_in_use(metrics.get(READER_DEVICE, {}))
+        if len(in_flight) > 0:
+            usage = np.max(in_flight) / aod_memory_rate_limit
+            messages.append(("info", f"peak AOD bytes in flight {np.max(in_flight) / 1.e6:.0f} MB = {usage:.0%} "
+                                     f"of --aod-memory-rate-limit {aod_memory_rate_limit / 1.e6:.0f} MB"))
+            if usage > 0.9:
+                messages.append(("warning", "the reader is throttled by --aod-memory-rate-limit, increase it if the "
+                                            "shm segment allows it"))
+        else:
+            messages.append(("info", f"no shm metrics for {READER_DEVICE}, AOD rate limit not checked"))
+    return messages
+
+
+def main():
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(description="Arguments")
+    parser.add_argument("metrics", metavar="text", default="performanceMetrics.json",
+                        help="json dump of the DPL performance metrics")
+    parser.add_argument("--script", default=None,
+                        help="workflow script (e.g. runTrigger.sh) to read the shm and AOD rate limits from")
+    parser.add_argument("--shm_segment_size", type=float, default=None, help="shm segment size (bytes)")
+    parser.add_argument("--aod_memory_rate_limit", type=float, default=None, help="AOD memory rate limit (bytes)")
+    parser.add_argument("--output", default=None, help="csv file for the table of the devices")
+    args = parser.parse_args()
+
+    options = get_workflow_options(args.script) if args.script is not None else {}
+    shm_segment_size = args.shm_segment_size if args.shm_segment_size is not None \
+        else options.get("shm_segment_size")
+    aod_memory_rate_limit = args.aod_memory_rate_limit if args.aod_memory_rate_limit is not None \
+        else options.get("aod_memory_rate_limit")
+
+    metrics, unknown = load_metrics(args.metrics)
+    table, bottleneck = get_report(metrics)
+    if table.empty:
+        print(f"\033[91mERROR: no device metrics in {args.metrics}\033[0m")
+        sys.exit(1)
+    if unknown:
+        print(f"Metrics not used: {', '.join(sorted(unknown))}")
+    with pd.option_context("display.float_format", "{:.3g}".format, "display.width", 200):
+        print(table.to_string(index=False))
+    if args.output is not None:
+        table.to_csv(args.output, index=False)
+
+    if bottleneck is not None:
+        row = table.iloc[0]
+        print(f"\033[93mBottleneck: {bottleneck} ({row['cpu_time_s']:.1f} s CPU, {row['cpu_fraction']:.0%} of the "
+              f"workflow, {row['cpu_mean_percent']:.0f}% mean CPU usage)\033[0m")
+    for level, message in check_limits(table, metrics, shm_segment_size, aod_memory_rate_limit):
+        print(f"\033[93mWARNING: {message}\033[0m" if level == "warning" else message)
+
+
+if __name__ == "__main__":
+    main()
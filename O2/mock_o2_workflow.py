@@ -0,0 +1,96 @@
+"""
+Mock of an O2 DPL device, for the local tests of run_filter_scan.py without an O2 installation.
+The devices are chained with pipes as in runTrigger.sh: each one forwards the upstream topology
+and adds its own name, and the last one (with --fairmq-ipc-prefix) processes toy events with the
+hf-filter thresholds of the configuration and writes AnalysisResults.root in the current directory
+run: python mock_o2_workflow.py --device o2-analysis-hf-filter -b --configuration json://dpl-config.json
+                                [--mock-events 100000] [--mock-duration 1] [--mock-fail]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import uproot
+
+TRIGGER_LABELS = ["processed", "HighPt2P", "HighPt3P", "Beauty3P"]
+
+
+def get_processed_events(filter_config, n_events, seed=42):
+    """
+    Function to emulate the hf-filter decisions on toy events
+
+    Parameters
+    -----------------
+    - filter_config: dictionary with the hf-filter configuration
+    - n_events: number of toy events
+    - seed: seed of the random generator
+
+    Outputs
+    -----------------
+    - counts: number of processed events and of events selected by each trigger
+    """
+    rng = np.random.default_rng(seed)
+    # leading pt of the 2-prong and 3-prong candidates and B+ mass residual of each event
+    pt_2prong = rng.exponential(2., n_events) * rng.exponential(1., n_events)
+    pt_3prong = rng.exponential(2., n_events) * rng.exponential(1., n_events)
+    has_beauty = rng.random(n_events) < 0.05
+    delta_mass = np.abs(rng.normal(0., 0.2, n_events))
+    return np.array([n_events,
+                     np.sum(pt_2prong > float(filter_config["pTThreshold2Prong"])),
+                     np.sum(pt_3prong > float(filter_config["pTThreshold3Prong"])),
+                     np.sum(has_beauty & (delta_mass < float(filter_config["deltaMassBPlus"])))],
+                    dtype=np.float64)
+
+
+def main():
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(description="Arguments")
+    parser.add_argument("--device", default="o2-analysis-hf-filter", help="name of the mocked executable")
+    parser.add_argument("--configuration", default=None, help="DPL configuration (json://file)")
+    parser.add_argument("--shm-segment-size", type=int, default=None, help="size of the shm segment")
+    parser.add_argument("--shm-segment-id", type=int, default=0, help="id of the shm segment (16-bit unsigned)")
+    parser.add_argument("--fairmq-ipc-prefix", default=None, help="directory of the ipc sockets")
+    parser.add_argument("--mock-events", type=int, default=100000, help="number of toy events")
+    parser.add_argument("--mock-duration", type=float, default=1., help="duration of the processing (s)")
+    parser.add_argument("--mock-fail", action="store_true", default=False, help="exit with an error")
+    args, _ = parser.parse_known_args()
+
+    # topology forwarded along the pipe, as the DPL devices do
+    upstream = [] if sys.stdin.isatty() else [line.strip() for line in sys.stdin if line.strip()]
+    if args.fairmq_ipc_prefix is None:
+        print("\n".join(upstream + [args.device]))
+        return
+
+    if not 0 <= args.shm_segment_id <= 65535:
+        print(f"[ERROR] {args.device}: invalid --shm-segment-id {args.shm_segment_id}, 16-bit unsigned value expected",
+              file=sys.stderr)
+        sys.exit(1)
+    if args.mock_fail:
+        print(f"[ERROR] {args.device}: mock failure", file=sys.stderr)
+        sys.exit(1)
+    if args.configuration is None or not args.configuration.startswith("json://"):
+        print(f"[ERROR] {args.device}: a json:// configuration is required", file=sys.stderr)
+        sys.exit(1)
+    with open(args.configuration[len("json://"):]) as in_file:
+        config = json.load(in_file)
+    if "hf-filter" not in config:
+        print(f"[ERROR] {args.device}: hf-filter not in the configuration", file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(args.fairmq_ipc_prefix, exist_ok=True)
+    print(f"[INFO] topology: {' | '.join(upstream + [args.device])}")
+    print(f"[INFO] shm segment size: {args.shm_segment_size}, ipc prefix: {args.fairmq_ipc_prefix}")
+    time.sleep(args.mock_duration)
+    counts = get_processed_events(config["hf-filter"], args.mock_events)
+    with uproot.recreate("AnalysisResults.root") as out_file:
+        out_file["hf-filter/registry/fProcessedEvents"] = (counts, np.arange(len(counts) + 1, dtype=np.float64))
+    print(f"[INFO] {dict(zip(TRIGGER_LABELS, counts.astype(int).tolist()))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Script for the scan of the hf-filter settings with the O2 DPL workflow of runTrigger.sh: the
+configuration variants are generated from a scan spec (grid or zip of the scanned values) on top
+of dpl-config-triggerHF.json, and several workflows are run concurrently, each in its own
+directory with its own --fairmq-ipc-prefix and shared-memory segment, as long as the reserved
+memory (shm segment + processes) of the running variants is within the memory budget. The
+AnalysisResults.root of each variant is collected in results/<variant>/ and an index of the
+variants (parameters, status, wall time, output) is written in the results directory
+run: python run_filter_scan.py config_filter_scan.yml [--jobs 4] [--memory_budget 32e9] [--mock] [--dry_run]
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import shlex
+import argparse
+import itertools
+import subprocess
+import pandas as pd
+import yaml
+
+# workflow of runTrigger.sh, the last device is the hf-filter
+DEFAULT_WORKFLOW = ["o2-analysis-timestamp", "o2-analysis-event-selection", "o2-analysis-multiplicity-table",
+                    "o2-analysis-pid-tof-beta", "o2-analysis-pid-tof-base", "o2-analysis-pid-tpc-full",
+                    "o2-analysis-pid-tof-full", "o2-analysis-track-propagation", "o2-analysis-trackselection",
+                    "o2-analysis-hf-track-index-skims-creator", "o2-analysis-hf-filter"]
+DEFAULT_OPTIONS = "--resources-monitoring 2 --aod-memory-rate-limit 1000000000"
+MAX_SHM_ID = 65535
+MOCK_EXECUTABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_o2_workflow.py")
+
+
+def to_dpl_value(value):
+    """
+    Helper function to convert a scanned value to the DPL json convention (all the values are strings)
+    """
+    if isinstance(value, (list, tuple)):
+        return [to_dpl_value(elem) for elem in value]
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def set_parameter(config, path, value):
+    """
+    Function to set a parameter of the DPL configuration
+
+    Parameters
+    -----------------
+    - config: dictionary with the DPL configuration (modified in place)
+    - path: task and parameter separated by slashes, e.g. hf-filter/pTThreshold2Prong or
+            hf-filter/cutsTrackBeauty3Prong/values for the tables
+    - value: value (or nested list of values for the tables)
+    """
+    keys = path.split("/")
+    node = config
+    for key in keys[:-1]:
+        if key not in node:
+            raise KeyError(f"{key} of {path} not in the DPL configuration")
+        node = node[key]
+    if keys[-1] not in node:
+        raise KeyError(f"{path} not in the DPL configuration")
+    node[keys[-1]] = to_dpl_value(value)
+
+
+def get_variations(scan, mode="grid"):
+    """
+    Function to get the list of variations from the scanned values
+
+    Parameters
+    -----------------
+    - scan: dictionary {parameter path: list of values}
+    - mode: grid (all the combinations) or zip (i-th value of each parameter)
+
+    Outputs
+    -----------------
+    - variations: list of dictionaries {parameter path: value}
+    """
+    paths = list(scan)
+    if mode == "grid":
+        combinations = itertools.product(*(scan[path] for path in paths))
+    elif mode == "zip":
+        n_values = {len(scan[path]) for path in paths}
+        if len(n_values) > 1:
+            raise ValueError("all the scanned parameters must have the same number of values in zip mode")
+        combinations = zip(*(scan[path] for path in paths))
+    else:
+        raise ValueError(f"scan mode {mode} not supported, use grid or zip")
+    return [dict(zip(paths, combination)) for combination in combinations]
+
+
+def make_absolute_inputs(config, base_dir):
+    """
+    Helper function to make the aod-file of the reader an absolute path, since
+    each workflow runs in the directory of its variant
+    """
+    reader = config.get("internal-dpl-aod-reader", {})
+    aod_file = reader.get("aod-file", "")
+    is_list = aod_file.startswith("@")
+    file_name = aod_file[1:] if is_list else aod_file
+    if file_name and "://" not in file_name and not os.path.isabs(file_name):
+        reader["aod-file"] = ("@" if is_list else "") + os.path.abspath(os.path.join(base_dir, file_name))
+
+
+# pylint: disable=too-many-arguments
+def get_workflow_command(workflow, config_file, options, shm_segment_size, ipc_prefix, shm_id,
+                         shm_id_option="--shm-segment-id", mock=False):
+    """
+    Function to build the shell pipeline of a workflow
+
+    Parameters
+    -----------------
+    - workflow: list of executables
+    - config_file: DPL configuration of the variant
+    - options: options common to all the devices
+    - shm_segment_size: size of the shared-memory segment (bytes)
+    - ipc_prefix: directory of the fairmq ipc sockets of the variant
+    - shm_id: identifier of the shared-memory segment of the variant
+    - shm_id_option: option of the driver selecting the shared-memory segment
+    - mock: replace the executables with mock_o2_workflow.py
+
+    Outputs
+    -----------------
+    - command: shell command
+    """
+    commands = []
+    for i_exe, exe in enumerate(workflow):
+        args = [sys.executable, MOCK_EXECUTABLE, "--device", exe] if mock else [exe]
+        args += ["-b", "--configuration", f"json://{config_file}"] + shlex.split(options)
+        args += ["--shm-segment-size", str(shm_segment_size)]
+        if i_exe == len(workflow) - 1:
+            args += [shm_id_option, str(shm_id), "--fairmq-ipc-prefix", ipc_prefix]
+        commands.append(" ".join(shlex.quote(arg) for arg in args))
+    return " | \\\n".join(commands)
+
+
+def prepare_variant(name, params, base_config, base_dir, out_dir):
+    """
+    Function to write the DPL configuration of a variant in its directory
+
+    Outputs
+    -----------------
+    - var_dir: directory of the variant
+    - config_file: DPL configuration of the variant
+    """
+    var_dir = os.path.abspath(os.path.join(out_dir, name))
+    os.makedirs(os.path.join(var_dir, "ipc"), exist_ok=True)
+    config = copy.deepcopy(base_config)
+    for path, value in params.items():
+        set_parameter(config, path, value)
+    make_absolute_inputs(config, base_dir)
+    config_file = os.path.join(var_dir, "dpl-config.json")
+    with open(config_file, "w") as out_file:
+        json.dump(config, out_file, indent=2)
+    return var_dir, config_file
+
+
+def get_available_memory():
+    """
+    Helper function to get the available memory of the host (bytes), None if unknown
+    """
+    try:
+        with open("/proc/meminfo") as mem_info:
+            for line in mem_info:
+                if line.startswith("MemAvailable"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-statements
+def run_scan(spec, n_jobs, memory_budget, mock=False, dry_run=False, poll_interval=1.):
+    """
+    Function to run the workflows of all the variants, with at most n_jobs concurrent workflows
+    and the sum of the reserved memory of the running workflows within the budget
+
+    Parameters
+    -----------------
+    - spec: dictionary with the scan spec read from the yaml file
+    - n_jobs: maximum number of concurrent workflows
+    - memory_budget: maximum reserved memory of the running workflows (bytes)
+    - mock: run mock_o2_workflow.py instead of the O2 executables
+    - dry_run: only write the configurations and the commands
+    - poll_interval: interval between the checks of the running workflows (s)
+
+    Outputs
+    -----------------
+    - index: pandas dataframe with one row per variant
+    """
+    base_file = spec["base_config"]
+    base_dir = os.path.dirname(os.path.abspath(base_file))
+    with open(base_file) as in_file:
+        base_config = json.load(in_file)
+    out_dir = spec.get("output_dir", "results")
+    workflow = spec.get("workflow", DEFAULT_WORKFLOW)
+    options = spec.get("options", DEFAULT_OPTIONS)
+    shm_size = int(float(spec.get("shm_segment_size", 7.5e9)))
+    reserved = shm_size + int(float(spec.get("memory_per_workflow", 2.e9)))
+    if reserved > memory_budget:
+        print(f"\033[93mWARNING: memory of one workflow ({reserved / 1e9:.1f} GB) above the budget "
+              f"({memory_budget / 1e9:.1f} GB), the variants are run one at a time\033[0m")
+
+    variations = get_variations(spec["scan"], spec.get("mode", "grid"))
+    # the shm segment id is a 16-bit unsigned value, the variants of a scan use consecutive ids
+    shm_id_offset = int(spec.get("shm_id_offset", 0))
+    if shm_id_offset < 0 or shm_id_offset + len(variations) - 1 > MAX_SHM_ID:
+        raise ValueError(f"shm segment ids {shm_id_offset}-{shm_id_offset + len(variations) - 1} "
+                         f"outside the range 0-{MAX_SHM_ID}")
+    n_digits = max(3, len(str(len(variations) - 1)))
+    queue, rows = [], []
+    for i_var, params in enumerate(variations):
+        name = f"var_{i_var:0{n_digits}d}"
+        var_dir, config_file = prepare_variant(name, params, base_config, base_dir, out_dir)
+        command = get_workflow_command(workflow, config_file, options, shm_size, os.path.join(var_dir, "ipc"),
+                                       shm_id_offset + i_var, spec.get("shm_id_option", "--shm-segment-id"), mock)
+        with open(os.path.join(var_dir, "command.sh"), "w") as out_file:
+            out_file.write(f"{command}\n")
+        row = {"variant": name, "status": "pending", "return_code": None, "wall_time": None,
+               "output": None, "directory": var_dir}
+        row.update({path: json.dumps(value) if isinstance(value, list) else value for path, value in params.items()})
+        rows.append(row)
+        queue.append((row, var_dir, command))
+
+    running = []
+    while (queue or running) and not dry_run:
+        # start the next variants while the concurrency and the memory budget allow it
+        while queue and len(running) < n_jobs and \
+                (not running or (len(running) + 1) * reserved <= memory_budget):
+            row, var_dir, command = queue.pop(0)
+            log_file = open(os.path.join(var_dir, "log.txt"), "w")  # pylint: disable=consider-using-with
+            proc = subprocess.Popen(command, shell=True, cwd=var_dir, stdout=log_file,  # pylint: disable=consider-using-with
+                                    stderr=subprocess.STDOUT, executable="/bin/bash")
+            row["status"] = "running"
+            running.append((row, var_dir, proc, log_file, time.time()))
+            print(f"Started {row['variant']} ({len(running)} running, {len(queue)} pending)")
+        time.sleep(poll_interval)
+        for job in list(running):
+            row, var_dir, proc, log_file, start = job
+            if proc.poll() is None:
+                continue
+            log_file.close()
+            running.remove(job)
+            row["return_code"] = proc.returncode
+            row["wall_time"] = time.time() - start
+            output = os.path.join(var_dir, "AnalysisResults.root")
+            if proc.returncode == 0 and os.path.isfile(output):
+                row["status"] = "done"
+                row["output"] = output
+                print(f"\033[32m{row['variant']} done in {row['wall_time']:.0f} s\033[0m")
+            else:
+                row["status"] = "failed"
+                print(f"\033[91mERROR: {row['variant']} failed (return code {proc.returncode}), "
+                      f"see {os.path.join(var_dir, 'log.txt')}\033[0m")
+
+    index = pd.DataFrame(rows)
+    index.to_csv(os.path.join(out_dir, "index.csv"), index=False)
+    with open(os.path.join(out_dir, "index.json"), "w") as out_file:
+        json.dump({"base_config": os.path.abspath(base_file), "variants": rows}, out_file, indent=2, default=str)
+    return index
+
+
+def main():
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(description="Arguments")
+    parser.add_argument("config", metavar="text", default="config_filter_scan.yml",
+                        help="yaml file with the scan spec")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="maximum number of concurrent workflows (max_parallel of the spec if not set)")
+    parser.add_argument("--memory_budget", type=float, default=None,
+                        help="memory budget in bytes (spec, or 80%% of the available memory if not set)")
+    parser.add_argument("--mock", action="store_true", default=False,
+                        help="run mock_o2_workflow.py instead of the O2 executables")
+    parser.add_argument("--dry_run", action="store_true", default=False,
+                        help="only write the configurations and the commands of the variants")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as yml_cfg:  # pylint: disable=bad-option-value
+        spec = yaml.load(yml_cfg, yaml.FullLoader)
+
+    n_jobs = args.jobs if args.jobs is not None else spec.get("max_parallel", 2)
+    memory_budget = args.memory_budget if args.memory_budget is not None else spec.get("memory_budget")
+    if memory_budget is None:
+        available = get_available_memory()
+        memory_budget = 0.8 * available if available is not None else float("inf")
+    index = run_scan(spec, n_jobs, float(memory_budget), args.mock, args.dry_run)
+    print(index.drop(columns=["directory"]).to_string(index=False))
+    if (index["status"] == "failed").any():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+'''
+Module with an append-only store of benchmark results: each run is saved in its own parquet
+file, tagged with the library versions, the CPU model, the git commit and the configuration,
+and runs can be compared with a Mann-Whitney U test on the raw timings to flag regressions
+'''
+
+import os
+import json
+import math
+import uuid
+import hashlib
+import platform
+import subprocess
+from datetime import datetime, timezone
+from importlib import metadata
+import numpy as np
+import pandas as pd
+
+# libraries whose versions are saved by default with each run
+benchmarkLibraries = ['numpy', 'pandas', 'xgboost', 'treelite', 'treelite_runtime', 'hep_ml',
+                      'onnxruntime', 'hummingbird-ml', 'hipe4ml', 'threadpoolctl']
+# columns identifying the same measurement in different runs
+benchmarkKeys = ['mode', 'backend', 'batch_size', 'n_threads', 'n_estimators']
+
+
+def GetCpuModel():
+    '''
+    Helper method to get the CPU model of the host
+
+    Returns
+    ----------
+    - CPU model name
+    '''
+    if os.path.isfile('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as cpuInfo:
+            for line in cpuInfo:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    return platform.processor() or platform.machine()
+
+
+def GetGitCommit(path='.'):
+    '''
+    Helper method to get the git commit of a working tree
+
+    Arguments
+    ----------
+    - path inside the working tree
+
+    Returns
+    ----------
+    - commit hash, with the suffix -dirty if there are uncommitted changes, None outside a git repository
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=path, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=path,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-dirty' if status else commit
+
+
+def GetLibraryVersions(libraries=None):
+    '''
+    Helper method to get the versions of the installed libraries
+
+    Arguments
+    ----------
+    - list of distribution names (benchmarkLibraries if None)
+
+    Returns
+    ----------
+    - dictionary {library: version}, None for the libraries not installed
+    '''
+    versions = {}
+    for library in libraries if libraries is not None else benchmarkLibraries:
+        try:
+            versions[library] = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            versions[library] = None
+    return versions
+
+
+def GetRunTags(config=None, libraries=None, gitPath='.'):
+    '''
+    Method to get the tags identifying a benchmark run
+
+    Arguments
+    ----------
+    - dictionary with the configuration of the run (e.g. command-line arguments)
+    - list of libraries whose version is saved
+    - path inside the git working tree of the benchmarked code
+
+    Returns
+    ----------
+    - dictionary with run_id, timestamp, host, cpu, python, git_commit, config (JSON),
+      config_hash and one ver_<library> entry per library
+    '''
+    configJson = json.dumps(config if config is not None else {}, sort_keys=True, default=str)
+    tags = {'run_id': uuid.uuid4().hex[:12],
+            'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'host': platform.node(), 'cpu': GetCpuModel(), 'python': platform.python_version(),
+            'git_commit': GetGitCommit(gitPath), 'config': configJson,
+            'config_hash': hashlib.sha1(configJson.encode()).hexdigest()[:12]}
+    for library, version in GetLibraryVersions(libraries).items():
+        tags[f'ver_{library}'] = version
+    return tags
+
+
+def AppendRun(storeDir, dfResults, config=None, libraries=None, gitPath='.'):
+    '''
+    Method to append the results of a benchmark run to the store, in a new parquet file
+    (the files of the previous runs are never modified)
+
+    Arguments
+    ----------
+    - directory of the store
+    - pandas dataframe with the results (e.g. output of InferenceBenchmark.RunBenchmark)
+    - dictionary with the configuration of the run
+    - list of libraries whose version is saved
+    - path inside the git working tree of the benchmarked code
+
+    Returns
+    ----------
+    - identifier of the run
+    '''
+    os.makedirs(storeDir, exist_ok=True)
+    tags = GetRunTags(config, libraries, gitPath)
+    dfRun = dfResults.copy()
+    for tag, value in tags.items():
+        dfRun[tag] = value
+    fileName = os.path.join(storeDir, f'run_{tags["timestamp"].replace(":", "")}_{tags["run_id"]}.parquet')
+    dfRun.to_parquet(f'{fileName}.part')
+    # the run appears in the store only once complete
+    os.replace(f'{fileName}.part', fileName)
+    return tags['run_id']
+
+
+def LoadStore(storeDir, runIds=None):
+    '''
+    Method to load the results of the store
+
+    Arguments
+    ----------
+    - directory of the store
+    - optional list of run identifiers to be loaded
+
+    Returns
+    ----------
+    - pandas dataframe with the results of all the runs, sorted by time
+    '''
+    fileNames = sorted(fileName for fileName in os.listdir(storeDir)
+                       if fileName.startswith('run_') and fileName.endswith('.parquet')) \
+        if os.path.isdir(storeDir) else []
+    if runIds is not None:
+        fileNames = [fileName for fileName in fileNames
+                     if fileName[:-len('.parquet')].split('_')[-1] in runIds]
+    if len(fileNames) == 0:
+        return pd.DataFrame()
+    return pd.concat([pd.read_parquet(os.path.join(storeDir, fileName)) for fileName in fileNames],
+                     ignore_index=True)
+
+
+def ListRuns(dfStore):
+    '''
+    Method to get one row per run with its tags
+
+    Arguments
+    ----------
+    - pandas dataframe from LoadStore
+
+    Returns
+    ----------
+    - pandas dataframe with the tags of the runs, sorted by time
+    '''
+    tagCols = [col for col in dfStore.columns if col in ('run_id', 'timestamp', 'host', 'cpu', 'git_commit',
+                                                        'config_hash') or col.startswith('ver_')]
+    return dfStore[tagCols].drop_duplicates('run_id').sort_values('timestamp').reset_index(drop=True)
+
+
+def MannWhitneyU(sample1, sample2):
+    '''
+    Method to compute the two-sided Mann-Whitney U test, with the normal approximation
+    and the correction for ties
+
+    Arguments
+    ----------
+    - first sample
+    - second sample
+
+    Returns
+    ----------
+    - U statistic of the first sample
+    - two-sided p-value
+    '''
+    sample1, sample2 = np.asarray(sample1, dtype=np.float64), np.asarray(sample2, dtype=np.float64)
+    n1, n2 = len(sample1), len(sample2)
+    if n1 == 0 or n2 == 0:
+        return np.nan, np.nan
+    values = np.concatenate((sample1, sample2))
+    order = np.argsort(values, kind='mergesort')
+    _, firstIdx, counts = np.unique(values[order], return_index=True, return_counts=True)
+    ranks = np.empty(len(values), dtype=np.float64)
+    ranks[order] = np.repeat(firstIdx + (counts + 1) / 2., counts)
+    uStat = ranks[:n1].sum() - n1 * (n1 + 1) / 2.
+    nTot = n1 + n2
+    sigma2 = n1 * n2 / 12. * ((nTot + 1) - np.sum(counts**3 - counts) / (nTot * (nTot - 1)))
+    if sigma2 <= 0:
+        return uStat, 1.
+    zScore = (abs(uStat - n1 * n2 / 2.) - 0.5) / math.sqrt(sigma2)
+    return uStat, min(1., math.erfc(max(zScore, 0.) / math.sqrt(2.)))
+
+
+def CompareRuns(dfStore, baseRun, newRun, keys=None, alpha=0.01, minRelChange=0.05):
+    '''
+    Method to compare the timings of two runs: for each measurement (same keys in both
+    runs) the raw times are compared with a Mann-Whitney U test, and a regression
+    (improvement) is flagged if the new run is significantly slower (faster) by more
+    than the minimum relative change of the median
+
+    Arguments
+    ----------
+    - pandas dataframe from LoadStore
+    - identifier of the reference run
+    - identifier of the new run
+    - columns identifying the same measurement (benchmarkKeys present in the store if None)
+    - significance level of the test
+    - minimum relative change of the median time to be flagged
+
+    Returns
+    ----------
+    - pandas dataframe with the median times per candidate, the relative change of the
+      latency and of the throughput (candidates / s), the p-value and the status
+      (regression, improvement or unchanged)
+    '''
+    keys = keys if keys is not None else [key for key in benchmarkKeys if key in dfStore.columns]
+    dfBase = dfStore.query('run_id == @baseRun')
+    dfNew = dfStore.query('run_id == @newRun')
+    dfMerged = dfBase.merge(dfNew, on=keys, suffixes=('_base', '_new'))
+    rows = []
+    for _, row in dfMerged.iterrows():
+        timesBase, timesNew = np.asarray(row['times_ns_base']), np.asarray(row['times_ns_new'])
+        _, pValue = MannWhitneyU(timesNew, timesBase)
+        relChange = row['time_per_cand_new'] / row['time_per_cand_base'] - 1.
+        status = 'unchanged'
+        if pValue < alpha and abs(relChange) > minRelChange:
+            status = 'regression' if relChange > 0 else 'improvement'
+        result = {key: row[key] for key in keys}
+        result.update({'time_per_cand_base': row['time_per_cand_base'], 'time_per_cand_new': row['time_per_cand_new'],
+                       'latency_change': relChange, 'throughput_change': 1. / (1. + relChange) - 1.,
+                       'p_value': pValue, 'status': status})
+        rows.append(result)
+
+    return pd.DataFrame(rows)
@@ -1,3 +1,17 @@
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# logics supported in the bitwise selections
+bitLogics = ('or', 'and', 'not')
+# number of entries processed at once by the bit-mask kernel, small enough to stay in cache
+bitKernelBlockSize = 1 << 16
+# columns with bitmaps indexed by default
+bitIndexColumns = ['fSelBit', 'fCandType', 'fHFSelBit']
+
+
 def GetMaskOfBits(bits):
     '''
     Helper method to get bit mask from bits
@@ -10,11 +24,98 @@ def GetMaskOfBits(bits):
     ----------
     - mask corresponding to the input bits
     '''
-    mask = 0
-    for bit in bits:
-        mask += 2**bit
+    bits = np.asarray(bits, dtype=np.uint64)
+    if bits.size == 0:
+        return 0
+
+    return int(np.bitwise_or.reduce(np.left_shift(np.uint64(1), bits)))
+
+
+def GetBitColumnValues(column):
+    '''
+    Helper method to access the values of a column with bitmaps without copies
+
+    Arguments
+    ----------
+    - column as pandas series, numpy array or pyarrow (chunked) array
+
+    Returns
+    ----------
+    - numpy array of unsigned integers, a view of the input buffer for integer
+      columns (a copy is made only for non-integer or multi-chunk columns)
+    '''
+    if isinstance(column, pa.ChunkedArray) and column.num_chunks == 1:
+        column = column.chunk(0)
+    if isinstance(column, (pa.Array, pa.ChunkedArray)):
+        values = column.to_numpy(zero_copy_only=False)
+    else:
+        values = np.asarray(column)
+    if values.dtype.kind not in 'iu':
+        values = values.astype(np.int64)
+    if values.dtype.kind == 'i':
+        values = values.view(np.dtype(f'u{values.dtype.itemsize}'))
 
-    return mask
+    return values
+
+
+def GetBitMasks(column, specs):
+    '''
+    Method to evaluate several bitwise selections on the same column in one pass
+
+    Arguments
+    ----------
+    - column with bitmap (pandas series, numpy array or pyarrow array)
+    - list of (list of bits to test, logic to combine the bits (and, or, not))
+
+    Returns
+    ----------
+    - list of boolean numpy arrays, one per selection
+    '''
+    values = GetBitColumnValues(column)
+    for _, logic in specs:
+        if logic not in bitLogics:
+            raise ValueError(f'logic {logic} not supported for bitwise operations, options: {bitLogics}')
+    masksOfBits = [GetMaskOfBits(bits) for bits, _ in specs]
+    if masksOfBits and max(masksOfBits) > np.iinfo(values.dtype).max:
+        # bits beyond the width of the column are never set
+        values = values.astype(np.uint64)
+    masksOfBits = [values.dtype.type(mask) for mask in masksOfBits]
+    uniqueMasks = list(dict.fromkeys(masksOfBits))
+
+    flags = [np.empty(len(values), dtype=bool) for _ in specs]
+    buffers = {mask: np.empty(min(len(values), bitKernelBlockSize), dtype=values.dtype) for mask in uniqueMasks}
+    for start in range(0, len(values), bitKernelBlockSize):
+        block = values[start:start + bitKernelBlockSize]
+        stop = start + len(block)
+        # each mask is applied once per block, whatever the number of selections using it
+        for mask, buffer in buffers.items():
+            np.bitwise_and(block, mask, out=buffer[:len(block)])
+        for (_, logic), mask, flag in zip(specs, masksOfBits, flags):
+            maskedBlock = buffers[mask][:len(block)]
+            if logic == 'or':
+                np.not_equal(maskedBlock, 0, out=flag[start:stop])
+            elif logic == 'and':
+                np.equal(maskedBlock, mask, out=flag[start:stop])
+            else:
+                np.equal(maskedBlock, 0, out=flag[start:stop])
+
+    return flags
+
+
+def GetBitIndices(column, specs):
+    '''
+    Method to evaluate several bitwise selections on the same column in one pass
+
+    Arguments
+    ----------
+    - column with bitmap (pandas series, numpy array or pyarrow array)
+    - list of (list of bits to test, logic to combine the bits (and, or, not))
+
+    Returns
+    ----------
+    - list of numpy arrays with the indices of the selected entries, one per selection
+    '''
+    return [np.flatnonzero(flag) for flag in GetBitMasks(column, specs)]
 
 
 def FilterBitDf(dfToFilter, column, bitsToTest, logic='or'):
@@ -26,25 +127,211 @@ def FilterBitDf(dfToFilter, column, bitsToTest, logic='or'):
     - pandas dataframe to filter
     - colum with bitmap
     - list of bits to test
-    - logic to combine the bits (and, or)
+    - logic to combine the bits (and, or, not)
 
     Returns
     ----------
     - filtered pandas dataframe
     '''
-    maskOfBits = GetMaskOfBits(bitsToTest)
-    flags = dfToFilter[column].astype(int) & maskOfBits
-    if logic == 'or':
-        flags = flags.astype('bool')
-    elif logic == 'and':
-        flags -= maskOfBits
-        flags = ~flags.astype('bool')
-    elif logic == 'not':
-        flags = ~flags.astype('bool')
-    else:
+    if logic not in bitLogics:
         print('Error: only and, or, and not logics are supported for bitwise operations')
         return None
 
-    dfFilt = dfToFilter[flags.to_numpy()]
+    flags = GetBitMasks(dfToFilter[column], [(bitsToTest, logic)])[0]
+    dfFilt = dfToFilter[flags]
 
     return dfFilt
+
+
+def WriteDfChunkToParquet(dfChunk, fileName, writers, compression='gzip'):
+    '''
+    Method to append a chunk of a dataframe to a parquet file, the file is
+    opened when the first chunk is written and kept open in writers
+
+    Arguments
+    ----------
+    - pandas dataframe to append
+    - name of the output parquet file
+    - dictionary of open parquet writers {file name: writer}, updated in place
+    - compression algorithm
+
+    Returns
+    ----------
+    - None
+    '''
+    table = pa.Table.from_pandas(dfChunk, preserve_index=False)
+    if fileName not in writers:
+        writers[fileName] = pq.ParquetWriter(fileName, table.schema, compression=compression)
+    elif not table.schema.equals(writers[fileName].schema):
+        table = table.cast(writers[fileName].schema)
+    if table.num_rows > 0:
+        writers[fileName].write_table(table)
+
+
+def CloseParquetWriters(writers, indexColumns=None):
+    '''
+    Method to close the parquet files opened by WriteDfChunkToParquet
+
+    Arguments
+    ----------
+    - dictionary of open parquet writers {file name: writer}
+    - optional list of columns with bitmaps for which a bitmap index is written next to each file
+
+    Returns
+    ----------
+    - None
+    '''
+    for fileName, writer in writers.items():
+        writer.close()
+        if indexColumns:
+            WriteBitIndex(fileName, indexColumns)
+    writers.clear()
+
+
+def GetBitIndexFileName(fileName):
+    '''
+    Helper method to get the name of the bitmap index of a parquet file
+
+    Arguments
+    ----------
+    - name of the parquet file
+
+    Returns
+    ----------
+    - name of the bitmap index file
+    '''
+    return f'{fileName}.bitidx.npz'
+
+
+def WriteBitIndex(fileName, columns=None):
+    '''
+    Method to write the bitmap index of a parquet file: for each column with bitmaps,
+    one compressed bitmap of the rows (packed in bytes) per bit, together with the number
+    of rows of each row group
+
+    Arguments
+    ----------
+    - name of the parquet file
+    - list of columns with bitmaps to be indexed (columns not in the file are skipped)
+
+    Returns
+    ----------
+    - name of the bitmap index file, None if none of the columns is in the file
+    '''
+    if columns is None:
+        columns = bitIndexColumns
+    parquetFile = pq.ParquetFile(fileName)
+    columns = [col for col in columns if col in parquetFile.schema_arrow.names]
+    if len(columns) == 0:
+        return None
+
+    rowGroupSizes = np.array([parquetFile.metadata.row_group(iRowGroup).num_rows
+                              for iRowGroup in range(parquetFile.num_row_groups)], dtype=np.int64)
+    table = parquetFile.read(columns=columns)
+    arrays = {'nrows': np.array(table.num_rows), 'rowgroups': rowGroupSizes}
+    for col in columns:
+        values = GetBitColumnValues(table.column(col))
+        nBits = int(values.max()).bit_length() if len(values) > 0 else 0
+        bitmaps = np.empty((nBits, (len(values) + 7) // 8), dtype=np.uint8)
+        for bit in range(nBits):
+            bitmaps[bit] = np.packbits(GetBitMasks(values, [([bit], 'or')])[0])
+        arrays[f'bits_{col}'] = bitmaps
+    indexFileName = GetBitIndexFileName(fileName)
+    np.savez_compressed(indexFileName, **arrays)
+
+    return indexFileName
+
+
+def LoadBitIndex(indexFileName):
+    '''
+    Method to load a bitmap index written by WriteBitIndex
+
+    Arguments
+    ----------
+    - name of the bitmap index file
+
+    Returns
+    ----------
+    - dictionary with the number of rows (nrows), the sizes of the row groups (rowgroups)
+      and the packed bitmaps of each column (bitmaps: {column: array [bit][byte]})
+    '''
+    with np.load(indexFileName) as npz:
+        return {'nrows': int(npz['nrows']), 'rowgroups': npz['rowgroups'],
+                'bitmaps': {key[len('bits_'):]: npz[key] for key in npz.files if key.startswith('bits_')}}
+
+
+def QueryBitIndex(bitIndex, column, bitsToTest, logic='or'):
+    '''
+    Method to apply a selection testing one or more bits from the bitmap index alone,
+    with the same logics as FilterBitDf. The results of several queries can be combined
+    with the &, | and ~ operators
+
+    Arguments
+    ----------
+    - bitmap index (output of LoadBitIndex)
+    - colum with bitmap
+    - list of bits to test
+    - logic to combine the bits (and, or, not)
+
+    Returns
+    ----------
+    - boolean numpy array with the selected rows
+    '''
+    if logic not in bitLogics:
+        raise ValueError(f'logic {logic} not supported for bitwise operations, options: {bitLogics}')
+    if column not in bitIndex['bitmaps']:
+        raise KeyError(f'column {column} not in the bitmap index')
+    bitmaps = bitIndex['bitmaps'][column]
+    nBytes = (bitIndex['nrows'] + 7) // 8
+    # bits never set in the column have empty bitmaps
+    selBitmaps = [bitmaps[bit] if bit < len(bitmaps) else np.zeros(nBytes, dtype=np.uint8)
+                  for bit in dict.fromkeys(bitsToTest)]
+    if logic == 'and':
+        packed = np.bitwise_and.reduce(selBitmaps, axis=0) if selBitmaps else np.full(nBytes, 255, dtype=np.uint8)
+    else:
+        packed = np.bitwise_or.reduce(selBitmaps, axis=0) if selBitmaps else np.zeros(nBytes, dtype=np.uint8)
+        if logic == 'not':
+            packed = ~packed
+
+    return np.unpackbits(packed, count=bitIndex['nrows']).astype(bool)
+
+
+def ReadParquetWithBitIndex(fileName, column, bitsToTest, logic='or', columns=None):
+    '''
+    Method to read the rows of a parquet file passing a selection testing one or more bits:
+    the selection is evaluated on the bitmap index and only the row groups with selected
+    rows are read. Without a valid index the whole file is read and filtered
+
+    Arguments
+    ----------
+    - name of the parquet file
+    - colum with bitmap
+    - list of bits to test
+    - logic to combine the bits (and, or, not)
+    - list of columns to be read (all if None)
+
+    Returns
+    ----------
+    - filtered pandas dataframe
+    '''
+    parquetFile = pq.ParquetFile(fileName)
+    rowGroupSizes = [parquetFile.metadata.row_group(iRowGroup).num_rows
+                     for iRowGroup in range(parquetFile.num_row_groups)]
+    indexFileName = GetBitIndexFileName(fileName)
+    bitIndex = LoadBitIndex(indexFileName) if os.path.isfile(indexFileName) else None
+    if bitIndex is None or column not in bitIndex['bitmaps'] or list(bitIndex['rowgroups']) != rowGroupSizes:
+        print(f'WARNING: no valid bitmap index for {fileName}, the whole file is read')
+        colsToRead = None if columns is None else list(dict.fromkeys(list(columns) + [column]))
+        dfFilt = FilterBitDf(parquetFile.read(columns=colsToRead).to_pandas(), column, bitsToTest, logic)
+        return dfFilt if columns is None else dfFilt[list(columns)]
+
+    flags = QueryBitIndex(bitIndex, column, bitsToTest, logic)
+    edges = np.concatenate(([0], np.cumsum(rowGroupSizes)))
+    rowGroups = [iRowGroup for iRowGroup in range(len(rowGroupSizes))
+                 if flags[edges[iRowGroup]:edges[iRowGroup + 1]].any()]
+    table = parquetFile.read_row_groups(rowGroups, columns=columns)
+    if len(rowGroups) > 0:
+        rowFlags = np.concatenate([flags[edges[iRowGroup]:edges[iRowGroup + 1]] for iRowGroup in rowGroups])
+        table = table.take(np.flatnonzero(rowFlags))
+
+    return table.to_pandas()
@@ -0,0 +1,258 @@
+'''
+Module for the filling of histograms from numpy arrays in bulk: the bin contents are kept in
+numpy arrays (with under- and overflow bins, as in ROOT) filled with np.bincount, partial
+histograms from chunks of many input files are filled in parallel processes and merged, and
+the conversion to ROOT objects is done only at the end for styling and saving
+'''
+
+import copy
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+def GetBinIndices(values, nBins, low, high):
+    '''
+    Helper method to get the bin indices of values on a uniform axis, with the ROOT convention
+    (0 underflow, nBins + 1 overflow, the upper edge belongs to the overflow)
+
+    Arguments
+    ----------
+    - array of values
+    - number of bins
+    - lower edge of the axis
+    - upper edge of the axis
+
+    Returns
+    ----------
+    - array of bin indices (int64)
+    - boolean mask of the valid values (NaN values are not filled)
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    isValid = ~np.isnan(values)
+    indices = np.floor((values - low) * (nBins / (high - low)))
+    np.clip(indices, -1, nBins, out=indices)
+    indices[~isValid] = -1
+    return indices.astype(np.int64) + 1, isValid
+
+
+class BinnedHist:
+    '''
+    Histogram with uniform binning in one or more dimensions, with numpy storage of the sum of
+    weights and of the sum of squared weights (including under- and overflow bins)
+
+    Arguments
+    ----------
+    - name of the histogram
+    - title of the histogram (ROOT syntax, with the axis titles)
+    - list of axes (number of bins, lower edge, upper edge)
+    '''
+
+    def __init__(self, name, title, axes):
+        self.name = name
+        self.title = title
+        self.axes = [(int(nBins), float(low), float(high)) for nBins, low, high in axes]
+        self.shape = tuple(nBins + 2 for nBins, _, _ in self.axes)
+        self.sumw = np.zeros(self.shape, dtype=np.float64)
+        self.sumw2 = np.zeros(self.shape, dtype=np.float64)
+        self.entries = 0
+
+    def Fill(self, *values, weights=None):
+        '''
+        Method to fill the histogram with arrays of values, one per axis
+
+        Arguments
+        ----------
+        - arrays of values, one per axis
+        - optional array of weights
+        '''
+        if len(values) != len(self.axes):
+            raise ValueError(f'{self.name}: {len(values)} arrays of values for {len(self.axes)} axes')
+        indices, isValid = [], None
+        for axisValues, (nBins, low, high) in zip(values, self.axes):
+            axisIndices, axisValid = GetBinIndices(axisValues, nBins, low, high)
+            indices.append(axisIndices)
+            isValid = axisValid if isValid is None else isValid & axisValid
+        flatIndices = np.ravel_multi_index(indices, self.shape)
+        if not np.all(isValid):
+            flatIndices = flatIndices[isValid]
+            weights = np.asarray(weights)[isValid] if weights is not None else None
+        counts = np.bincount(flatIndices, weights=weights, minlength=self.sumw.size).reshape(self.shape)
+        self.sumw += counts
+        if weights is None:
+            self.sumw2 += counts
+        else:
+            weights = np.asarray(weights, dtype=np.float64)
+            self.sumw2 += np.bincount(flatIndices, weights=weights * weights,
+                                      minlength=self.sumw.size).reshape(self.shape)
+        self.entries += len(flatIndices)
+
+    def Add(self, other):
+        '''
+        Method to add the contents of another histogram with the same binning
+
+        Arguments
+        ----------
+        - BinnedHist to be added
+        '''
+        if other.axes != self.axes:
+            raise ValueError(f'{self.name}: cannot add {other.name} with different binning')
+        self.sumw += other.sumw
+        self.sumw2 += other.sumw2
+        self.entries += other.entries
+
+    def Reset(self):
+        '''
+        Method to reset the contents of the histogram
+        '''
+        self.sumw[...] = 0.
+        self.sumw2[...] = 0.
+        self.entries = 0
+
+    def GetEdges(self, iAxis=0):
+        '''
+        Method to get the bin edges of an axis
+
+        Arguments
+        ----------
+        - index of the axis
+
+        Returns
+        ----------
+        - numpy array with the bin edges
+        '''
+        nBins, low, high = self.axes[iAxis]
+        return np.linspace(low, high, nBins + 1)
+
+    def ToROOT(self, histClass=None):
+        '''
+        Method to convert the histogram to a ROOT one, with the contents of all the bins
+        (including under- and overflow), the errors and the number of entries
+
+        Arguments
+        ----------
+        - ROOT class of the histogram (TH1D, TH2D or TH3D depending on the dimensions if None)
+
+        Returns
+        ----------
+        - ROOT histogram
+        '''
+        import ROOT  # pylint: disable=import-error,import-outside-toplevel
+        histClass = histClass if histClass is not None else f'TH{len(self.axes)}D'
+        binning = [par for axis in self.axes for par in axis]
+        hist = getattr(ROOT, histClass)(self.name, self.title, *binning)
+        hist.Sumw2()
+        # ROOT global bin = ix + (nx + 2) * (iy + (ny + 2) * iz), i.e. column-major order
+        hist.SetContent(np.ascontiguousarray(self.sumw.ravel(order='F')))
+        hist.GetSumw2().Set(self.sumw2.size, np.ascontiguousarray(self.sumw2.ravel(order='F')))
+        hist.SetEntries(self.entries)
+        return hist
+
+
+def MergeHists(histsList):
+    '''
+    Method to merge dictionaries of histograms with the same keys
+
+    Arguments
+    ----------
+    - list of dictionaries {key: BinnedHist}
+
+    Returns
+    ----------
+    - dictionary {key: BinnedHist} with the sum of the histograms
+    '''
+    merged = None
+    for hists in histsList:
+        if hists is None:
+            continue
+        if merged is None:
+            merged = hists
+            continue
+        for key, hist in hists.items():
+            merged[key].Add(hist)
+    return merged
+
+
+def IterateTreeChunks(fileName, treeName, branches, stepSize='100 MB', library='np'):
+    '''
+    Method to iterate over a tree in chunks, reading only the requested branches
+
+    Arguments
+    ----------
+    - name of the input ROOT file
+    - name of the tree (with the directory)
+    - list of branch names or filters
+    - size of the chunks (number of entries or size, e.g. '100 MB')
+    - output format of uproot (np or pd)
+
+    Returns
+    ----------
+    - generator of chunks (dictionaries of arrays or pandas dataframes)
+    '''
+    import uproot  # pylint: disable=import-error,import-outside-toplevel
+    with uproot.open(fileName) as inFile:
+        yield from inFile[treeName].iterate(filter_name=branches, step_size=stepSize, library=library)
+
+
+def GetEmptyCopy(hists):
+    '''
+    Helper method to get empty copies of histograms
+
+    Arguments
+    ----------
+    - dictionary {key: BinnedHist}
+
+    Returns
+    ----------
+    - dictionary {key: BinnedHist} with the same binning and no entries
+    '''
+    emptyHists = copy.deepcopy(hists)
+    for hist in emptyHists.values():
+        hist.Reset()
+    return emptyHists
+
+
+def FillFileHists(fileName, fillFunc, hists):
+    '''
+    Method to fill empty copies of the histograms with the candidates of one file
+
+    Arguments
+    ----------
+    - name of the input file
+    - function fillFunc(fileName, hists) filling the histograms (e.g. with IterateTreeChunks)
+    - dictionary {key: BinnedHist} with the histograms to be filled
+
+    Returns
+    ----------
+    - dictionary {key: BinnedHist} with the histograms of the file
+    '''
+    fileHists = GetEmptyCopy(hists)
+    fillFunc(fileName, fileHists)
+    return fileHists
+
+
+def FillHistsFromFiles(fileNames, fillFunc, hists, nJobs=1):
+    '''
+    Method to fill histograms from many input files, processed in parallel (one process per
+    file), and merge the partial histograms
+
+    Arguments
+    ----------
+    - list of input file names
+    - function fillFunc(fileName, hists) filling the histograms with the candidates of a file
+      (defined at module level, to be sent to the worker processes)
+    - dictionary {key: BinnedHist} with the histograms to be filled (used as templates, not modified)
+    - maximum number of parallel processes
+
+    Returns
+    ----------
+    - dictionary {key: BinnedHist} with the merged histograms
+    '''
+    if nJobs <= 1 or len(fileNames) <= 1:
+        fileHists = [FillFileHists(fileName, fillFunc, hists) for fileName in fileNames]
+    else:
+        with ProcessPoolExecutor(max_workers=min(nJobs, len(fileNames))) as executor:
+            # only the numpy contents of the partial histograms are sent back by the workers
+            fileHists = list(executor.map(FillFileHists, fileNames, [fillFunc] * len(fileNames),
+                                          [hists] * len(fileNames)))
+    merged = MergeHists(fileHists)
+    return merged if merged is not None else GetEmptyCopy(hists)
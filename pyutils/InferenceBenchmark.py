@@ -0,0 +1,410 @@
+'''
+Module with utilities for the benchmark of the inference time of ML models:
+warm-up and repeated timing runs, summary with median and interquartile range,
+thread pinning and structured reports
+'''
+
+import os
+import json
+import time
+import platform
+import numpy as np
+import pandas as pd
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# graph optimisation levels of ONNX Runtime
+onnxOptLevels = ('disable', 'basic', 'extended', 'all')
+# edges of the per-call latency histograms of the event replay (ns), 20 bins per decade from 10 ns to 1 s
+replayHistEdges = np.logspace(1, 9, 161)
+
+
+class ThreadPinning:
+    '''
+    Context manager pinning the process to a set of cores and limiting the number
+    of threads of the OpenMP/BLAS thread pools (if threadpoolctl is available).
+    Libraries with their own thread setting (e.g. xgboost nthread) have to be
+    configured separately
+
+    Arguments
+    ----------
+    - number of threads
+    - list of cores to be used (first nThreads available cores if None)
+    '''
+
+    def __init__(self, nThreads, cores=None):
+        self.nThreads = nThreads
+        self.cores = cores
+        self.oldAffinity = None
+        self.limits = None
+
+    def __enter__(self):
+        if hasattr(os, 'sched_setaffinity'):
+            self.oldAffinity = os.sched_getaffinity(0)
+            cores = self.cores if self.cores is not None else sorted(self.oldAffinity)
+            os.sched_setaffinity(0, list(cores)[:self.nThreads])
+        if threadpool_limits is not None:
+            self.limits = threadpool_limits(limits=self.nThreads)
+        return self
+
+    def __exit__(self, *exc):
+        if self.limits is not None:
+            self.limits.restore_original_limits()
+        if self.oldAffinity is not None:
+            os.sched_setaffinity(0, self.oldAffinity)
+        return False
+
+
+def TimeFunction(func, nWarmup=3, nRepeats=10):
+    '''
+    Method to time a function with warm-up and repeated runs
+
+    Arguments
+    ----------
+    - function without arguments to be timed
+    - number of warm-up runs (not timed)
+    - number of timed runs
+
+    Returns
+    ----------
+    - numpy array with the time of each run in ns
+    '''
+    for _ in range(nWarmup):
+        func()
+    times = np.empty(nRepeats, dtype=np.int64)
+    for iRep in range(nRepeats):
+        start = time.perf_counter_ns()
+        func()
+        times[iRep] = time.perf_counter_ns() - start
+
+    return times
+
+
+def SummariseTimes(times, nCand):
+    '''
+    Method to summarise the times of repeated runs
+
+    Arguments
+    ----------
+    - array with the time of each run in ns
+    - number of candidates processed in each run
+
+    Returns
+    ----------
+    - dictionary with median, quartiles, IQR, min and mean in ns and the median
+      and IQR of the time per candidate in s
+    '''
+    q25, median, q75 = np.percentile(times, [25, 50, 75])
+    return {'median_ns': median, 'q25_ns': q25, 'q75_ns': q75, 'iqr_ns': q75 - q25,
+            'min_ns': float(np.min(times)), 'mean_ns': float(np.mean(times)),
+            'time_per_cand': median * 1.e-9 / nCand, 'iqr_per_cand': (q75 - q25) * 1.e-9 / nCand}
+
+
+def RunBenchmark(backends, data, batchSizes, threads=(1,), threadSetters=None,
+                 nWarmup=3, nRepeats=10, tags=None, cores=None):
+    '''
+    Method to benchmark several backends sweeping batch sizes and number of threads in the same process
+
+    Arguments
+    ----------
+    - dictionary {backend name: function predicting a batch}
+    - input data (pandas dataframe or numpy array), batches are its first rows
+    - list of batch sizes
+    - list of numbers of threads
+    - optional dictionary {backend name: function setting its number of threads}
+    - number of warm-up runs
+    - number of timed runs
+    - optional dictionary of tags added to each row (e.g. n_estimators)
+    - optional list of cores to pin the threads to
+
+    Returns
+    ----------
+    - pandas dataframe with one row per (number of threads, batch size, backend),
+      with the summary of the times and the raw times (times_ns)
+    '''
+    threadSetters = threadSetters or {}
+    tags = tags or {}
+    rows = []
+    for nThreads in threads:
+        with ThreadPinning(nThreads, cores):
+            for name, setter in threadSetters.items():
+                if name in backends:
+                    setter(nThreads)
+            for batchSize in batchSizes:
+                if batchSize > len(data):
+                    print(f'\033[93mWARNING: batch size {batchSize} larger than the sample '
+                          f'({len(data)} candidates), skipped\033[0m')
+                    continue
+                batch = data.iloc[:batchSize] if isinstance(data, pd.DataFrame) else data[:batchSize]
+                for name, predict in backends.items():
+                    times = TimeFunction(lambda: predict(batch), nWarmup, nRepeats)  # pylint: disable=cell-var-from-loop
+                    row = dict(tags)
+                    row.update({'mode': 'batch', 'backend': name, 'batch_size': batchSize, 'n_threads': nThreads,
+                                'n_warmup': nWarmup, 'n_repeats': nRepeats})
+                    row.update(SummariseTimes(times, batchSize))
+                    row['times_ns'] = times.tolist()
+                    rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def GetCpuFrequency():
+    '''
+    Helper method to get the nominal frequency of the CPU, used to convert times to cycles
+
+    Returns
+    ----------
+    - frequency in Hz (maximum frequency of cpu0 if available, otherwise the current
+      frequency from /proc/cpuinfo), None if not available
+    '''
+    maxFreqFile = '/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq'
+    if os.path.isfile(maxFreqFile):
+        with open(maxFreqFile) as freqFile:
+            return float(freqFile.read().strip()) * 1.e3
+    if os.path.isfile('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as cpuInfo:
+            for line in cpuInfo:
+                if line.startswith('cpu MHz'):
+                    return float(line.split(':', 1)[1]) * 1.e6
+    return None
+
+
+def GetMultiplicitiesFromColumns(dfCand, columns):
+    '''
+    Method to get the per-event candidate multiplicities of a sample in which the candidates
+    of the same event are consecutive, from the changes of event-level columns
+    (e.g. Ntracklets and zVtxReco)
+
+    Arguments
+    ----------
+    - pandas dataframe with the candidates
+    - list of event-level columns
+
+    Returns
+    ----------
+    - numpy array with the number of candidates of each event
+    '''
+    values = dfCand[columns].to_numpy()
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    isNewEvent = np.concatenate(([True], np.any(values[1:] != values[:-1], axis=1)))
+    return np.diff(np.append(np.flatnonzero(isNewEvent), len(values)))
+
+
+def SampleMultiplicities(nEvents, mean=None, multiplicities=None, seed=42):
+    '''
+    Method to sample per-event candidate multiplicities, from a Poisson distribution or by
+    resampling observed multiplicities
+
+    Arguments
+    ----------
+    - number of events
+    - mean of the Poisson distribution
+    - array of observed multiplicities (e.g. from GetMultiplicitiesFromColumns), used if not None
+
+    Returns
+    ----------
+    - numpy array with the number of candidates of each event
+    '''
+    rng = np.random.default_rng(seed)
+    if multiplicities is not None:
+        return rng.choice(np.asarray(multiplicities), size=nEvents, replace=True)
+    if mean is None:
+        raise ValueError('either the mean or the observed multiplicities are needed')
+    return rng.poisson(mean, size=nEvents)
+
+
+def TimeEventReplay(func, batches, nWarmup=100):
+    '''
+    Method to time a function called once per event
+
+    Arguments
+    ----------
+    - function predicting a batch
+    - list of batches, one per event with candidates
+    - number of warm-up calls (not timed)
+
+    Returns
+    ----------
+    - numpy array with the latency of each call in ns
+    - total CPU time of the process during the timed calls in ns
+    '''
+    for batch in batches[:nWarmup]:
+        func(batch)
+    latencies = np.empty(len(batches), dtype=np.int64)
+    cpuStart = time.process_time_ns()
+    for iBatch, batch in enumerate(batches):
+        start = time.perf_counter_ns()
+        func(batch)
+        latencies[iBatch] = time.perf_counter_ns() - start
+    return latencies, time.process_time_ns() - cpuStart
+
+
+def RunEventReplay(backends, data, multiplicities, nWarmup=100, threads=(1,), threadSetters=None,
+                   tags=None, cores=None):
+    '''
+    Method to benchmark several backends calling them once per event with the candidates of the
+    event, as in the online filter, instead of with large batches
+
+    Arguments
+    ----------
+    - dictionary {backend name: function predicting a batch}
+    - input data (numpy array or pandas dataframe), the candidates of the events are taken in order
+    - array with the number of candidates of each event (events without candidates are not scored)
+    - number of warm-up calls
+    - list of numbers of threads
+    - optional dictionary {backend name: function setting its number of threads}
+    - optional dictionary of tags added to each row
+    - optional list of cores to pin the threads to
+
+    Returns
+    ----------
+    - pandas dataframe with one row per (number of threads, backend), with the percentiles of
+      the per-call latency, the time and the CPU cycles per candidate, the latency histogram
+      (hist_counts, with edges replayHistEdges) and the raw per-call latencies (times_ns)
+    '''
+    threadSetters = threadSetters or {}
+    tags = tags or {}
+    multiplicities = np.asarray(multiplicities, dtype=np.int64)
+    multWithCand = multiplicities[multiplicities > 0]
+    maxMult = int(multWithCand.max()) if len(multWithCand) > 0 else 0
+    if maxMult > len(data):
+        raise ValueError(f'maximum multiplicity {maxMult} larger than the sample ({len(data)} candidates)')
+    # contiguous slices of the sample, restarting from the beginning when the sample is exhausted
+    starts = (np.cumsum(multWithCand) - multWithCand) % (len(data) - maxMult + 1)
+    isDataFrame = isinstance(data, pd.DataFrame)
+    batches = [data.iloc[start:start + mult] if isDataFrame else data[start:start + mult]
+               for start, mult in zip(starts, multWithCand)]
+    nCand = int(multWithCand.sum())
+    cpuFreq = GetCpuFrequency()
+
+    rows = []
+    for nThreads in threads:
+        with ThreadPinning(nThreads, cores):
+            for name, setter in threadSetters.items():
+                if name in backends:
+                    setter(nThreads)
+            for name, predict in backends.items():
+                latencies, cpuTime = TimeEventReplay(predict, batches, nWarmup)
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                row = dict(tags)
+                row.update({'mode': 'replay', 'backend': name, 'batch_size': 0, 'n_threads': nThreads,
+                            'n_warmup': nWarmup, 'n_events': len(multiplicities), 'n_calls': len(batches),
+                            'n_cand': nCand, 'mean_multiplicity': float(np.mean(multiplicities)),
+                            'median_ns': p50, 'p95_ns': p95, 'p99_ns': p99,
+                            'max_ns': float(np.max(latencies)), 'mean_ns': float(np.mean(latencies)),
+                            'time_per_cand': float(np.sum(latencies)) * 1.e-9 / nCand,
+                            'cycles_per_cand': cpuTime * 1.e-9 * cpuFreq / nCand if cpuFreq else np.nan,
+                            'hist_counts': np.histogram(latencies, replayHistEdges)[0].tolist(),
+                            'times_ns': latencies.tolist()})
+                rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def GetOnnxSession(modelFile, nThreads=1, optLevel='all', nInterOpThreads=1):
+    '''
+    Method to create an ONNX Runtime inference session with configurable options
+
+    Arguments
+    ----------
+    - name of the .onnx file
+    - number of intra-op threads
+    - graph optimisation level (disable, basic, extended, all)
+    - number of inter-op threads
+
+    Returns
+    ----------
+    - onnxruntime.InferenceSession
+    '''
+    if ort is None:
+        raise ImportError('onnxruntime is required for the ONNX backend')
+    if optLevel not in onnxOptLevels:
+        raise ValueError(f'graph optimisation level {optLevel} not supported, options: {onnxOptLevels}')
+    sessOptions = ort.SessionOptions()
+    sessOptions.intra_op_num_threads = nThreads
+    sessOptions.inter_op_num_threads = nInterOpThreads
+    sessOptions.graph_optimization_level = {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL}[optLevel]
+
+    return ort.InferenceSession(modelFile, sessOptions, providers=['CPUExecutionProvider'])
+
+
+def PredictOnnx(session, inputs):
+    '''
+    Method to get the scores of the positive class from an ONNX Runtime session
+    of a binary classifier (e.g. converted from XGBoost with hipe4ml_converter)
+
+    Arguments
+    ----------
+    - onnxruntime.InferenceSession
+    - float32 numpy array with the features
+
+    Returns
+    ----------
+    - numpy array with the scores
+    '''
+    outputs = session.run(None, {session.get_inputs()[0].name: inputs})
+    probs = np.asarray(outputs[-1])
+
+    return probs[:, -1] if probs.ndim == 2 else probs
+
+
+def GetHostInfo():
+    '''
+    Helper method to get the information on the host of the benchmark
+
+    Returns
+    ----------
+    - dictionary with host name, platform, python version and number of cores
+    '''
+    return {'host': platform.node(), 'platform': platform.platform(),
+            'python': platform.python_version(), 'n_cores': os.cpu_count()}
+
+
+def SaveReport(dfReport, fileName):
+    '''
+    Method to save a benchmark report, in parquet format for .parquet and .parquet.gzip
+    files and in JSON format (with the host information) otherwise
+
+    Arguments
+    ----------
+    - pandas dataframe output of RunBenchmark
+    - name of the output file
+    '''
+    outDir = os.path.dirname(fileName)
+    if outDir and not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    if '.parquet' in fileName:
+        dfReport.to_parquet(fileName, compression='gzip' if fileName.endswith('.gzip') else 'snappy')
+    else:
+        with open(fileName, 'w') as outFile:
+            json.dump({'host': GetHostInfo(), 'results': dfReport.to_dict(orient='records')}, outFile, indent=1)
+
+
+def LoadReport(fileName):
+    '''
+    Method to load a benchmark report saved with SaveReport
+
+    Arguments
+    ----------
+    - name of the report file
+
+    Returns
+    ----------
+    - pandas dataframe with the results
+    '''
+    if '.parquet' in fileName:
+        return pd.read_parquet(fileName)
+    with open(fileName) as inFile:
+        return pd.DataFrame(json.load(inFile)['results'])
@@ -0,0 +1,62 @@
+'''
+Module with a lazy facade of ROOT: the PyROOT import (several seconds and a full ROOT
+environment) is deferred until a ROOT symbol is actually used, so that the scripts and the
+code paths that only need uproot/numpy can run without it
+usage: from pyutils.LazyROOT import ROOT, then ROOT.TFile.Open(...), ROOT.gStyle, ROOT.kRed, ...
+'''
+
+import sys
+import importlib
+
+
+class LazyModule:
+    '''
+    Proxy of a module imported at the first access to one of its attributes
+
+    Arguments
+    ----------
+    - name of the module
+    '''
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _Load(self):
+        '''
+        Method to import the module, only once
+
+        Returns
+        ----------
+        - imported module
+        '''
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        # special attributes (e.g. probed by copy, pickle or inspect) do not trigger the import
+        if attr.startswith('__') and attr.endswith('__'):
+            raise AttributeError(attr)
+        return getattr(self._Load(), attr)
+
+    def __dir__(self):
+        return dir(self._Load())
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name} ({state})>'
+
+
+ROOT = LazyModule('ROOT')
+
+
+def IsROOTLoaded():
+    '''
+    Helper method to check if ROOT has been imported, by the facade or directly
+
+    Returns
+    ----------
+    - True if ROOT is in the imported modules
+    '''
+    return 'ROOT' in sys.modules
@@ -0,0 +1,371 @@
+'''
+Module with a lookup-table classifier for trigger-speed inference: the features are
+binned in per-feature quantiles, only the cells populated in the building sample are
+stored (sorted uint64 keys searched with binary search) and the scores are quantised
+to uint8 or uint16. The tables can be saved as .npy files and memory mapped
+'''
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# supported widths of the quantised scores
+lookupTableBits = {8: np.uint8, 16: np.uint16}
+
+
+def GetRocAuc(labels, scores):
+    '''
+    Helper method to compute the area under the ROC curve from the ranks of the scores
+    (Mann-Whitney U statistic, ties counted as one half)
+
+    Arguments
+    ----------
+    - numpy array with the labels (1 for signal, 0 for background)
+    - numpy array with the scores
+
+    Returns
+    ----------
+    - area under the ROC curve, nan if only one class is present
+    '''
+    labels = np.asarray(labels).astype(bool)
+    nSig, nBkg = np.count_nonzero(labels), np.count_nonzero(~labels)
+    if nSig == 0 or nBkg == 0:
+        return np.nan
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(scores, kind='mergesort')
+    sortedScores = scores[order]
+    ranks = np.empty(len(scores), dtype=np.float64)
+    # average rank of the tied scores
+    _, firstIdx, counts = np.unique(sortedScores, return_index=True, return_counts=True)
+    ranks[order] = np.repeat(firstIdx + (counts + 1) / 2., counts)
+
+    return (ranks[labels].sum() - nSig * (nSig + 1) / 2.) / (nSig * nBkg)
+
+
+class QuantileLookupClassifier:
+    '''
+    Lookup-table classifier with per-feature quantile bins and sparse storage of the
+    populated cells. The score of each cell is the mean score of the full model for the
+    candidates of the building sample in the cell. Missing values have their own bin.
+    Candidates in cells not populated in the building sample are looked up in coarser
+    tables, with the number of bins halved at each level
+
+    Arguments
+    ----------
+    - number of quantile bins per feature (int or list with one value per feature)
+    - number of bits of the quantised scores (8 or 16)
+    - number of levels of the table (1 for no coarser tables)
+    - score of the candidates not found at any level (lowest score if None)
+    '''
+
+    def __init__(self, nBins=16, nBits=8, nLevels=3, fallback=None):
+        if nBits not in lookupTableBits:
+            raise ValueError(f'{nBits} bits not supported for the scores, options: {list(lookupTableBits)}')
+        self.nBins = nBins
+        self.nBits = nBits
+        self.nLevels = nLevels
+        self.fallback = fallback
+        self.features = None
+        # list of {edges, strides, keys, scores}, from the finest to the coarsest binning
+        self.levels = []
+        self.scoreRange = (0., 1.)
+        self.fallbackCode = 0
+
+    def GetInputArray(self, data):
+        '''
+        Helper method to get the float32 feature matrix, selecting the columns of
+        pandas dataframes by name
+        '''
+        if isinstance(data, pd.DataFrame) and self.features is not None:
+            data = data[self.features]
+        return np.ascontiguousarray(data, dtype=np.float32)
+
+    def GetKeys(self, data, level=0):
+        '''
+        Method to get the keys of the cells of the candidates
+
+        Arguments
+        ----------
+        - pandas dataframe or numpy array with the features
+        - level of the table
+
+        Returns
+        ----------
+        - numpy array of uint64 keys
+        '''
+        inputs = self.GetInputArray(data)
+        keys = np.zeros(len(inputs), dtype=np.uint64)
+        for iFeat, (edges, stride) in enumerate(zip(self.levels[level]['edges'], self.levels[level]['strides'])):
+            column = inputs[:, iFeat]
+            bins = np.searchsorted(edges, column, side='right').astype(np.uint64)
+            # missing values in the last bin
+            bins[np.isnan(column)] = len(edges) + 1
+            keys += bins * stride
+        return keys
+
+    def Fit(self, data, scores, features=None):
+        '''
+        Method to build the table from a sample of candidates and their scores
+
+        Arguments
+        ----------
+        - pandas dataframe or numpy array with the features
+        - numpy array with the scores of the full model (one or two dimensional)
+        - list of features (columns of the dataframe if None)
+
+        Returns
+        ----------
+        - the classifier itself
+        '''
+        if features is not None:
+            self.features = list(features)
+        elif isinstance(data, pd.DataFrame):
+            self.features = list(data.columns)
+        inputs = self.GetInputArray(data)
+        nFeatures = inputs.shape[1]
+        nBins = self.nBins if isinstance(self.nBins, (list, tuple)) else [self.nBins] * nFeatures
+        fineEdges = []
+        for iFeat in range(nFeatures):
+            column = inputs[:, iFeat]
+            column = column[~np.isnan(column)]
+            quantiles = np.linspace(0., 1., nBins[iFeat] + 1)[1:-1]
+            # duplicated edges (discrete features) are merged
+            fineEdges.append(np.unique(np.quantile(column, quantiles)).astype(np.float32)
+                             if len(column) > 0 else np.zeros(0, dtype=np.float32))
+
+        scores = np.asarray(scores, dtype=np.float64)
+        scores2D = scores.reshape(len(scores), -1)
+        self.scoreRange = (float(scores2D.min()), float(scores2D.max()))
+        self.levels = []
+        for level in range(self.nLevels):
+            # every 2^level-th edge, i.e. the quantiles of nBins / 2^level bins
+            step = 1 << level
+            edges = [featEdges[step - 1::step] for featEdges in fineEdges]
+            self.levels.append({'edges': edges, 'strides': GetStrides(edges)})
+            keys, inverse = np.unique(self.GetKeys(inputs, level), return_inverse=True)
+            counts = np.bincount(inverse, minlength=len(keys))
+            meanScores = np.column_stack([np.bincount(inverse, weights=scores2D[:, iCol], minlength=len(keys))
+                                          / counts for iCol in range(scores2D.shape[1])])
+            self.levels[-1]['keys'] = keys
+            self.levels[-1]['scores'] = self.QuantiseScores(meanScores if scores.ndim == 2 else meanScores[:, 0])
+        self.fallbackCode = 0 if self.fallback is None else self.QuantiseScores(np.array([self.fallback]))[0]
+
+        return self
+
+    def QuantiseScores(self, scores):
+        '''
+        Helper method to quantise the scores in the range of the building sample
+        '''
+        maxCode = (1 << self.nBits) - 1
+        low, high = self.scoreRange
+        scale = maxCode / (high - low) if high > low else 0.
+        codes = np.rint((np.clip(scores, low, high) - low) * scale)
+        return codes.astype(lookupTableBits[self.nBits])
+
+    def FindCells(self, data, level=0):
+        '''
+        Method to find the cells of the candidates in one level of the table
+
+        Arguments
+        ----------
+        - pandas dataframe or numpy array with the features
+        - level of the table
+
+        Returns
+        ----------
+        - numpy array with the index of the cells in the table
+        - boolean numpy array, False for the candidates in cells not populated
+        '''
+        tableKeys = self.levels[level]['keys']
+        keys = self.GetKeys(data, level)
+        idx = np.minimum(np.searchsorted(tableKeys, keys), max(len(tableKeys) - 1, 0))
+        found = tableKeys[idx] == keys if len(tableKeys) > 0 else np.zeros(len(keys), dtype=bool)
+        return idx, found
+
+    def PredictQuantised(self, data):
+        '''
+        Method to get the quantised scores of the candidates
+
+        Arguments
+        ----------
+        - pandas dataframe or numpy array with the features
+
+        Returns
+        ----------
+        - numpy array of uint8 or uint16 scores
+        '''
+        inputs = self.GetInputArray(data)
+        scoreShape = self.levels[0]['scores'].shape[1:]
+        codes = np.full((len(inputs),) + scoreShape, self.fallbackCode, dtype=lookupTableBits[self.nBits])
+        missing = np.arange(len(inputs))
+        for level in range(len(self.levels)):
+            idx, found = self.FindCells(inputs[missing], level)
+            codes[missing[found]] = self.levels[level]['scores'][idx[found]]
+            missing = missing[~found]
+            if len(missing) == 0:
+                break
+        return codes
+
+    def Predict(self, data):
+        '''
+        Method to get the scores of the candidates, in the same units as the scores of the full model
+
+        Arguments
+        ----------
+        - pandas dataframe or numpy array with the features
+
+        Returns
+        ----------
+        - numpy array of float32 scores
+        '''
+        low, high = self.scoreRange
+        maxCode = (1 << self.nBits) - 1
+        return (low + self.PredictQuantised(data).astype(np.float32) * np.float32((high - low) / maxCode))
+
+    def GetTableSize(self):
+        '''
+        Method to get the size of the table
+
+        Returns
+        ----------
+        - size in bytes of the keys, scores and bin edges of all the levels
+        '''
+        return sum(level['keys'].nbytes + level['scores'].nbytes + sum(edges.nbytes for edges in level['edges'])
+                   for level in self.levels)
+
+    def Save(self, outDir):
+        '''
+        Method to save the table in a directory: keys and scores of each level as .npy files
+        (to be memory mapped) and the bin edges and settings as JSON
+
+        Arguments
+        ----------
+        - output directory
+        '''
+        os.makedirs(outDir, exist_ok=True)
+        for iLevel, level in enumerate(self.levels):
+            np.save(os.path.join(outDir, f'keys_{iLevel}.npy'), level['keys'])
+            np.save(os.path.join(outDir, f'scores_{iLevel}.npy'), level['scores'])
+        with open(os.path.join(outDir, 'table.json'), 'w') as outFile:
+            json.dump({'features': self.features, 'nbins': self.nBins, 'nbits': self.nBits,
+                       'nlevels': len(self.levels), 'fallback': self.fallback,
+                       'fallback_code': int(self.fallbackCode), 'score_range': list(self.scoreRange),
+                       'edges': [[edges.tolist() for edges in level['edges']] for level in self.levels]},
+                      outFile, indent=1)
+
+
+def GetStrides(edges):
+    '''
+    Helper method to get the strides of the features in the keys of the cells
+
+    Arguments
+    ----------
+    - list with the bin edges of each feature
+
+    Returns
+    ----------
+    - numpy array of uint64 strides
+    '''
+    # bins below the first edge, between the edges, above the last edge and for missing values
+    binsPerFeature = [len(featEdges) + 2 for featEdges in edges]
+    if np.sum(np.log2(binsPerFeature)) >= 64:
+        raise ValueError('too many cells for 64-bit keys, reduce the number of bins')
+    return np.cumprod([1] + binsPerFeature[:-1]).astype(np.uint64)
+
+
+def LoadLookupTable(inDir, mmap=True):
+    '''
+    Method to load a table saved with QuantileLookupClassifier.Save
+
+    Arguments
+    ----------
+    - input directory
+    - if True, the keys and scores are memory mapped instead of read
+
+    Returns
+    ----------
+    - QuantileLookupClassifier
+    '''
+    with open(os.path.join(inDir, 'table.json')) as inFile:
+        meta = json.load(inFile)
+    lut = QuantileLookupClassifier(meta['nbins'], meta['nbits'], meta['nlevels'], meta['fallback'])
+    lut.features = meta['features']
+    lut.scoreRange = tuple(meta['score_range'])
+    lut.fallbackCode = meta['fallback_code']
+    mmapMode = 'r' if mmap else None
+    for iLevel, levelEdges in enumerate(meta['edges']):
+        edges = [np.asarray(featEdges, dtype=np.float32) for featEdges in levelEdges]
+        lut.levels.append({'edges': edges, 'strides': GetStrides(edges),
+                           'keys': np.load(os.path.join(inDir, f'keys_{iLevel}.npy'), mmap_mode=mmapMode),
+                           'scores': np.load(os.path.join(inDir, f'scores_{iLevel}.npy'), mmap_mode=mmapMode)})
+
+    return lut
+
+
+def BuildLookupTable(modelHdl, data, nBins=16, nBits=8, nLevels=3, fallback=None, outputMargin=False):
+    '''
+    Method to build a lookup table from a trained hipe4ml ModelHandler (or from a
+    pyutils.TreeEnsemble)
+
+    Arguments
+    ----------
+    - model handler
+    - pandas dataframe with the candidates used to populate the table
+    - number of quantile bins per feature
+    - number of bits of the quantised scores
+    - number of levels of the table
+    - score of the candidates not found at any level
+    - if True the raw scores are used
+
+    Returns
+    ----------
+    - QuantileLookupClassifier
+    '''
+    if hasattr(modelHdl, 'get_training_columns'):
+        features = modelHdl.get_training_columns()
+        scores = modelHdl.predict(data, outputMargin)
+    else:
+        features = modelHdl.featureNames
+        scores = modelHdl.Predict(data, outputMargin)
+    lut = QuantileLookupClassifier(nBins, nBits, nLevels, fallback)
+
+    return lut.Fit(data, scores, features)
+
+
+def GetLookupTableReport(lut, data, labels, refScores):
+    '''
+    Method to compare a lookup table with the full model on a test sample
+
+    Arguments
+    ----------
+    - QuantileLookupClassifier
+    - pandas dataframe or numpy array with the features of the test sample
+    - numpy array with the labels (class indices)
+    - numpy array with the scores of the full model (one or two dimensional)
+
+    Returns
+    ----------
+    - dictionary with the table size (bytes), the number of cells, the fraction of test
+      candidates in populated cells at each level, the AUC of the full model and of the table for each
+      class (one vs rest, only the signal for binary models) and the maximum AUC loss
+    '''
+    lutScores = lut.Predict(data)
+    refScores = np.asarray(refScores)
+    labels = np.asarray(labels)
+    report = {'table_size': lut.GetTableSize(), 'n_cells': sum(len(level['keys']) for level in lut.levels)}
+    # fraction of candidates found at each level
+    for iLevel in range(len(lut.levels)):
+        report[f'found_fraction_{iLevel}'] = float(np.mean(lut.FindCells(data, iLevel)[1]))
+    classes = range(refScores.shape[1]) if refScores.ndim == 2 else [1]
+    aucLosses = []
+    for iClass in classes:
+        isClass = labels == iClass
+        aucRef = GetRocAuc(isClass, refScores[:, iClass] if refScores.ndim == 2 else refScores)
+        aucLut = GetRocAuc(isClass, lutScores[:, iClass] if lutScores.ndim == 2 else lutScores)
+        report[f'auc_ref_{iClass}'] = aucRef
+        report[f'auc_lut_{iClass}'] = aucLut
+        aucLosses.append(aucRef - aucLut)
+    report['max_auc_loss'] = float(np.nanmax(aucLosses)) if aucLosses else np.nan
+
+    return report
@@ -2,11 +2,7 @@
 Script with helper methods for style settings
 '''
 
-from ROOT import gStyle, gROOT, TGaxis # pylint: disable=import-error,no-name-in-module
-from ROOT import kBlack, kWhite, kGray, kRed, kBlue, kGreen # pylint: disable=import-error,no-name-in-module
-from ROOT import kMagenta, kAzure, kCyan, kOrange, kYellow, kSpring, kTeal, kViolet, kPink # pylint: disable=import-error,no-name-in-module
-from ROOT import kFullCircle, kFullSquare, kFullDiamond, kFullCross, kFullTriangleUp, kFullTriangleDown # pylint: disable=import-error,no-name-in-module
-from ROOT import kOpenCircle, kOpenSquare, kOpenDiamond, kOpenCross, kOpenTriangleUp, kOpenTriangleDown # pylint: disable=import-error,no-name-in-module
+from pyutils.LazyROOT import ROOT
 
 # pylint: disable=too-many-branches, too-many-statements
 def SetGlobalStyle(**kwargs):
@@ -49,94 +45,94 @@ def SetGlobalStyle(**kwargs):
 
     # pad margins
     if 'padrightmargin' in kwargs:
-        gStyle.SetPadRightMargin(kwargs['padrightmargin'])
+        ROOT.gStyle.SetPadRightMargin(kwargs['padrightmargin'])
     else:
-        gStyle.SetPadRightMargin(0.035)
+        ROOT.gStyle.SetPadRightMargin(0.035)
 
     if 'padleftmargin' in kwargs:
-        gStyle.SetPadLeftMargin(kwargs['padleftmargin'])
+        ROOT.gStyle.SetPadLeftMargin(kwargs['padleftmargin'])
     else:
-        gStyle.SetPadLeftMargin(0.12)
+        ROOT.gStyle.SetPadLeftMargin(0.12)
 
     if 'padtopmargin' in kwargs:
-        gStyle.SetPadTopMargin(kwargs['padtopmargin'])
+        ROOT.gStyle.SetPadTopMargin(kwargs['padtopmargin'])
     else:
-        gStyle.SetPadTopMargin(0.035)
+        ROOT.gStyle.SetPadTopMargin(0.035)
 
     if 'padbottommargin' in kwargs:
-        gStyle.SetPadBottomMargin(kwargs['padbottommargin'])
+        ROOT.gStyle.SetPadBottomMargin(kwargs['padbottommargin'])
     else:
-        gStyle.SetPadBottomMargin(0.1)
+        ROOT.gStyle.SetPadBottomMargin(0.1)
 
     # title sizes
     if 'titlesize' in kwargs:
-        gStyle.SetTitleSize(kwargs['titlesize'], 'xyz')
+        ROOT.gStyle.SetTitleSize(kwargs['titlesize'], 'xyz')
     else:
-        gStyle.SetTitleSize(0.050, 'xyz')
+        ROOT.gStyle.SetTitleSize(0.050, 'xyz')
 
     if 'titlesizex' in kwargs:
-        gStyle.SetTitleSize(kwargs['titlesizex'], 'x')
+        ROOT.gStyle.SetTitleSize(kwargs['titlesizex'], 'x')
     if 'titlesizey' in kwargs:
-        gStyle.SetTitleSize(kwargs['titlesizex'], 'y')
+        ROOT.gStyle.SetTitleSize(kwargs['titlesizex'], 'y')
     if 'titlesizez' in kwargs:
-        gStyle.SetTitleSize(kwargs['titlesizex'], 'z')
+        ROOT.gStyle.SetTitleSize(kwargs['titlesizex'], 'z')
 
     # label sizes
     if 'labelsize' in kwargs:
-        gStyle.SetLabelSize(kwargs['labelsize'], 'xyz')
+        ROOT.gStyle.SetLabelSize(kwargs['labelsize'], 'xyz')
     else:
-        gStyle.SetLabelSize(0.045, 'xyz')
+        ROOT.gStyle.SetLabelSize(0.045, 'xyz')
 
     if 'labelsizex' in kwargs:
-        gStyle.SetLabelSize(kwargs['labelsizex'], 'x')
+        ROOT.gStyle.SetLabelSize(kwargs['labelsizex'], 'x')
     if 'labelsizey' in kwargs:
-        gStyle.SetLabelSize(kwargs['labelsizex'], 'y')
+        ROOT.gStyle.SetLabelSize(kwargs['labelsizex'], 'y')
     if 'labelsizez' in kwargs:
-        gStyle.SetLabelSize(kwargs['labelsizex'], 'z')
+        ROOT.gStyle.SetLabelSize(kwargs['labelsizex'], 'z')
 
     # title offsets
     if 'titleoffset' in kwargs:
-        gStyle.SetTitleOffset(kwargs['titleoffset'], 'xyz')
+        ROOT.gStyle.SetTitleOffset(kwargs['titleoffset'], 'xyz')
     else:
-        gStyle.SetTitleOffset(1.2, 'xyz')
+        ROOT.gStyle.SetTitleOffset(1.2, 'xyz')
 
     if 'titleoffsetx' in kwargs:
-        gStyle.SetTitleOffset(kwargs['titleoffsetx'], 'x')
+        ROOT.gStyle.SetTitleOffset(kwargs['titleoffsetx'], 'x')
     if 'titleoffsety' in kwargs:
-        gStyle.SetTitleOffset(kwargs['titleoffsety'], 'y')
+        ROOT.gStyle.SetTitleOffset(kwargs['titleoffsety'], 'y')
     if 'titleoffsetz' in kwargs:
-        gStyle.SetTitleOffset(kwargs['titleoffsetz'], 'z')
+        ROOT.gStyle.SetTitleOffset(kwargs['titleoffsetz'], 'z')
 
     # other options
     if 'opttitle' in kwargs:
-        gStyle.SetOptTitle(kwargs['opttitle'])
+        ROOT.gStyle.SetOptTitle(kwargs['opttitle'])
     else:
-        gStyle.SetOptTitle(0)
+        ROOT.gStyle.SetOptTitle(0)
 
     if 'optstat' in kwargs:
-        gStyle.SetOptStat(kwargs['optstat'])
+        ROOT.gStyle.SetOptStat(kwargs['optstat'])
     else:
-        gStyle.SetOptStat(0)
+        ROOT.gStyle.SetOptStat(0)
 
     if 'padtickx' in kwargs:
-        gStyle.SetPadTickX(kwargs['padtickx'])
+        ROOT.gStyle.SetPadTickX(kwargs['padtickx'])
     else:
-        gStyle.SetPadTickX(1)
+        ROOT.gStyle.SetPadTickX(1)
 
     if 'padticky' in kwargs:
-        gStyle.SetPadTickY(kwargs['padticky'])
+        ROOT.gStyle.SetPadTickY(kwargs['padticky'])
     else:
-        gStyle.SetPadTickY(1)
+        ROOT.gStyle.SetPadTickY(1)
 
-    gStyle.SetLegendBorderSize(0)
+    ROOT.gStyle.SetLegendBorderSize(0)
 
     if 'maxdigits' in kwargs:
-        TGaxis.SetMaxDigits(kwargs['maxdigits'])
+        ROOT.TGaxis.SetMaxDigits(kwargs['maxdigits'])
 
     if 'palette' in kwargs:
-        gStyle.SetPalette(kwargs['palette'])
+        ROOT.gStyle.SetPalette(kwargs['palette'])
 
-    gROOT.ForceStyle()
+    ROOT.gROOT.ForceStyle()
 
 
 def SetObjectStyle(obj, **kwargs):
@@ -305,11 +301,11 @@ def GetROOTColor(color='kBlack'):
     - ROOT color corresponding to input color
 
     '''
-    cMapROOT = {'kBlack': kBlack, 'kWhite': kWhite, 'kGrey': kGray,
-                'kRed': kRed, 'kBlue': kBlue, 'kGreen': kGreen,
-                'kTeal': kTeal, 'kAzure': kAzure, 'kCyan': kCyan,
-                'kOrange': kOrange, 'kYellow': kYellow, 'kSpring': kSpring,
-                'kMagenta': kMagenta, 'kViolet': kViolet, 'kPink': kPink}
+    cMapROOT = {'kBlack': ROOT.kBlack, 'kWhite': ROOT.kWhite, 'kGrey': ROOT.kGray,
+                'kRed': ROOT.kRed, 'kBlue': ROOT.kBlue, 'kGreen': ROOT.kGreen,
+                'kTeal': ROOT.kTeal, 'kAzure': ROOT.kAzure, 'kCyan': ROOT.kCyan,
+                'kOrange': ROOT.kOrange, 'kYellow': ROOT.kYellow, 'kSpring': ROOT.kSpring,
+                'kMagenta': ROOT.kMagenta, 'kViolet': ROOT.kViolet, 'kPink': ROOT.kPink}
 
     ROOTcolor = None
     for colorKey in cMapROOT:
@@ -343,10 +339,10 @@ def GetROOTMarker(marker='kFullCircle'):
     - ROOT color corresponding to input color
 
     '''
-    mMapROOT = {'kFullCircle': kFullCircle, 'kFullSquare': kFullSquare, 'kFullDiamond': kFullDiamond,
-                'kFullCross': kFullCross, 'kFullTriangleUp': kFullTriangleUp, 'kFullTriangleDown': kFullTriangleDown,
-                'kOpenCircle': kOpenCircle, 'kOpenSquare': kOpenSquare, 'kOpenDiamond': kOpenDiamond,
-                'kOpenCross': kOpenCross, 'kOpenTriangleUp': kOpenTriangleUp, 'kOpenTriangleDown': kOpenTriangleDown}
+    mMapROOT = {'kFullCircle': ROOT.kFullCircle, 'kFullSquare': ROOT.kFullSquare, 'kFullDiamond': ROOT.kFullDiamond,
+                'kFullCross': ROOT.kFullCross, 'kFullTriangleUp': ROOT.kFullTriangleUp, 'kFullTriangleDown': ROOT.kFullTriangleDown,
+                'kOpenCircle': ROOT.kOpenCircle, 'kOpenSquare': ROOT.kOpenSquare, 'kOpenDiamond': ROOT.kOpenDiamond,
+                'kOpenCross': ROOT.kOpenCross, 'kOpenTriangleUp': ROOT.kOpenTriangleUp, 'kOpenTriangleDown': ROOT.kOpenTriangleDown}
 
     if marker in mMapROOT:
         ROOTmarker = mMapROOT.get(marker)
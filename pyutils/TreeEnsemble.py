@@ -0,0 +1,498 @@
+'''
+Module with a dependency-free (numpy only) evaluator of tree ensembles saved in the
+xgboost JSON format (booster.save_model('model.json')), to apply the trigger BDTs
+without importing xgboost or unpickling the hipe4ml ModelHandler
+'''
+
+import os
+import copy
+import json
+import numpy as np
+import pandas as pd
+
+# number of (candidate, tree) pairs traversed at once, to bound the memory usage
+treeEnsembleBlockSize = 1 << 22
+
+
+def ParseBaseScore(baseScore):
+    '''
+    Helper method to parse the base score of the xgboost JSON format, saved as a
+    string with a scalar ('5E-1') or a vector ('[5E-1]') in recent versions
+
+    Arguments
+    ----------
+    - base score as string
+
+    Returns
+    ----------
+    - numpy array of base scores (one element or one per class)
+    '''
+    return np.array([float(val) for val in baseScore.strip('[]').split(',') if val.strip()], dtype=np.float64)
+
+
+class TreeEnsemble:
+    '''
+    Tree ensemble stored as flat node arrays concatenated over the trees: split feature,
+    threshold, left and right children (global indices), default direction for missing
+    values and leaf value. Leaves point to themselves, so that all the trees can be
+    traversed level by level in parallel for a number of steps equal to the maximum depth
+
+    Arguments
+    ----------
+    - dictionary with the xgboost JSON model (content of booster.save_model('model.json')),
+      empty ensemble to be filled (e.g. by LoadCompactModel) if None
+    '''
+
+    def __init__(self, model=None):
+        self.leafScale = None
+        if model is None:
+            return
+        learner = model['learner']
+        booster = learner['gradient_booster']
+        if booster['name'] == 'dart':
+            treeWeights = np.asarray(booster['weight_drop'], dtype=np.float32)
+            booster = booster['gbtree']
+        elif booster['name'] == 'gbtree':
+            treeWeights = None
+        else:
+            raise ValueError(f'booster {booster["name"]} not supported, options: gbtree, dart')
+        trees = booster['model']['trees']
+        modelParams = learner['learner_model_param']
+        self.objective = learner['objective']['name']
+        self.nClasses = max(int(modelParams.get('num_class', '0')), 1)
+        self.nFeatures = int(modelParams['num_feature'])
+        self.featureNames = learner.get('feature_names') or None
+        self.treeClass = np.asarray(booster['model'].get('tree_info', [0] * len(trees)), dtype=np.int64)
+
+        features, thresholds, lefts, rights, defaultLefts, values, roots, depths = ([] for _ in range(8))
+        offset = 0
+        for iTree, tree in enumerate(trees):
+            left = np.asarray(tree['left_children'], dtype=np.int32)
+            right = np.asarray(tree['right_children'], dtype=np.int32)
+            isLeaf = left == -1
+            nodeIds = np.arange(len(left), dtype=np.int32)
+            cond = np.asarray(tree['split_conditions'], dtype=np.float32)
+            features.append(np.where(isLeaf, 0, np.asarray(tree['split_indices'], dtype=np.int32)))
+            thresholds.append(np.where(isLeaf, np.float32(0.), cond))
+            lefts.append(np.where(isLeaf, nodeIds, left) + offset)
+            rights.append(np.where(isLeaf, nodeIds, right) + offset)
+            defaultLefts.append(np.asarray(tree['default_left'], dtype=bool))
+            # the leaf values are stored in the split conditions of the leaves
+            leafValues = np.where(isLeaf, cond, np.float32(0.))
+            if treeWeights is not None:
+                leafValues = leafValues * treeWeights[iTree]
+            values.append(leafValues.astype(np.float32))
+            roots.append(offset)
+            depths.append(GetTreeDepth(left, right))
+            offset += len(left)
+
+        self.feature = np.concatenate(features) if trees else np.zeros(0, dtype=np.int32)
+        self.threshold = np.concatenate(thresholds) if trees else np.zeros(0, dtype=np.float32)
+        self.left = np.concatenate(lefts) if trees else np.zeros(0, dtype=np.int32)
+        self.right = np.concatenate(rights) if trees else np.zeros(0, dtype=np.int32)
+        self.defaultLeft = np.concatenate(defaultLefts) if trees else np.zeros(0, dtype=bool)
+        self.value = np.concatenate(values) if trees else np.zeros(0, dtype=np.float32)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.treeDepths = np.asarray(depths, dtype=np.int32)
+        self.maxDepth = max(depths, default=0)
+
+        baseScore = ParseBaseScore(modelParams.get('base_score', '0.5'))
+        # the base score is saved as probability for the logistic objectives
+        if self.objective in ('binary:logistic', 'reg:logistic'):
+            baseScore = np.log(baseScore / (1. - baseScore))
+        self.baseMargin = np.broadcast_to(baseScore, (self.nClasses,)).astype(np.float64)
+
+    def GetInputArray(self, data):
+        '''
+        Method to get the float32 feature matrix, the columns of pandas dataframes are
+        selected and ordered by name if the feature names are stored in the model
+
+        Arguments
+        ----------
+        - pandas dataframe or numpy array with the features
+
+        Returns
+        ----------
+        - float32 numpy array (candidates, features)
+        '''
+        if isinstance(data, pd.DataFrame) and self.featureNames is not None:
+            data = data[self.featureNames]
+        inputs = np.ascontiguousarray(data, dtype=np.float32)
+        if inputs.ndim != 2 or inputs.shape[1] != self.nFeatures:
+            raise ValueError(f'input with shape {inputs.shape}, expected (n, {self.nFeatures})')
+        return inputs
+
+    def GetLeaves(self, inputs, roots):
+        '''
+        Method to traverse the trees level by level for a block of candidates
+
+        Arguments
+        ----------
+        - float32 numpy array (candidates, features)
+        - numpy array with the global index of the roots of the trees to be traversed
+
+        Returns
+        ----------
+        - numpy array (candidates, trees) with the global index of the reached leaves
+        '''
+        nodes = np.broadcast_to(roots, (len(inputs), len(roots))).copy()
+        rows = np.arange(len(inputs))[:, None]
+        for _ in range(self.maxDepth):
+            featValues = inputs[rows, self.feature[nodes]]
+            # xgboost goes left if value < threshold, missing values follow the default direction
+            goLeft = np.where(np.isnan(featValues), self.defaultLeft[nodes], featValues < self.threshold[nodes])
+            nodes = np.where(goLeft, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def PredictMargin(self, data, nTrees=None):
+        '''
+        Method to compute the raw scores (margins) of the candidates
+
+        Arguments
+        ----------
+        - pandas dataframe or numpy array with the features
+        - number of trees (per class) to be used, all if None
+
+        Returns
+        ----------
+        - numpy array (candidates, classes) with the margins
+        '''
+        inputs = self.GetInputArray(data)
+        nUsedTrees = len(self.roots) if nTrees is None else min(nTrees * self.nClasses, len(self.roots))
+        treeClass = self.treeClass[:nUsedTrees]
+        classMatrix = np.zeros((nUsedTrees, self.nClasses), dtype=np.float64)
+        classMatrix[np.arange(nUsedTrees), treeClass] = 1.
+        margins = np.empty((len(inputs), self.nClasses), dtype=np.float64)
+        blockSize = max(treeEnsembleBlockSize // max(nUsedTrees, 1), 1)
+        for start in range(0, len(inputs), blockSize):
+            leaves = self.GetLeaves(inputs[start:start + blockSize], self.roots[:nUsedTrees])
+            margins[start:start + blockSize] = self.value[leaves] @ classMatrix
+        return margins + self.baseMargin
+
+    def PredictProba(self, data, nTrees=None):
+        '''
+        Method to compute the scores of the candidates as in XGBClassifier.predict_proba
+
+        Arguments
+        ----------
+        - pandas dataframe or numpy array with the features
+        - number of trees (per class) to be used, all if None
+
+        Returns
+        ----------
+        - numpy array (candidates, classes) with the probabilities, with two columns
+          (1 - p, p) for binary classifiers
+        '''
+        margins = self.PredictMargin(data, nTrees)
+        if self.objective.startswith('multi:'):
+            expMargins = np.exp(margins - margins.max(axis=1, keepdims=True))
+            return expMargins / expMargins.sum(axis=1, keepdims=True)
+        if self.objective in ('binary:logistic', 'reg:logistic'):
+            probs = 1. / (1. + np.exp(-margins[:, 0]))
+            return np.column_stack((1. - probs, probs))
+        return margins
+
+    def Predict(self, data, outputMargin=True, nTrees=None):
+        '''
+        Method to compute the scores of the candidates as in hipe4ml ModelHandler.predict
+
+        Arguments
+        ----------
+        - pandas dataframe or numpy array with the features
+        - if True the raw scores are returned, otherwise the probabilities
+        - number of trees (per class) to be used, all if None
+
+        Returns
+        ----------
+        - numpy array with the scores, one dimensional for binary classifiers
+        '''
+        scores = self.PredictMargin(data, nTrees) if outputMargin else self.PredictProba(data, nTrees)
+        if self.nClasses == 1:
+            return scores[:, -1]
+        return scores
+
+
+def GetTreeDepth(left, right):
+    '''
+    Helper method to get the depth of a tree from its children arrays
+
+    Arguments
+    ----------
+    - numpy array with the left children (-1 for leaves)
+    - numpy array with the right children
+
+    Returns
+    ----------
+    - maximum depth of the tree (0 for a single leaf)
+    '''
+    depth = np.zeros(len(left), dtype=np.int32)
+    # children always have a larger index than their parent in the xgboost format
+    for node in range(len(left)):
+        if left[node] != -1:
+            depth[left[node]] = depth[node] + 1
+            depth[right[node]] = depth[node] + 1
+    return int(depth.max()) if len(depth) > 0 else 0
+
+
+def LoadTreeEnsemble(fileName):
+    '''
+    Method to load a tree ensemble saved in the xgboost JSON format
+
+    Arguments
+    ----------
+    - name of the JSON file
+
+    Returns
+    ----------
+    - TreeEnsemble
+    '''
+    with open(fileName) as inFile:
+        return TreeEnsemble(json.load(inFile))
+
+
+def DumpModelHandlerJson(modelHandlerFileName, jsonFileName):
+    '''
+    Method to convert a pickled hipe4ml ModelHandler with an xgboost model to the
+    xgboost JSON format (requires hipe4ml and xgboost)
+
+    Arguments
+    ----------
+    - name of the ModelHandler pickle file
+    - name of the output JSON file
+    '''
+    from hipe4ml.model_handler import ModelHandler  # pylint: disable=import-outside-toplevel
+    modelHdl = ModelHandler()
+    modelHdl.load_model_handler(modelHandlerFileName)
+    modelHdl.get_original_model().get_booster().save_model(jsonFileName)
+
+
+def SelectTrees(ensemble, treeIdx, values=None):
+    '''
+    Method to build a new ensemble with a subset of the trees
+
+    Arguments
+    ----------
+    - TreeEnsemble
+    - list of indices of the trees to be kept
+    - optional list of arrays with the new leaf values of each kept tree
+
+    Returns
+    ----------
+    - TreeEnsemble
+    '''
+    bounds = np.append(ensemble.roots, len(ensemble.feature))
+    arrays = {name: [] for name in ('feature', 'threshold', 'left', 'right', 'defaultLeft', 'value')}
+    roots = []
+    offset = 0
+    for iSel, iTree in enumerate(treeIdx):
+        nodes = slice(bounds[iTree], bounds[iTree + 1])
+        for name in ('feature', 'threshold', 'defaultLeft'):
+            arrays[name].append(getattr(ensemble, name)[nodes])
+        arrays['left'].append(ensemble.left[nodes] - bounds[iTree] + offset)
+        arrays['right'].append(ensemble.right[nodes] - bounds[iTree] + offset)
+        arrays['value'].append(ensemble.value[nodes] if values is None else np.asarray(values[iSel], dtype=np.float32))
+        roots.append(offset)
+        offset += bounds[iTree + 1] - bounds[iTree]
+
+    compact = copy.copy(ensemble)
+    for name, arrayList in arrays.items():
+        setattr(compact, name, np.concatenate(arrayList) if arrayList else getattr(ensemble, name)[:0])
+    compact.roots = np.asarray(roots, dtype=np.int32)
+    compact.treeClass = ensemble.treeClass[list(treeIdx)]
+    compact.treeDepths = ensemble.treeDepths[list(treeIdx)]
+    compact.maxDepth = int(compact.treeDepths.max()) if len(compact.treeDepths) > 0 else 0
+
+    return compact
+
+
+def TruncateEnsemble(ensemble, nTrees):
+    '''
+    Method to keep the first boosting rounds of an ensemble
+
+    Arguments
+    ----------
+    - TreeEnsemble
+    - number of trees (per class) to be kept
+
+    Returns
+    ----------
+    - TreeEnsemble
+    '''
+    return SelectTrees(ensemble, range(min(nTrees * ensemble.nClasses, len(ensemble.roots))))
+
+
+def MergeIdenticalTrees(ensemble):
+    '''
+    Method to merge the trees of the same class with identical splits (same features,
+    thresholds and default directions), whose leaf values can be summed. Shallow trees
+    on few features, in particular after the quantisation of the thresholds, are often
+    repeated along the boosting rounds
+
+    Arguments
+    ----------
+    - TreeEnsemble
+
+    Returns
+    ----------
+    - TreeEnsemble with the same scores and at most the same number of trees
+    '''
+    bounds = np.append(ensemble.roots, len(ensemble.feature))
+    groups = {}
+    for iTree in range(len(ensemble.roots)):
+        nodes = slice(bounds[iTree], bounds[iTree + 1])
+        left = ensemble.left[nodes] - bounds[iTree]
+        isLeaf = left == np.arange(len(left))
+        structure = (int(ensemble.treeClass[iTree]), left.tobytes(), (ensemble.right[nodes] - bounds[iTree]).tobytes(),
+                     ensemble.feature[nodes].tobytes(), np.where(isLeaf, np.float32(0.), ensemble.threshold[nodes]).tobytes(),
+                     np.where(isLeaf, False, ensemble.defaultLeft[nodes]).tobytes())
+        groups.setdefault(structure, []).append(iTree)
+
+    treeIdx, values = [], []
+    for trees in groups.values():
+        treeIdx.append(trees[0])
+        values.append(np.sum([ensemble.value[bounds[iTree]:bounds[iTree + 1]].astype(np.float64)
+                              for iTree in trees], axis=0))
+
+    return SelectTrees(ensemble, treeIdx, values)
+
+
+def QuantiseThresholds(ensemble, nBits=8):
+    '''
+    Method to limit the number of distinct thresholds of each feature to 2^nBits, snapping
+    each threshold to the nearest of the quantiles of the thresholds of the feature
+
+    Arguments
+    ----------
+    - TreeEnsemble
+    - number of bits of the threshold index of each feature
+
+    Returns
+    ----------
+    - TreeEnsemble
+    '''
+    compact = copy.copy(ensemble)
+    compact.threshold = ensemble.threshold.copy()
+    isSplit = ensemble.left != np.arange(len(ensemble.left))
+    for feat in np.unique(ensemble.feature[isSplit]):
+        nodes = np.flatnonzero(isSplit & (ensemble.feature == feat))
+        uniqueThresholds = np.unique(ensemble.threshold[nodes])
+        if len(uniqueThresholds) <= 1 << nBits:
+            continue
+        grid = np.unique(np.quantile(uniqueThresholds, np.linspace(0., 1., 1 << nBits)).astype(np.float32))
+        idx = np.clip(np.searchsorted(grid, ensemble.threshold[nodes]), 1, len(grid) - 1)
+        lower, upper = grid[idx - 1], grid[idx]
+        compact.threshold[nodes] = np.where(ensemble.threshold[nodes] - lower <= upper - ensemble.threshold[nodes],
+                                            lower, upper)
+
+    return compact
+
+
+def QuantiseLeaves(ensemble, nBits=8):
+    '''
+    Method to quantise the leaf values to signed nBits integers with a common scale
+
+    Arguments
+    ----------
+    - TreeEnsemble
+    - number of bits of the leaf values (8 or 16)
+
+    Returns
+    ----------
+    - TreeEnsemble, with the scale in leafScale
+    '''
+    maxCode = (1 << (nBits - 1)) - 1
+    maxValue = float(np.max(np.abs(ensemble.value))) if len(ensemble.value) > 0 else 0.
+    compact = copy.copy(ensemble)
+    compact.leafScale = maxValue / maxCode if maxValue > 0 else 1.
+    compact.value = np.rint(ensemble.value / compact.leafScale).astype(np.float32) * np.float32(compact.leafScale)
+
+    return compact
+
+
+def GetSmallestUIntType(maxValue):
+    '''
+    Helper method to get the smallest unsigned integer type for values up to maxValue
+    '''
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if maxValue <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def SaveCompactModel(ensemble, fileName):
+    '''
+    Method to save an ensemble in a compact npz file: node indices, features and threshold
+    indices in the smallest unsigned integer types, distinct thresholds stored once and
+    leaf values as integers if quantised with QuantiseLeaves
+
+    Arguments
+    ----------
+    - TreeEnsemble
+    - name of the output npz file
+
+    Returns
+    ----------
+    - size of the file in bytes
+    '''
+    nNodes = len(ensemble.feature)
+    thresholdValues, thresholdIdx = np.unique(ensemble.threshold, return_inverse=True)
+    arrays = {'feature': ensemble.feature.astype(GetSmallestUIntType(max(ensemble.nFeatures - 1, 0))),
+              'threshold_values': thresholdValues.astype(np.float32),
+              'threshold_index': thresholdIdx.astype(GetSmallestUIntType(max(len(thresholdValues) - 1, 0))),
+              'left': ensemble.left.astype(GetSmallestUIntType(max(nNodes - 1, 0))),
+              'right': ensemble.right.astype(GetSmallestUIntType(max(nNodes - 1, 0))),
+              'default_left': np.packbits(ensemble.defaultLeft),
+              'roots': ensemble.roots, 'tree_class': ensemble.treeClass.astype(np.uint16),
+              'tree_depths': ensemble.treeDepths.astype(np.uint8), 'base_margin': ensemble.baseMargin,
+              'meta': np.array(json.dumps({'objective': ensemble.objective, 'n_classes': ensemble.nClasses,
+                                           'n_features': ensemble.nFeatures, 'n_nodes': nNodes,
+                                           'feature_names': ensemble.featureNames,
+                                           'leaf_scale': ensemble.leafScale}))}
+    if ensemble.leafScale is not None:
+        codes = np.rint(ensemble.value / np.float32(ensemble.leafScale))
+        maxCode = np.max(np.abs(codes), initial=0)
+        arrays['value'] = codes.astype(next(dtype for dtype in (np.int8, np.int16, np.int32)
+                                            if maxCode <= np.iinfo(dtype).max))
+    else:
+        arrays['value'] = ensemble.value
+    np.savez_compressed(fileName, **arrays)
+    fileName = fileName if fileName.endswith('.npz') else f'{fileName}.npz'
+
+    return os.path.getsize(fileName)
+
+
+def LoadCompactModel(fileName):
+    '''
+    Method to load an ensemble saved with SaveCompactModel
+
+    Arguments
+    ----------
+    - name of the npz file
+
+    Returns
+    ----------
+    - TreeEnsemble
+    '''
+    ensemble = TreeEnsemble()
+    with np.load(fileName) as npz:
+        meta = json.loads(str(npz['meta']))
+        ensemble.objective = meta['objective']
+        ensemble.nClasses = meta['n_classes']
+        ensemble.nFeatures = meta['n_features']
+        ensemble.featureNames = meta['feature_names']
+        ensemble.leafScale = meta['leaf_scale']
+        ensemble.feature = npz['feature'].astype(np.int32)
+        ensemble.threshold = npz['threshold_values'][npz['threshold_index']]
+        ensemble.left = npz['left'].astype(np.int32)
+        ensemble.right = npz['right'].astype(np.int32)
+        ensemble.defaultLeft = np.unpackbits(npz['default_left'], count=meta['n_nodes']).astype(bool)
+        ensemble.value = npz['value'].astype(np.float32)
+        if ensemble.leafScale is not None:
+            ensemble.value *= np.float32(ensemble.leafScale)
+        ensemble.roots = npz['roots'].astype(np.int32)
+        ensemble.treeClass = npz['tree_class'].astype(np.int64)
+        ensemble.treeDepths = npz['tree_depths'].astype(np.int32)
+        ensemble.maxDepth = int(ensemble.treeDepths.max()) if len(ensemble.treeDepths) > 0 else 0
+        ensemble.baseMargin = npz['base_margin']
+
+    return ensemble
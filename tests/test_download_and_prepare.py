@@ -0,0 +1,49 @@
+'''
+Test of the verification of the parquet outputs in O2/ML/download_and_prepare.py: missing or
+corrupt files must be reported as invalid, not raise
+run: python -m pytest tests/test_download_and_prepare.py or python tests/test_download_and_prepare.py
+'''
+
+import os
+import sys
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'O2', 'ML'))
+sys.path.insert(0, REPO_DIR)
+
+# dependencies of prepare_samples, imported by download_and_prepare
+for dep in ['pyarrow', 'matplotlib', 'uproot', 'alive_progress']:
+    pytest.importorskip(dep)
+
+import pandas as pd  # pylint: disable=wrong-import-position
+from download_and_prepare import verify_outputs  # pylint: disable=wrong-import-position,import-error
+
+
+def test_valid_file(tmp_path):
+    '''
+    a readable parquet file is valid
+    '''
+    fileName = str(tmp_path / 'valid.parquet')
+    pd.DataFrame({'fPT2Prong': [1., 2.]}).to_parquet(fileName)
+    assert verify_outputs([fileName], False)
+
+
+def test_missing_file(tmp_path):
+    '''
+    a missing file (e.g. before the first preparation) is invalid
+    '''
+    assert not verify_outputs([str(tmp_path / 'missing.parquet')], False)
+
+
+def test_corrupt_file(tmp_path):
+    '''
+    a truncated or corrupt file is invalid
+    '''
+    fileName = tmp_path / 'corrupt.parquet'
+    fileName.write_bytes(b'PAR1 not a parquet file')
+    assert not verify_outputs([str(fileName)], False)
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-v']))
@@ -0,0 +1,68 @@
+'''
+Import-time benchmark of the lazy ROOT facade: the modules that only reference ROOT through
+pyutils.LazyROOT must not import PyROOT and must stay fast to import
+run: python -m pytest tests/test_lazy_root.py or python tests/test_lazy_root.py
+'''
+
+import os
+import sys
+import subprocess
+import importlib.util
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# seconds, importing PyROOT alone takes several seconds
+MAX_IMPORT_TIME = {'pyutils.StyleFormatter': 1., 'prepare_samples': 5.}
+
+
+def ImportInSubprocess(module, cwd=REPO_DIR):
+    '''
+    Helper method to import a module in a fresh interpreter with -X importtime
+
+    Arguments
+    ----------
+    - module to be imported
+    - working directory of the interpreter
+
+    Returns
+    ----------
+    - True if ROOT is in sys.modules after the import
+    - total import time in seconds (sum of the top-level cumulative times)
+    '''
+    code = f'import sys; sys.path.insert(0, {REPO_DIR!r}); import {module}; print("ROOT" in sys.modules)'
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd,
+                          capture_output=True, text=True, check=True)
+    importTime = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line.split('|')
+        # nested imports are indented and already included in the cumulative time of the parent
+        if fields[1].strip().isdigit() and not fields[2].startswith('  '):
+            importTime += int(fields[1]) * 1.e-6
+    return proc.stdout.strip().splitlines()[-1] == 'True', importTime
+
+
+def test_style_formatter():
+    '''
+    pyutils.StyleFormatter only touches ROOT when its methods are called
+    '''
+    isROOTLoaded, importTime = ImportInSubprocess('pyutils.StyleFormatter')
+    assert not isROOTLoaded
+    assert importTime < MAX_IMPORT_TIME['pyutils.StyleFormatter']
+
+
+def test_prepare_samples():
+    '''
+    O2/ML/prepare_samples.py loads ROOT only for the DCA smearing
+    '''
+    for dep in ['numpy', 'matplotlib', 'uproot', 'alive_progress']:
+        if importlib.util.find_spec(dep) is None:
+            pytest.skip(f'{dep} not available')
+    isROOTLoaded, importTime = ImportInSubprocess('prepare_samples', os.path.join(REPO_DIR, 'O2', 'ML'))
+    assert not isROOTLoaded
+    assert importTime < MAX_IMPORT_TIME['prepare_samples']
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-v']))